@@ -1,18 +1,33 @@
 """The app module, containing the app factory function."""
 
+import threading
+
 from flask import Flask
-from flask import send_file, request
+from flask import g, send_file, request
 
+from . import passwords
 from .routes import routes, success_response, failure_response
-from .models import db, User
+from .models import db, User, UploadViewer, TimelineEntry
 from .settings import (
     AWS_ACCESS_KEY_ID,
     AWS_SECRET_ACCESS_KEY,
     CF_PUBLIC_KEY_ID,
     CF_PRIVATE_KEY,
     VIEW_DOCS_KEY,
+    METRICS_KEY,
+    CONVERT_RECONCILE_INTERVAL,
+    TOMBSTONE_REAP_INTERVAL,
+    EMAIL_SEND_INTERVAL,
+    VISIBILITY_INDEX,
 )
 from .extensions import db, login_manager, cors
+from .background import PeriodicTask
+from .email import send_queued_emails
+from .querystats import register_query_stats, route_stats
+from .reconciler import reconcile_convert_statuses
+from .schema import upgrade_schema
+from .search import trigrams_available
+from .reaper import reap_tombstones, reaper_stats, tombstone_backlog
 
 
 def create_app(test_config=None):
@@ -22,6 +37,7 @@ def create_app(test_config=None):
     app.config.from_pyfile("settings.py")
     register_extensions(app)
     register_routes(app)
+    register_commands(app)
     return app
 
 
@@ -31,23 +47,31 @@ def register_extensions(app) -> None:
     db.init_app(app)
     with app.app_context():
         db.create_all()
+        app.config["SEARCH_TRIGRAMS"] = trigrams_available()
 
     # CORS
     cors.init_app(app)
 
+    # statement counts and timings of each request
+    register_query_stats(app)
+
     # Flask-Login config and callbacks
     login_manager.init_app(app)
 
     @login_manager.user_loader
     def load_user(user_id):
         # Return user object if user exists or None if DNE
-        user = User.query.filter_by(id=user_id).first()
-        return user
+        return User.load_cached(int(user_id))
 
     @login_manager.unauthorized_handler
     def unauthorized():
         return failure_response("User not authorized.", 401)
 
+    @app.teardown_request
+    def forget_courtships(exc):
+        # relationships cached by User.courtships only live for one request
+        g.pop("courtships", None)
+
 
 def register_routes(app) -> None:
     """Register all blueprints and misc routes."""
@@ -65,6 +89,22 @@ def register_routes(app) -> None:
             return failure_response("Invalid key!", 401)
         return send_file("docs.html")
 
+    @app.route("/internal/metrics")
+    def metrics():
+        key = request.args.get("key")
+        if key != METRICS_KEY:
+            return failure_response("Invalid key!", 401)
+        return success_response(
+            {
+                "routes": route_stats.snapshot(),
+                "password_hashing": passwords.hasher.stats.snapshot(),
+                "reaper": {
+                    **reaper_stats.snapshot(),
+                    "tombstone_backlog": tombstone_backlog(),
+                },
+            }
+        )
+
     # apple token retriever
     @app.route("/appletokenprinter")
     def appletokenprinter():
@@ -72,3 +112,113 @@ def register_routes(app) -> None:
         if key != VIEW_DOCS_KEY:  # same key
             return failure_response("Invalid key!", 401)
         return send_file("applebutton.html")
+
+
+def register_commands(app) -> None:
+    """Register maintenance commands with the flask CLI."""
+
+    @app.cli.command("upgrade-db")
+    def upgrade_db():
+        """Add new columns to existing tables and fill derived data."""
+        for step in upgrade_schema():
+            print(step)
+
+    @app.cli.command("recount-courtships")
+    def recount_courtships():
+        """Recompute every user's friend, coach, and student counts."""
+        User.recount_courtships()
+        db.session.commit()
+
+    @app.cli.command("rebuild-visibility-index")
+    def rebuild_visibility_index():
+        """Recompute the upload visibility index from scratch."""
+        if not VISIBILITY_INDEX:
+            print("VISIBILITY_INDEX is not set, nothing to do.")
+            return
+        UploadViewer.refresh()
+        db.session.commit()
+        print(f"Indexed {UploadViewer.query.count()} upload viewer(s).")
+
+    @app.cli.command("check-visibility-index")
+    def check_visibility_index():
+        """Compare the upload visibility index with the live predicate."""
+        inconsistencies = UploadViewer.find_inconsistencies(User.query.all())
+        for user_id, (missing, extra) in inconsistencies.items():
+            print(f"User {user_id}: missing {missing}, extra {extra}")
+        print(f"{len(inconsistencies)} user(s) with inconsistent visibility.")
+
+    @app.cli.command("backfill-timelines")
+    def backfill_timelines():
+        """Rebuild every user's feed timeline from scratch."""
+        TimelineEntry.refresh()
+        db.session.commit()
+        print(f"Wrote {TimelineEntry.query.count()} timeline entries.")
+
+    @app.cli.command("reconcile-conversions")
+    def reconcile_conversions():
+        """Poll MediaConvert once for every upload that is still converting."""
+        n_changed = reconcile_convert_statuses()
+        print(f"Updated the convert status of {n_changed} upload(s).")
+
+    @app.cli.command("reap-tombstones")
+    def reap():
+        """Delete the S3 objects of removed uploads that are due."""
+        n_reaped = reap_tombstones()
+        print(f"Deleted {n_reaped} upload(s) from S3.")
+        print(f"Reaper stats: {reaper_stats.snapshot()}")
+        print(f"Backlog: {tombstone_backlog()}")
+
+    @app.cli.command("run-workers")
+    def run_workers():
+        """Run the enabled background jobs until interrupted.
+
+        Run this in exactly one process. The web workers never run them.
+        """
+        workers = make_workers(app)
+        if len(workers) == 0:
+            print("No background workers are enabled.")
+            return
+        for worker in workers:
+            worker.start()
+        print(f"Running {', '.join(w.name for w in workers)}.")
+        try:
+            threading.Event().wait()
+        except KeyboardInterrupt:
+            for worker in workers:
+                worker.stop()
+
+    @app.cli.command("send-emails")
+    def send_emails():
+        """Send every queued email that is due."""
+        n_sent = send_queued_emails()
+        print(f"Sent {n_sent} email(s).")
+
+
+def make_workers(app) -> list[PeriodicTask]:
+    """:return: the background workers enabled in settings, not started"""
+    workers = []
+    if CONVERT_RECONCILE_INTERVAL > 0:
+        workers.append(
+            PeriodicTask(
+                app,
+                "convert-reconciler",
+                reconcile_convert_statuses,
+                CONVERT_RECONCILE_INTERVAL,
+            )
+        )
+    if TOMBSTONE_REAP_INTERVAL > 0:
+        workers.append(
+            PeriodicTask(
+                app,
+                "tombstone-reaper",
+                reap_tombstones,
+                TOMBSTONE_REAP_INTERVAL,
+            )
+        )
+    if EMAIL_SEND_INTERVAL > 0:
+        workers.append(
+            PeriodicTask(
+                app, "email-sender", send_queued_emails, EMAIL_SEND_INTERVAL
+            )
+        )
+    return workers
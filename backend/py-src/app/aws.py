@@ -1,12 +1,18 @@
 """Provides utility functions to abstract interaction with AWS."""
 
 import boto3
+import cachetools
 import datetime
 import json
+import logging
 import os
+import threading
 import time
 import enum
 
+from concurrent.futures import Future, ThreadPoolExecutor
+from dataclasses import dataclass, field
+
 from cryptography.hazmat.backends import default_backend
 from cryptography.hazmat.primitives import hashes
 from cryptography.hazmat.primitives import serialization
@@ -22,8 +28,12 @@ from .settings import (
     CF_PUBLIC_KEY_ID,
     AWS_ACCESS_KEY_ID,
     AWS_SECRET_ACCESS_KEY,
+    SIGNED_URL_WINDOW_SECS,
+    SIGNED_URL_CACHE_SIZE,
+    S3_DELETE_WORKERS,
 )
 
+logger = logging.getLogger(__name__)
 _s3 = boto3.client(
     "s3",
     region_name=S3_BUCKET_REGION,
@@ -51,15 +61,72 @@ _mediaconvert = boto3.client(
 )
 
 
+class CloudFrontSigningService:
+    """Signs CloudFront URLs and policies with a private key loaded once.
+
+    Loaded keys are immutable, so a single instance may be shared by every
+    thread in a process. Each worker process loads the key on first use.
+    """
+
+    def __init__(self, private_key_pem: bytes, key_id: str) -> None:
+        self._private_key_pem = private_key_pem
+        self._private_key = None
+        self._lock = threading.Lock()
+        self._signer = CloudFrontSigner(key_id, self.sign)
+        self.n_signatures = 0
+        self.secs_signing = 0.0
+
+    def _get_private_key(self):
+        """:return: the parsed private key, loading it on the first call."""
+        if self._private_key is None:
+            with self._lock:
+                if self._private_key is None:
+                    self._private_key = serialization.load_pem_private_key(
+                        self._private_key_pem,
+                        password=None,
+                        backend=default_backend(),
+                    )
+        return self._private_key
+
+    def sign(self, message: bytes) -> bytes:
+        """:return: the RSA-SHA1 signature of a message"""
+        key = self._get_private_key()
+        before = time.perf_counter()
+        signature = key.sign(message, padding.PKCS1v15(), hashes.SHA1())
+        elapsed = time.perf_counter() - before
+        with self._lock:
+            self.n_signatures += 1
+            self.secs_signing += elapsed
+        return signature
+
+    def generate_presigned_url(
+        self, url: str, expiration: datetime.datetime
+    ) -> str:
+        """:return: a URL signed with a canned policy that expires at expiration"""
+        return self._signer.generate_presigned_url(
+            url, date_less_than=expiration
+        )
+
+    def stats(self) -> dict:
+        """:return: signing throughput counters for this process"""
+        with self._lock:
+            n, secs = self.n_signatures, self.secs_signing
+        return {
+            "n_signatures": n,
+            "secs_signing": secs,
+            "signatures_per_sec": n / secs if secs > 0 else 0.0,
+        }
+
+
+cf_signing = CloudFrontSigningService(CF_PRIVATE_KEY, CF_PUBLIC_KEY_ID)
+
+
 def rsa_sign(message):
     """Sign a message with cf_private_key.
 
     :return: The signed message
     """
-    private_key = serialization.load_pem_private_key(
-        CF_PRIVATE_KEY, password=None, backend=default_backend()
-    )
-    return private_key.sign(message, padding.PKCS1v15(), hashes.SHA1())
+    return cf_signing.sign(message)
 
 
 def _is_invalidation_request_completed(invalidation_id: str) -> bool:
@@ -82,12 +149,42 @@ def _get_presigned_url(object_key: str, expiration: datetime.datetime) -> str:
     :return: Presigned URL pointing to the object
     """
     url = f"{cf_domain}/{object_key}"
-    cloudfront_signer = CloudFrontSigner(CF_PUBLIC_KEY_ID, rsa_sign)
     # Create a signed url using a canned policy
-    signed_url = cloudfront_signer.generate_presigned_url(
-        url, date_less_than=expiration
-    )
-    return signed_url
+    return cf_signing.generate_presigned_url(url, expiration)
+
+
+# Signed URLs keyed by (object key, hours valid, window index). Entries are
+# evicted once their window has passed.
+_signed_urls = cachetools.TTLCache(
+    maxsize=SIGNED_URL_CACHE_SIZE, ttl=SIGNED_URL_WINDOW_SECS
+)
+_signed_urls_lock = threading.Lock()
+
+
+def _get_windowed_presigned_url(
+    object_key: str, expiration_in_hours: int
+) -> str:
+    """Get a presigned Cloudfront URL that is reused within a time window.
+
+    The expiration is rounded up to the end of the current window, so the URL
+    stays valid for between expiration_in_hours and one window longer.
+
+    :param object_key: The S3 object to sign
+    :param expiration_in_hours: The minimum number of hours the URL is valid
+    :return: Presigned URL pointing to the object
+    """
+    window = int(time.time() // SIGNED_URL_WINDOW_SECS)
+    cache_key = (object_key, expiration_in_hours, window)
+    with _signed_urls_lock:
+        url = _signed_urls.get(cache_key)
+    if url is None:
+        expiration = datetime.datetime.utcfromtimestamp(
+            (window + 1) * SIGNED_URL_WINDOW_SECS + expiration_in_hours * 3600
+        )
+        url = _get_presigned_url(object_key, expiration)
+        with _signed_urls_lock:
+            _signed_urls[cache_key] = url
+    return url
 
 
 def get_download_url(
@@ -99,13 +196,11 @@ def get_download_url(
 
     :param upload_uuid: The upload UUID
     :param filename: The original media filename
-    :param expiration_in_hours: The number of hours until the URLs expire
+    :param expiration_in_hours: The minimum hours until the URL expires
     :return: Presigned URL pointing to the originally uploaded file
     """
-    td = datetime.timedelta(hours=expiration_in_hours)
     key = f"uploads/{upload_uuid}/{filename}"
-    url = _get_presigned_url(key, datetime.datetime.utcnow() + td)
-    return url
+    return _get_windowed_presigned_url(key, expiration_in_hours)
 
 
 def get_thumbnail_url(upload_uuid: str, expiration_in_hours: int) -> str:
@@ -114,13 +209,11 @@ def get_thumbnail_url(upload_uuid: str, expiration_in_hours: int) -> str:
        Requires the thumbnail file exists in the S3 bucket.
 
     :param upload_uuid: The upload UUID
-    :param expiration_in_hours: The number of hours until the URLs expire
+    :param expiration_in_hours: The minimum hours until the URL expires
     :return: Presigned URL pointing to the thumbnail of the given upload
     """
-    td = datetime.timedelta(hours=expiration_in_hours)
     key = f"uploads/{upload_uuid}/thumbnail.0000000.jpg"
-    url = _get_presigned_url(key, datetime.datetime.utcnow() + td)
-    return url
+    return _get_windowed_presigned_url(key, expiration_in_hours)
 
 
 def get_presigned_url_post(
@@ -177,57 +270,127 @@ class ConvertStatus(enum.Enum):
     ERROR = enum.auto()
 
 
+_convert_statuses = {
+    "SUBMITTED": ConvertStatus.SUBMITTED,
+    "PROGRESSING": ConvertStatus.PROGRESSING,
+    "COMPLETE": ConvertStatus.COMPLETE,
+    "CANCELED": ConvertStatus.CANCELED,
+    "ERROR": ConvertStatus.ERROR,
+}
+
+
 def get_mediaconvert_status(job_id: str) -> ConvertStatus:
     """Get an AWS MediaConvert job's status.
 
     :param job_id: The MediaConvert job ID
     """
     response = _mediaconvert.get_job(Id=job_id)
-    status = response["Job"]["Status"]
-    to_enum = {
-        "SUBMITTED": ConvertStatus.SUBMITTED,
-        "PROGRESSING": ConvertStatus.PROGRESSING,
-        "COMPLETE": ConvertStatus.COMPLETE,
-        "CANCELED": ConvertStatus.CANCELED,
-        "ERROR": ConvertStatus.ERROR,
-    }
-    return to_enum[status]
-
-
-def delete_uploads(upload_ids: list[int]) -> None:
+    return _convert_statuses[response["Job"]["Status"]]
+
+
+def get_mediaconvert_statuses(job_ids: list[str]) -> dict[str, ConvertStatus]:
+    """Get the statuses of many AWS MediaConvert jobs.
+
+    Jobs that could not be retrieved are omitted so they may be retried.
+
+    :param job_ids: The MediaConvert job IDs
+    :return: The status of each retrieved job keyed by job ID
+    """
+    statuses = {}
+    for job_id in job_ids:
+        try:
+            statuses[job_id] = get_mediaconvert_status(job_id)
+        except ClientError:
+            continue
+    return statuses
+
+
+@dataclass
+class DeletionReport:
+    """The outcome of deleting one upload's objects from S3."""
+
+    upload_id: int
+    n_deleted: int = 0
+    errors: list[str] = field(default_factory=list)
+
+    @property
+    def ok(self) -> bool:
+        return len(self.errors) == 0
+
+
+def delete_uploads(
+    upload_ids: list[int], max_workers: int = S3_DELETE_WORKERS
+) -> dict[int, DeletionReport]:
     """Delete a list of uploads by ID from S3.
 
+    Each upload's prefix is listed page by page on a bounded thread pool and
+    every page of up to 1000 keys is handed to a second pool for deletion
+    while the next page is being listed.
+
     :param upload_ids: IDs of the uploads to be deleted.
+    :param max_workers: Threads used for listing and for deleting.
+    :return: A report of deleted keys and errors keyed by upload ID
     """
+    reports = {id: DeletionReport(id) for id in upload_ids}
+    if not upload_ids:
+        return reports
 
-    def delete_1000(queue: list[str]) -> list[str]:
-        """Delete the first 1000 keys in queue and return remaining."""
-        _s3.delete_objects(
+    def delete_page(keys: list[str]) -> tuple[int, list[str]]:
+        """:return: the number of keys deleted and any errors"""
+        res = _s3.delete_objects(
             Bucket=S3_BUCKET_NAME,
             Delete={
-                "Objects": [{"Key": key} for key in queue[:1000]],
+                "Objects": [{"Key": key} for key in keys],
                 "Quiet": True,  # limit response size - only contains errors
             },
         )
-        return queue[1000:]
-
-    queue: list[str] = []
-    for id in upload_ids:
-        res = _s3.list_objects_v2(
-            Bucket=S3_BUCKET_NAME, Prefix=f"uploads/{id}"
-        )
-        objects = res.get("Contents")
-        if objects is not None:
-            # Upload exists in S3 bucket, append keys to deletion queue
-            for obj in res["Contents"]:
-                key = obj["Key"]
-                queue.append(key)
-                if len(queue) > 1000:
-                    queue = delete_1000(queue)
-
-    # clear remaining keys in queue
-    while len(queue) > 0:
-        queue = delete_1000(queue)
+        errors = res.get("Errors", [])
+        return len(keys) - len(errors), [
+            f"{e['Key']}: {e['Code']}" for e in errors
+        ]
+
+    def list_and_delete(upload_id: int, pending: list[Future]) -> None:
+        """Queue each page of the upload's keys for deletion in pending."""
+        # the trailing slash keeps upload 1 from matching uploads/10/...
+        kwargs = {"Bucket": S3_BUCKET_NAME, "Prefix": f"uploads/{upload_id}/"}
+        while True:
+            res = _s3.list_objects_v2(**kwargs)
+            keys = [obj["Key"] for obj in res.get("Contents", [])]
+            if keys:
+                pending.append(deleters.submit(delete_page, keys))
+            if not res.get("IsTruncated"):
+                return
+            kwargs["ContinuationToken"] = res["NextContinuationToken"]
+
+    pending: dict[int, list[Future]] = {id: [] for id in reports}
+    with ThreadPoolExecutor(max_workers) as listers, ThreadPoolExecutor(
+        max_workers
+    ) as deleters:
+        listings = {
+            id: listers.submit(list_and_delete, id, pending[id])
+            for id in reports
+        }
+        # reports are only updated here so worker threads never race
+        for id, report in reports.items():
+            try:
+                listings[id].result()
+            except ClientError as e:
+                report.errors.append(str(e))
+            for deletion in pending[id]:
+                try:
+                    n_deleted, errors = deletion.result()
+                except ClientError as e:
+                    report.errors.append(str(e))
+                    continue
+                report.n_deleted += n_deleted
+                report.errors.extend(errors)
+            if not report.ok:
+                logger.warning(
+                    "Failed to delete upload %d from S3: %s",
+                    id,
+                    "; ".join(report.errors),
+                )
+    return reports
 
 
 def s3_key_exists(key: str) -> bool:
@@ -0,0 +1,64 @@
+"""Provides a minimal periodic worker for background maintenance jobs."""
+
+from __future__ import annotations
+import datetime
+import threading
+from typing import Callable
+
+from flask import Flask
+
+
+def backoff(
+    attempts: int, base_secs: float, max_secs: float
+) -> datetime.timedelta:
+    """:return: the delay before retrying a job that failed attempts times"""
+    secs = base_secs * 2 ** (attempts - 1)
+    return datetime.timedelta(seconds=min(secs, max_secs))
+
+
+class PeriodicTask:
+    """Repeatedly run a function inside an app context on a daemon thread."""
+
+    def __init__(
+        self, app: Flask, name: str, fn: Callable[[], object], interval: float
+    ) -> None:
+        """
+        :param name: A name used for the thread and in logs
+        :param fn: The job. Exceptions are logged and do not stop the task.
+        :param interval: The number of seconds to wait between runs
+        """
+        self.app = app
+        self.name = name
+        self.fn = fn
+        self.interval = interval
+        self._stopped = threading.Event()
+        self._thread: threading.Thread | None = None
+
+    def run_once(self) -> None:
+        """Run the job a single time in the calling thread."""
+        with self.app.app_context():
+            try:
+                self.fn()
+            except Exception:
+                self.app.logger.exception(
+                    f"Background task {self.name} failed."
+                )
+
+    def _loop(self) -> None:
+        while not self._stopped.is_set():
+            self.run_once()
+            self._stopped.wait(self.interval)
+
+    def start(self) -> None:
+        """Start running the job on a daemon thread."""
+        assert self._thread is None, "Task has already been started."
+        self._thread = threading.Thread(
+            target=self._loop, name=self.name, daemon=True
+        )
+        self._thread.start()
+
+    def stop(self, timeout: float | None = None) -> None:
+        """Stop the task after its current run finishes."""
+        self._stopped.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
@@ -1,7 +1,12 @@
 import time
 import json
 import base64
+import binascii
+import fnmatch
 import os
+import threading
+
+import cachetools
 
 from .aws import rsa_sign
 
@@ -18,13 +23,42 @@ def _replace_unsupported_chars(message: str) -> str:
     return message.replace("+", "-").replace("=", "_").replace("/", "~")
 
 
+def _restore_unsupported_chars(message: str) -> str:
+    return message.replace("-", "+").replace("_", "=").replace("~", "/")
+
+
 class CookieSigner:
-    def __init__(self, expiration_in_hrs: int, cf_key_id: str):
+    def __init__(
+        self,
+        expiration_in_hrs: int,
+        cf_key_id: str,
+        window_secs: int = 0,
+        cache_size: int = 0,
+    ):
+        """
+        :param window_secs: If positive, expirations are rounded up to the
+            end of a window of this many seconds and the cookies of each URL
+            are signed once per window
+        :param cache_size: The number of URLs whose cookies are kept
+        """
         self.expiration_in_hrs = expiration_in_hrs
         self.__cf_key_id = cf_key_id
         self.object_url_header = os.environ.get("S3_OBJECT_URL_HEADER")
+        self.window_secs = window_secs
+        self._signed = (
+            cachetools.TTLCache(maxsize=cache_size, ttl=window_secs)
+            if window_secs > 0 and cache_size > 0
+            else None
+        )
+        self._signed_lock = threading.Lock()
+
+    def _window(self) -> int:
+        return int(time.time() // self.window_secs)
 
     def _expiration_time(self) -> int:
+        if self.window_secs > 0:
+            end = (self._window() + 1) * self.window_secs
+            return end + self.expiration_in_hrs * 3600
         return int(time.time()) + (self.expiration_in_hrs * 3600)
 
     def _generate_policy_cookie(self, url: str) -> tuple[str, str]:
@@ -56,6 +90,55 @@ class CookieSigner:
         return sig_64
 
     def generate_signed_cookies(self, url: str) -> dict:
+        """Sign cookies granting access to a URL pattern.
+
+        Cookies are only issued after the caller checked access, so the
+        cookies of a URL are shared by every viewer within a window.
+        """
+        if self._signed is None:
+            return self._sign_cookies(url)
+        cache_key = (url, self._window())
+        with self._signed_lock:
+            cookies = self._signed.get(cache_key)
+        if cookies is None:
+            cookies = self._sign_cookies(url)
+            with self._signed_lock:
+                self._signed[cache_key] = cookies
+        return dict(cookies)
+
+    def _sign_cookies(self, url: str) -> dict:
         policy_json, policy64 = self._generate_policy_cookie(url)
         signature = self._generate_signature(policy_json)
         return _generate_cookies(policy64, signature, self.__cf_key_id)
+
+    def cookies_cover(
+        self, cookies: dict, url: str, min_secs_left: int
+    ) -> bool:
+        """Check if a client already holds cookies granting access to a URL.
+
+        The signature is not verified. A forged policy only prevents its
+        sender from being issued working cookies.
+
+        :param cookies: The cookies sent by the client
+        :param url: The URL the client wants to access
+        :param min_secs_left: Cookies expiring sooner than this are not valid
+        """
+        if (
+            cookies.get("CloudFront-Key-Pair-Id") != self.__cf_key_id
+            or "CloudFront-Signature" not in cookies
+        ):
+            return False
+        try:
+            policy_64 = _restore_unsupported_chars(
+                cookies["CloudFront-Policy"]
+            )
+            policy = json.loads(base64.b64decode(policy_64))
+            statement = policy["Statement"][0]
+            resource = statement["Resource"]
+            expires = statement["Condition"]["DateLessThan"]["AWS:EpochTime"]
+        except (KeyError, IndexError, TypeError, ValueError, binascii.Error):
+            return False
+        return (
+            fnmatch.fnmatchcase(url, resource)
+            and expires - time.time() >= min_secs_left
+        )
@@ -3,9 +3,11 @@
 Tutorial followed:
 https://realpython.com/handling-email-confirmation-in-flask/
 """
+
 from __future__ import annotations
 import json
 import datetime
+from concurrent.futures import ThreadPoolExecutor
 from typing import Callable
 from functools import wraps
 
@@ -18,14 +20,17 @@ import boto3
 from botocore.exceptions import ClientError
 
 from . import settings
+from .background import backoff
+from .ratelimit import RateLimit, make_buckets
 from .extensions import db
-from .models import LoginMethods, User
+from .models import LoginMethods, OutboundEmail, User
 
 
 def email_conf_required(route: Callable) -> Callable:
     """Decorator that ensures a user confirmes their email address if they registered via email.
     Requires that the user is authenticated.
     """
+
     # Copy the signature, name, docstring, etc of route into wrapper function
     @wraps(route)
     def verify(*args, **kwargs):
@@ -45,10 +50,32 @@ def email_conf_required(route: Callable) -> Callable:
     return verify
 
 
+class TokenService:
+    """Signs and verifies timestamped tokens with one reusable serializer."""
+
+    def __init__(self, secret_key: str, salt: str) -> None:
+        self._serializer = URLSafeTimedSerializer(secret_key, salt=salt)
+
+    def dumps(self, value) -> str:
+        """:return: a signed token containing a value"""
+        return self._serializer.dumps(value)
+
+    def loads(self, token: str | bytes, max_age: int):
+        """:return: the value in a token or None if expired/invalid"""
+        try:
+            return self._serializer.loads(token, max_age=max_age)
+        except BadSignature:
+            return None
+
+
+user_tokens = TokenService(
+    settings.SECRET_KEY, settings.SECURITY_PASSWORD_SALT
+)
+
+
 def generate_user_token(id: int) -> str | bytes:
-    """Generate a confirmation token containing an email."""
-    serializer = URLSafeTimedSerializer(settings.SECRET_KEY)
-    return serializer.dumps(id, salt=settings.SECURITY_PASSWORD_SALT)
+    """Generate a confirmation token containing a user ID."""
+    return user_tokens.dumps(id)
 
 
 def confirm_user_token(token: str | bytes, secs_valid_for=3600) -> int | None:
@@ -56,16 +83,7 @@ def confirm_user_token(token: str | bytes, secs_valid_for=3600) -> int | None:
 
     :param secs_valid_for: The number of seconds for which the token is valid.
     """
-    serializer = URLSafeTimedSerializer(settings.SECRET_KEY)
-    try:
-        id = serializer.loads(
-            token,
-            salt=settings.SECURITY_PASSWORD_SALT,
-            max_age=secs_valid_for,
-        )
-        return id
-    except BadSignature:
-        return None
+    return user_tokens.loads(token, secs_valid_for)
 
 
 _ses = boto3.client(
@@ -88,16 +106,23 @@ class EmailRateLimit(Exception):
         super().__init__("User reached email request limit.")
 
 
-def secs_before_sending(user: User) -> int:
-    """:return: the seconds till the user is allowed to send another email.
+# confirmation, resent confirmation, and password reset emails per user
+email_limit = RateLimit(
+    "email",
+    settings.EMAIL_RATE_LIMIT_BURST,
+    settings.EMAIL_RATE_LIMIT_SECS,
+    make_buckets(),
+)
+
+
+def _take_email_token(user: User) -> None:
+    """Count an email against the user's rate limit.
 
-    A user is only permitted to send an email every 90 sec.
+    :raise EmailRateLimit: if the user has been sent too many emails
     """
-    if user.email_last_sent is None:
-        return 0
-    allowed_to_send = user.email_last_sent + datetime.timedelta(seconds=90)
-    now = datetime.datetime.utcnow()
-    return int((allowed_to_send - now).total_seconds())
+    secs_left = email_limit.take(user.id)
+    if secs_left > 0:
+        raise EmailRateLimit(secs_left)
 
 
 def send_email(to, subject, html, text) -> None:
@@ -153,19 +178,83 @@ def send_email(to, subject, html, text) -> None:
         message_id = response["MessageId"]
 
 
+def enqueue_email(to, subject, html, text) -> None:
+    """Queue a transactional email to be sent by the email worker.
+
+    The email is added to the session and is only sent once the caller
+    commits, so it is never sent for a transaction that rolls back.
+
+    :param to: The recipient's email address
+    :param subject: The email's subject line
+    :param html: The email body, possibly containing HTML.
+    :param text: The email body for recipients with non-HTML email clients.
+    """
+    db.session.add(
+        OutboundEmail(recipient=to, subject=subject, html=html, text=text)
+    )
+
+
+def send_queued_emails(batch_size: int = settings.EMAIL_BATCH_SIZE) -> int:
+    """Send every queued email that is due.
+
+    Each batch is sent by at most EMAIL_SEND_WORKERS concurrent SES requests.
+    Failed emails are retried with exponential backoff until they have been
+    attempted EMAIL_MAX_ATTEMPTS times. Due emails are locked with SKIP LOCKED
+    so that workers in several processes never send the same email.
+
+    :param batch_size: The number of emails sent between commits
+    :return: The number of emails sent
+    """
+
+    def send(email: OutboundEmail) -> str | None:
+        """:return: an error message if the email failed to send"""
+        try:
+            send_email(email.recipient, email.subject, email.html, email.text)
+        except EmailFailed as e:
+            return str(e)
+        return None
+
+    n_sent = 0
+    with ThreadPoolExecutor(settings.EMAIL_SEND_WORKERS) as pool:
+        while True:
+            now = datetime.datetime.utcnow()
+            batch: list[OutboundEmail] = (
+                OutboundEmail.query.filter(
+                    OutboundEmail.next_attempt <= now,
+                    OutboundEmail.attempts < settings.EMAIL_MAX_ATTEMPTS,
+                )
+                .order_by(OutboundEmail.next_attempt)
+                .limit(batch_size)
+                .with_for_update(skip_locked=True)
+                .all()
+            )
+            if len(batch) == 0:
+                return n_sent
+            for email, error in zip(batch, pool.map(send, batch)):
+                if error is None:
+                    db.session.delete(email)
+                    n_sent += 1
+                    continue
+                # failed emails are not due again in this run
+                email.attempts += 1
+                email.last_error = error
+                email.next_attempt = now + backoff(
+                    email.attempts,
+                    settings.EMAIL_RETRY_SECS,
+                    settings.EMAIL_MAX_RETRY_SECS,
+                )
+            db.session.commit()
+
+
 def send_conf_email(to: User) -> None:
     """Send an account confirmation email to a user.
 
     :param to: The recipient
-    :raise EmailFailed: if email could not send, containing error message.
     :raise EmailRateLimit:
         if this user has seen too many emails, containing the number of seconds
         before they are allowed to send another
     """
-    # check last sent
-    secs_left = secs_before_sending(to)
-    if secs_left > 0:
-        raise EmailRateLimit(secs_left)
+    _take_email_token(to)
     # generate email body
     token = generate_user_token(to.id)
     link = url_for("routes.confirm_email", token=token, _external=True)
@@ -181,9 +270,8 @@ Please activate your email:
 Have a great day!
     """
     subject = "Activate your account! 🎾"
-    # send email and update last sent
-    send_email(to.email, subject, html_body, text_body)
-    to.email_last_sent = datetime.datetime.utcnow()
+    # queue email, committing it with the rate limit token
+    enqueue_email(to.email, subject, html_body, text_body)
     db.session.commit()
 
 
@@ -191,15 +279,11 @@ def send_forgot_pwd_email(to: User) -> None:
     """Send a "forgot password" email to a user.
 
     :param to: The recipient
-    :raise EmailFailed: if email could not send, containing error message.
     :raise EmailRateLimit:
         if this user has seen too many emails, containing the number of seconds
         before they are allowed to send another
     """
-    # check last sent
-    secs_left = secs_before_sending(to)
-    if secs_left > 0:
-        raise EmailRateLimit(secs_left)
+    _take_email_token(to)
     # generate email body
     token = generate_user_token(to.id)
     link = f"https://myace.ai/forgotpassword?token={token}"
@@ -215,7 +299,6 @@ Please click here to reset your password:
 Have a great day!
     """
     subject = "Password reset 🔒"
-    # send email and update last sent
-    send_email(to.email, subject, html_body, text_body)
-    to.email_last_sent = datetime.datetime.utcnow()
+    # queue email, committing it with the rate limit token
+    enqueue_email(to.email, subject, html_body, text_body)
     db.session.commit()
@@ -0,0 +1,220 @@
+"""Caches the public keys that Apple and Google sign ID tokens with.
+
+Keys are fetched once and served from memory. Apple's are parsed from a JSON
+Web Key Set, and Google's certificates are served to google-auth by
+CachedCertsRequest in place of its HTTP transport. Once a key set is
+older than its TTL it is still served while a background thread refetches
+it, so no login waits on the provider unless the keys are missing, too stale
+to trust, or a token names a key ID that the cache has not seen yet. Those
+fetches are attempted at most once per minimum refetch interval, so logins
+fail fast while the provider is down.
+"""
+
+from __future__ import annotations
+import json
+import logging
+import threading
+import time
+from typing import Any, Callable
+
+import requests
+from google.auth import exceptions as g_exceptions
+from google.auth import transport as g_transport
+from jwt.algorithms import RSAAlgorithm
+
+from .settings import (
+    JWKS_FETCH_TIMEOUT_SECS,
+    JWKS_MAX_STALE_SECS,
+    JWKS_MIN_REFETCH_SECS,
+    JWKS_TTL_SECS,
+)
+
+APPLE_KEYS_URL = "https://appleid.apple.com/auth/keys"
+# the x509 certificates that google-auth verifies Google ID tokens with
+GOOGLE_CERTS_URL = "https://www.googleapis.com/oauth2/v1/certs"
+
+logger = logging.getLogger(__name__)
+
+
+class KeysUnavailable(Exception):
+    """The keys of an identity provider could not be fetched."""
+
+    def __init__(self, url: str) -> None:
+        super().__init__(f"Could not fetch the keys at {url}.")
+
+
+def fetch_json(url: str) -> dict:
+    """:return: the JSON document published at a URL"""
+    response = requests.get(url, timeout=JWKS_FETCH_TIMEOUT_SECS)
+    response.raise_for_status()
+    return response.json()
+
+
+def parse_jwks(jwks: dict) -> dict[str, Any]:
+    """:return: the RSA public keys of a JSON Web Key Set by key ID"""
+    return {
+        jwk["kid"]: RSAAlgorithm.from_jwk(json.dumps(jwk))
+        for jwk in jwks["keys"]
+        if jwk.get("kty") == "RSA"
+    }
+
+
+def parse_certs(certs: dict) -> dict[str, Any]:
+    """:return: the PEM certificates of a Google style certs document by key
+    ID"""
+    return {kid: cert for kid, cert in certs.items() if isinstance(cert, str)}
+
+
+class KeySet:
+    """The public keys published by one identity provider."""
+
+    def __init__(
+        self,
+        url: str,
+        fetch: Callable[[str], dict] = fetch_json,
+        parse: Callable[[dict], dict[str, Any]] = parse_jwks,
+        ttl: float = JWKS_TTL_SECS,
+        max_stale: float = JWKS_MAX_STALE_SECS,
+        min_refetch: float = JWKS_MIN_REFETCH_SECS,
+    ) -> None:
+        """
+        :param fetch: Downloads the document at a URL
+        :param parse: Returns the keys of a document by key ID
+        :param ttl: Seconds before keys are refreshed in the background
+        :param max_stale: Seconds after which keys are no longer served
+            while they are refreshed
+        :param min_refetch: The minimum number of seconds between fetch
+            attempts. Within it, unknown key IDs are rejected and keys too
+            stale to serve are unavailable.
+        """
+        self.url = url
+        self.fetch = fetch
+        self.parse = parse
+        self.ttl = ttl
+        self.max_stale = max_stale
+        self.min_refetch = min_refetch
+        self.n_fetches = 0
+        self._keys: dict[str, Any] = {}
+        self._fetched_at: float | None = None
+        self._attempted_at = float("-inf")
+        # held while fetching so concurrent misses share one request
+        self._fetch_lock = threading.Lock()
+        self._refresh_lock = threading.Lock()
+        self._refreshing = False
+
+    def get(self, kid: str):
+        """:return: the public key with a key ID
+
+        :raise KeyError: if the provider has no key with the ID
+        :raise KeysUnavailable: if the keys had to be fetched and could not be
+        """
+        now = time.monotonic()
+        fetched_at = self._fetched_at
+        age = float("inf") if fetched_at is None else now - fetched_at
+        if age > self.max_stale:
+            # fail fast instead of fetching on every login while the
+            # provider is down
+            if not self._may_fetch(now):
+                raise KeysUnavailable(self.url)
+            self._refetch(fetched_at, now)
+        elif age > self.ttl and self._may_fetch(now):
+            self._refresh_in_background()
+        key = self._keys.get(kid)
+        if key is None:
+            # the provider may have rotated in a new key
+            if self._may_fetch(now):
+                self._refetch(self._fetched_at, now)
+            key = self._keys.get(kid)
+            if key is None:
+                raise KeyError(f"Unknown key ID {kid}.")
+        return key
+
+    def _may_fetch(self, now: float) -> bool:
+        """:return: whether min_refetch has passed since the last attempt"""
+        return now - self._attempted_at >= self.min_refetch
+
+    def _refetch(self, seen_fetched_at: float | None, since: float) -> None:
+        """Fetch the keys unless another thread did since they were seen."""
+        with self._fetch_lock:
+            if self._fetched_at != seen_fetched_at:
+                return
+            if self._attempted_at >= since:
+                # a fetch failed while this thread waited, don't queue another
+                raise KeysUnavailable(self.url)
+            self._attempted_at = time.monotonic()
+            self.n_fetches += 1
+            try:
+                keys = self.parse(self.fetch(self.url))
+            except Exception as e:
+                raise KeysUnavailable(self.url) from e
+            self._keys = keys
+            self._fetched_at = time.monotonic()
+
+    def _refresh_in_background(self) -> None:
+        with self._refresh_lock:
+            if self._refreshing:
+                return
+            self._refreshing = True
+        fetched_at = self._fetched_at
+        since = time.monotonic()
+
+        def refresh():
+            try:
+                self._refetch(fetched_at, since)
+            except Exception:
+                logger.warning(
+                    "Failed to refresh the keys at %s", self.url, exc_info=True
+                )
+            finally:
+                self._refreshing = False
+
+        threading.Thread(
+            target=refresh, name=f"jwks-refresh-{self.url}", daemon=True
+        ).start()
+
+
+class _CertsResponse(g_transport.Response):
+    def __init__(self, certs: dict) -> None:
+        self._data = json.dumps(certs).encode()
+
+    @property
+    def status(self) -> int:
+        return 200
+
+    @property
+    def headers(self) -> dict:
+        return {}
+
+    @property
+    def data(self) -> bytes:
+        return self._data
+
+
+class CachedCertsRequest(g_transport.Request):
+    """A google-auth transport that answers requests for a KeySet's
+    certificates from its cache instead of the network.
+
+    Pass it to google.oauth2.id_token.verify_oauth2_token, which still does
+    all of the token verification.
+    """
+
+    def __init__(self, keys: KeySet, kid: str) -> None:
+        """
+        :param kid: The key ID named by the token being verified
+        """
+        self.keys = keys
+        self.kid = kid
+
+    def __call__(self, url, method="GET", body=None, headers=None, **kwargs):
+        """:return: a certs document with the certificate of the token's key
+
+        :raise KeyError: if the provider has no key with the token's key ID
+        :raise KeysUnavailable: if the keys had to be fetched and could not be
+        """
+        if url != self.keys.url or method != "GET":
+            raise g_exceptions.TransportError(f"Unexpected request to {url}.")
+        return _CertsResponse({self.kid: self.keys.get(self.kid)})
+
+
+apple_keys = KeySet(APPLE_KEYS_URL)
+google_keys = KeySet(GOOGLE_CERTS_URL, parse=parse_certs)
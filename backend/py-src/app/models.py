@@ -6,15 +6,34 @@ import enum
 import random
 import re
 import string
-from sqlalchemy import or_, and_
+import threading
+
+import cachetools
+from sqlalchemy import (
+    or_,
+    and_,
+    case,
+    event,
+    exists,
+    func,
+    inspect,
+    select,
+    union,
+)
+from sqlalchemy.dialects.postgresql import insert as pg_insert
 
+from flask_sqlalchemy import BaseQuery
 from sqlalchemy.ext.hybrid import hybrid_method
+from sqlalchemy.orm import joinedload, make_transient_to_detached
+from sqlalchemy.orm.attributes import set_committed_value
 from sqlalchemy.sql.elements import BooleanClauseList
 
-from typing import List, Optional
+from typing import Iterable, List, Optional
+
+from flask import g, has_request_context
 
 from .extensions import db
-from . import aws
+from . import aws, settings
 
 # TODO: transition from exposing primary keys in routes to using UUIDs or IDENTITY or SERIAL
 
@@ -32,6 +51,15 @@ class LoginMethods(enum.Enum):
     APPLE = enum.auto()
 
 
+# The columns read while authenticating requests, cached by user ID for
+# User.load_cached. Changes made by other processes show after the TTL.
+_AUTH_COLUMNS = ("id", "login_method", "email_confirmed")
+_auth_columns = cachetools.TTLCache(
+    maxsize=settings.USER_CACHE_SIZE, ttl=settings.USER_CACHE_TTL_SECS
+)
+_auth_columns_lock = threading.Lock()
+
+
 # User Table
 class User(db.Model):
     __tablename__ = "user"
@@ -52,7 +80,11 @@ class User(db.Model):
     password_hash = db.Column(db.String, nullable=True)
     # email_confirmed is only null if login_method is EMAIL
     email_confirmed = db.Column(db.Boolean, nullable=True)
-    email_last_sent = db.Column(db.DateTime, nullable=True)
+    # Denormalized courtship counts, kept in sync by
+    # UserRelationship.update_counts. Run `flask recount-courtships` to repair.
+    n_friends = db.Column(db.Integer, nullable=False, default=0)
+    n_coaches = db.Column(db.Integer, nullable=False, default=0)
+    n_students = db.Column(db.Integer, nullable=False, default=0)
 
     uploads = db.relationship(
         "Upload", back_populates="user", passive_deletes="all"
@@ -100,26 +132,49 @@ class User(db.Model):
 
     def serialize(self, client: User):
         """:return: a serialized User from the perspective of the client"""
-        # public profile information
-        response = {
-            "id": self.id,
-            "username": self.username,
-            "display_name": self.display_name,
-            "biography": self.biography,
-            "n_uploads": self.n_uploads_visible_to(client),
-            "n_courtships": {
-                "friends": self.count_friends(),
-                "coaches": self.count_coaches(),
-                "students": self.count_students(),
-            },
-        }
-        # courtship field
-        rel = client.get_relationship_with(self)
-        response["courtship"] = None if rel is None else rel.serialize(client)
-        # private profile information
-        if self.id == client.id:
-            response["email"] = self.email
-            response["email_confirmed"] = self.email_confirmed
+        return User.serialize_many([self], client)[0]
+
+    @staticmethod
+    def serialize_many(users: list[User], client: User) -> list[dict]:
+        """Serialize a list of users from the perspective of the client.
+
+        Upload counts and the client's courtships are each computed for the
+        whole list with a single grouped query.
+
+        :return: a list of serialized Users in the same order as users
+        """
+        ids = {u.id for u in users}
+        if len(ids) == 0:
+            return []
+        n_uploads = dict(
+            db.session.query(Upload.user_id, func.count(Upload.id))
+            .filter(and_(Upload.user_id.in_(ids), Upload.viewable_to(client)))
+            .group_by(Upload.user_id)
+            .all()
+        )
+        response = []
+        for user in users:
+            # public profile information
+            res = {
+                "id": user.id,
+                "username": user.username,
+                "display_name": user.display_name,
+                "biography": user.biography,
+                "n_uploads": n_uploads.get(user.id, 0),
+                "n_courtships": {
+                    "friends": user.n_friends,
+                    "coaches": user.n_coaches,
+                    "students": user.n_students,
+                },
+            }
+            # courtship field
+            rel = client.courtships.get(user.id)
+            res["courtship"] = None if rel is None else rel.serialize(client)
+            # private profile information
+            if user.id == client.id:
+                res["email"] = user.email
+                res["email_confirmed"] = user.email_confirmed
+            response.append(res)
         return response
 
     def n_uploads_visible_to(self, client: User) -> int:
@@ -162,67 +217,121 @@ class User(db.Model):
             )
         ).count()
 
-    def get_relationship_with(self, other: User) -> Optional[UserRelationship]:
-        """:return: a relationship with another user, or None if DNE"""
-        a_to_b = db.session.query(UserRelationship).get((self.id, other.id))
-        if a_to_b is not None:
-            return a_to_b
-        b_to_a = db.session.query(UserRelationship).get((other.id, self.id))
-        return b_to_a
-
-    def has_courtship_with(self, other_id: db.Column):
-        """:return: An EXISTS subquery true if this user has a courtship with other."""
-        return UserRelationship.query.filter(
-            or_(
+    @staticmethod
+    def recount_courtships() -> None:
+        """Recompute every user's denormalized courtship counts in bulk."""
+        n_friends = (
+            db.session.query(func.count())
+            .filter(
                 and_(
-                    UserRelationship.user_a_id == self.id,
-                    UserRelationship.user_b_id == other_id,
-                ),
+                    or_(
+                        UserRelationship.user_a_id == User.id,
+                        UserRelationship.user_b_id == User.id,
+                    ),
+                    UserRelationship.type == RelationshipType.FRIENDS,
+                )
+            )
+            .scalar_subquery()
+        )
+        n_coaches = (
+            db.session.query(func.count())
+            .filter(
                 and_(
-                    UserRelationship.user_a_id == other_id,
-                    UserRelationship.user_b_id == self.id,
-                ),
+                    UserRelationship.user_b_id == User.id,
+                    UserRelationship.type == RelationshipType.A_COACHES_B,
+                )
             )
-        ).exists()
-
-    def coaches(self, other_id: db.Column):
-        """:return: An EXISTS subquery true if this user coaches other."""
-        return UserRelationship.query.filter(
-            and_(
-                UserRelationship.user_a_id == self.id,
-                UserRelationship.user_b_id == other_id,
-                UserRelationship.type == RelationshipType.A_COACHES_B,
+            .scalar_subquery()
+        )
+        n_students = (
+            db.session.query(func.count())
+            .filter(
+                and_(
+                    UserRelationship.user_a_id == User.id,
+                    UserRelationship.type == RelationshipType.A_COACHES_B,
+                )
             )
-        ).exists()
+            .scalar_subquery()
+        )
+        User.query.update(
+            {
+                User.n_friends: n_friends,
+                User.n_coaches: n_coaches,
+                User.n_students: n_students,
+            },
+            synchronize_session=False,
+        )
 
-    def student_of(self, other_id: db.Column):
-        """:return: An EXISTS subquery true if other coaches this user."""
-        return UserRelationship.query.filter(
-            and_(
-                UserRelationship.user_a_id == other_id,
-                UserRelationship.user_b_id == self.id,
-                UserRelationship.type == RelationshipType.A_COACHES_B,
-            )
-        ).exists()
+    def leave_courtships(self) -> None:
+        """Remove this user from the courtship counts of everyone they court.
 
-    def friends_with(self, other_id: db.Column):
-        """:return: An EXISTS subquery true if users are friends with other."""
-        return UserRelationship.query.filter(
-            and_(
-                UserRelationship.type == RelationshipType.FRIENDS,
-                # relationship exists involving the two users
-                or_(
-                    and_(
-                        UserRelationship.user_a_id == self.id,
-                        UserRelationship.user_b_id == other_id,
-                    ),
-                    and_(
-                        UserRelationship.user_a_id == other_id,
-                        UserRelationship.user_b_id == self.id,
-                    ),
-                ),
+        Must be called before deleting the user because their relationships
+        are deleted by DB-level cascades.
+        """
+        friend_ids = (
+            db.session.query(UserRelationship.user_b_id)
+            .filter_by(user_a_id=self.id, type=RelationshipType.FRIENDS)
+            .union(
+                db.session.query(UserRelationship.user_a_id).filter_by(
+                    user_b_id=self.id, type=RelationshipType.FRIENDS
+                )
             )
-        ).exists()
+        )
+        student_ids = db.session.query(UserRelationship.user_b_id).filter_by(
+            user_a_id=self.id, type=RelationshipType.A_COACHES_B
+        )
+        coach_ids = db.session.query(UserRelationship.user_a_id).filter_by(
+            user_b_id=self.id, type=RelationshipType.A_COACHES_B
+        )
+        User.query.filter(User.id.in_(friend_ids)).update(
+            {User.n_friends: User.n_friends - 1}, synchronize_session=False
+        )
+        User.query.filter(User.id.in_(student_ids)).update(
+            {User.n_coaches: User.n_coaches - 1}, synchronize_session=False
+        )
+        User.query.filter(User.id.in_(coach_ids)).update(
+            {User.n_students: User.n_students - 1}, synchronize_session=False
+        )
+
+    @property
+    def courtships(self) -> Courtships:
+        """This user's relationships, loaded with one query the first time
+        they are needed in a request and cached until the request ends."""
+        if not has_request_context():
+            return Courtships.load(self.id)
+        cache = g.setdefault("courtships", {})
+        if self.id not in cache:
+            cache[self.id] = Courtships.load(self.id)
+        return cache[self.id]
+
+    def get_relationship_with(self, other: User) -> Optional[UserRelationship]:
+        """:return: a relationship with another user, or None if DNE"""
+        rel = self.courtships.get(other.id)
+        if rel is None:
+            return None
+        return db.session.query(UserRelationship).get(
+            (rel.user_a_id, rel.user_b_id)
+        )
+
+    def has_courtship_with(self, other_id: int | db.Column):
+        """:return: True if this user has a relationship with other, or an
+        equivalent clause if other_id is a column"""
+        return self.courtships.test(other_id, self.courtships.by_user.keys())
+
+    def coaches(self, other_id: int | db.Column):
+        """:return: True if this user coaches other, or an equivalent clause
+        if other_id is a column"""
+        return self.courtships.test(other_id, self.courtships.students)
+
+    def student_of(self, other_id: int | db.Column):
+        """:return: True if other coaches this user, or an equivalent clause
+        if other_id is a column"""
+        return self.courtships.test(other_id, self.courtships.coaches)
+
+    def friends_with(self, other_id: int | db.Column):
+        """:return: True if users are friends with other, or an equivalent
+        clause if other_id is a column"""
+        return self.courtships.test(other_id, self.courtships.friends)
 
     def can_view_upload(self, upload: Upload) -> bool:
         """:return: True if the user is allowed to view a given upload."""
@@ -266,10 +375,11 @@ class User(db.Model):
         if self.id == bucket.user_id:
             return True
         # A bucket is viewable if it contains >=1 viewable uploads
-        for u in bucket.uploads:
-            if self.can_view_upload(u):
-                return True
-        return False
+        return db.session.query(
+            Upload.query.filter(
+                and_(Upload.bucket_id == bucket.id, Upload.viewable_to(self))
+            ).exists()
+        ).scalar()
 
     def can_modify_bucket(self, bucket: Bucket) -> bool:
         """:return: True if the user is allowed to edit a given bucket's contents and properties"""
@@ -323,6 +433,42 @@ class User(db.Model):
         """:return: unicode representation of user ID"""
         return str(self.id)
 
+    @staticmethod
+    def load_cached(user_id: int) -> Optional[User]:
+        """Get a user to authenticate a request.
+
+        The columns read by authentication are cached, so a cached user is
+        attached to the session without a query. Its other columns are
+        loaded together the first time one of them is read.
+
+        :return: the user, or None if DNE
+        """
+        with _auth_columns_lock:
+            values = _auth_columns.get(user_id)
+        if values is None:
+            user = User.query.filter_by(id=user_id).first()
+            if user is not None:
+                with _auth_columns_lock:
+                    _auth_columns[user_id] = {
+                        key: getattr(user, key) for key in _AUTH_COLUMNS
+                    }
+            return user
+        user = User.__mapper__.class_manager.new_instance()
+        for key, value in values.items():
+            set_committed_value(user, key, value)
+        make_transient_to_detached(user)
+        return db.session.merge(user, load=False)
+
+    @staticmethod
+    def forget_cached(user_ids: Optional[Iterable[int]] = None) -> None:
+        """Drop the cached auth columns of users, or of every user if None."""
+        with _auth_columns_lock:
+            if user_ids is None:
+                _auth_columns.clear()
+                return
+            for user_id in user_ids:
+                _auth_columns.pop(user_id, None)
+
 
 @enum.unique
 class RelationshipType(enum.Enum):
@@ -367,7 +513,9 @@ class UserRelationship(db.Model):
         db.ForeignKey("user.id", ondelete="CASCADE"), primary_key=True
     )
     user_b_id = db.Column(
-        db.ForeignKey("user.id", ondelete="CASCADE"), primary_key=True
+        db.ForeignKey("user.id", ondelete="CASCADE"),
+        primary_key=True,
+        index=True,
     )
     # Stores enum variable names as strings in DB. For now I think this is OK
     # bc it provides readability while only slightly compromising disk space.
@@ -391,6 +539,51 @@ class UserRelationship(db.Model):
             res["dir"] = "out" if self.user_a_id == client.id else "in"
         return res
 
+    def update_counts(self, delta: int) -> None:
+        """Add (1) or remove (-1) this courtship from both users' counts.
+
+        Requests are never counted, so this is a no-op unless the users are
+        friends or one coaches the other. The change is committed along with
+        the rest of the session.
+        """
+        if self.type == RelationshipType.FRIENDS:
+            User.query.filter(
+                User.id.in_((self.user_a_id, self.user_b_id))
+            ).update(
+                {User.n_friends: User.n_friends + delta},
+                synchronize_session="evaluate",
+            )
+        elif self.type == RelationshipType.A_COACHES_B:
+            User.query.filter_by(id=self.user_a_id).update(
+                {User.n_students: User.n_students + delta},
+                synchronize_session="evaluate",
+            )
+            User.query.filter_by(id=self.user_b_id).update(
+                {User.n_coaches: User.n_coaches + delta},
+                synchronize_session="evaluate",
+            )
+
+    def refresh_derived(self) -> None:
+        """Refresh the visibility index and both users' timelines.
+
+        Call after this relationship is created, changed or deleted. The
+        change is committed along with the rest of the session.
+        """
+        UploadViewer.refresh_courtship(self.user_a_id, self.user_b_id)
+        TimelineEntry.refresh_courtship(self.user_a_id, self.user_b_id)
+
+    @staticmethod
+    def other_id_of(user_id: int):
+        """:return: a column expression of the ID of the other user in a
+        relationship involving the given user"""
+        return case(
+            (
+                UserRelationship.user_a_id == user_id,
+                UserRelationship.user_b_id,
+            ),
+            else_=UserRelationship.user_a_id,
+        )
+
     def get_other(self, client: User) -> User:
         """:return: the other User involved in this relationship"""
         other_id = (
@@ -426,6 +619,88 @@ class UserRelationship(db.Model):
             )
 
 
+class Courtships:
+    """A snapshot of one user's relationships, split by the other user's role.
+
+    Read through User.courtships, which caches snapshots for the rest of the
+    request. Snapshots are dropped whenever a relationship of the user is
+    flushed. The relationships are detached copies that are never flushed.
+    """
+
+    def __init__(self, user_id: int, rels: list[UserRelationship]) -> None:
+        # every relationship keyed by the other user's ID
+        self.by_user: dict[int, UserRelationship] = {}
+        self.friends: set[int] = set()
+        self.coaches: set[int] = set()
+        self.students: set[int] = set()
+        # users with a request to or from this user
+        self.pending: set[int] = set()
+        for rel in rels:
+            if rel.user_a_id == user_id:
+                other_id = rel.user_b_id
+            else:
+                other_id = rel.user_a_id
+            self.by_user[other_id] = rel
+            if rel.type == RelationshipType.FRIENDS:
+                self.friends.add(other_id)
+            elif rel.type == RelationshipType.A_COACHES_B:
+                if rel.user_a_id == user_id:
+                    self.students.add(other_id)
+                else:
+                    self.coaches.add(other_id)
+            elif rel.type.is_request():
+                self.pending.add(other_id)
+
+    @staticmethod
+    def load(user_id: int) -> Courtships:
+        """:return: a user's relationships, read with a single query"""
+        rows = db.session.query(
+            UserRelationship.user_a_id,
+            UserRelationship.user_b_id,
+            UserRelationship.type,
+        ).filter(
+            or_(
+                UserRelationship.user_a_id == user_id,
+                UserRelationship.user_b_id == user_id,
+            )
+        )
+        return Courtships(
+            user_id,
+            [
+                UserRelationship(user_a_id=a, user_b_id=b, type=type)
+                for a, b, type in rows
+            ],
+        )
+
+    @staticmethod
+    def forget(*user_ids: int) -> None:
+        """Drop the users' cached snapshots after their relationships change."""
+        if has_request_context():
+            cache = g.get("courtships", {})
+            for user_id in user_ids:
+                cache.pop(user_id, None)
+
+    def get(self, other_id: int) -> Optional[UserRelationship]:
+        """:return: the (detached) relationship with another user, or None"""
+        return self.by_user.get(other_id)
+
+    @staticmethod
+    def test(other_id: int | db.Column, ids: Iterable[int]):
+        """:return: True if other_id is one of ids, or an equivalent clause if
+        other_id is a column"""
+        if isinstance(other_id, int):
+            return other_id in ids
+        return other_id.in_(list(ids))
+
+
+@event.listens_for(db.session, "after_flush")
+def _forget_changed_courtships(session, flush_context) -> None:
+    """Drop cached courtships of users whose relationships were flushed."""
+    for obj in (*session.new, *session.dirty, *session.deleted):
+        if isinstance(obj, UserRelationship):
+            Courtships.forget(obj.user_a_id, obj.user_b_id)
+
+
 def rel_req_of_str(s: str) -> Optional[RelationshipType]:
     """:return: the pending (requested) RelationshipType representation of a string or None if DNE"""
     if s == "friend-req":
@@ -501,6 +776,13 @@ also_shared_with = db.Table(
     ),
 )
 
+# statuses after which a MediaConvert job never changes again
+_FINISHED_CONVERT_STATUSES = (
+    aws.ConvertStatus.COMPLETE,
+    aws.ConvertStatus.CANCELED,
+    aws.ConvertStatus.ERROR,
+)
+
 
 # Upload Table
 class Upload(db.Model):
@@ -526,12 +808,19 @@ class Upload(db.Model):
     )
     # Mediaconvert
     mediaconvert_job_id = db.Column(db.String, nullable=True)
+    # Last known job status, updated by the convert status reconciler
+    mediaconvert_status = db.Column(db.Enum(aws.ConvertStatus), nullable=True)
     stream_ready = db.Column(db.Boolean, nullable=False, default=False)
     # Bucket (each upload has to be created in a bucket)
-    bucket_id = db.Column(
-        db.Integer,
-        db.ForeignKey("bucket.id", ondelete="CASCADE"),
-        nullable=False,
+    # the previous bucket is loaded on moves so that its cached summary can
+    # be forgotten
+    bucket_id = db.column_property(
+        db.Column(
+            db.Integer,
+            db.ForeignKey("bucket.id", ondelete="CASCADE"),
+            nullable=False,
+        ),
+        active_history=True,
     )
     bucket = db.relationship("Bucket", back_populates="uploads")
     # Comments
@@ -541,42 +830,133 @@ class Upload(db.Model):
 
     def serialize(self, client: User):
         """:return: a serialized Upload from the perspective of the client"""
-        # Check stream_ready
-        if not self.stream_ready and self.mediaconvert_job_id is not None:
-            status = aws.get_mediaconvert_status(self.mediaconvert_job_id)
-            if status == aws.ConvertStatus.COMPLETE:
-                self.stream_ready = True
-                db.session.commit()
-        response = {
-            "id": self.id,
-            "created": self.created.isoformat(),
-            "display_title": self.display_title,
-            "stream_ready": self.stream_ready,
-            "bucket": self.bucket.serialize(client),
-            "visibility": {
-                "default": visib_to_str(self.visibility),
-                "also_shared_with": [
-                    u.serialize(client) for u in self.also_shared_with
-                ],
-            },
+        return Upload.serialize_many([self], client)[0]
+
+    @staticmethod
+    def serialize_many(uploads: list[Upload], client: User) -> list[dict]:
+        """Serialize a list of uploads from the perspective of the client.
+
+        Buckets and individual shares are each loaded for the whole list with
+        a single query, so the number of statements does not grow with the
+        number of uploads.
+
+        :return: a list of serialized Uploads in the same order as uploads
+        """
+        if len(uploads) == 0:
+            return []
+        upload_ids = {up.id for up in uploads}
+        buckets = Bucket.query.filter(
+            Bucket.id.in_({up.bucket_id for up in uploads})
+        ).all()
+        bucket_by_id = {
+            b.id: res
+            for b, res in zip(buckets, Bucket.serialize_many(buckets, client))
         }
-        if self.stream_ready:
-            response["thumbnail"] = aws.get_thumbnail_url(
-                str(self.id), expiration_in_hours=1
+        shares = (
+            db.session.query(also_shared_with.c.upload_id, User)
+            .join(User, User.id == also_shared_with.c.user_id)
+            .filter(also_shared_with.c.upload_id.in_(upload_ids))
+            .order_by(also_shared_with.c.upload_id, User.id)
+            .all()
+        )
+        shared_users = list({user.id: user for _, user in shares}.values())
+        user_by_id = {
+            u.id: res
+            for u, res in zip(
+                shared_users, User.serialize_many(shared_users, client)
             )
+        }
+        shared_with = {up_id: [] for up_id in upload_ids}
+        for up_id, user in shares:
+            shared_with[up_id].append(user_by_id[user.id])
+        response = []
+        for up in uploads:
+            res = {
+                "id": up.id,
+                "created": up.created.isoformat(),
+                "display_title": up.display_title,
+                "stream_ready": up.stream_ready,
+                "bucket": bucket_by_id[up.bucket_id],
+                "visibility": {
+                    "default": visib_to_str(up.visibility),
+                    "also_shared_with": shared_with[up.id],
+                },
+            }
+            if up.stream_ready:
+                res["thumbnail"] = aws.get_thumbnail_url(
+                    str(up.id), expiration_in_hours=1
+                )
+            response.append(res)
         return response
 
-    def share_with(self, users: list[User]) -> None:
-        """Share this upload with a list of users."""
+    def set_convert_status(self, status: aws.ConvertStatus) -> bool:
+        """Record the status of this upload's MediaConvert job.
+
+        Job state events can arrive late or out of order, so a status that
+        would move a job backwards is ignored: finished jobs keep their final
+        status and progressing jobs are never made submitted again.
+
+        :return: whether the status changed
+        """
+        current = self.mediaconvert_status
+        if (
+            status == current
+            or current in _FINISHED_CONVERT_STATUSES
+            or (
+                current == aws.ConvertStatus.PROGRESSING
+                and status == aws.ConvertStatus.SUBMITTED
+            )
+        ):
+            return False
+        self.mediaconvert_status = status
+        if status == aws.ConvertStatus.COMPLETE:
+            self.stream_ready = True
+        return True
+
+    @classmethod
+    def converting(cls) -> BooleanClauseList:
+        """:return: a filter matching uploads with an unfinished convert job."""
+        return and_(
+            cls.mediaconvert_job_id.isnot(None),
+            cls.stream_ready.is_(False),
+            or_(
+                cls.mediaconvert_status.is_(None),
+                cls.mediaconvert_status.in_(
+                    (
+                        aws.ConvertStatus.SUBMITTED,
+                        aws.ConvertStatus.PROGRESSING,
+                    )
+                ),
+            ),
+        )
+
+    def share_with(self, users: list[User], replace: bool = False) -> None:
+        """Share this upload with a list of users.
+
+        Also call this after changing the upload's default visibility, even
+        with no users, so that the visibility index is refreshed.
+
+        :param replace: Unshare it with everyone else in the same transaction
+        """
         assert type(users) == list, type(users)
+        if replace:
+            self._remove_shares()
         self.also_shared_with.extend(users)
+        UploadViewer.refresh(Upload.id == self.id)
+        TimelineEntry.refresh(Upload.id == self.id)
         db.session.commit()
 
     def unshare_with_all(self) -> None:
         """Unshare this upload with all individuals in also_shared_with."""
+        self._remove_shares()
+        # refreshed in the same transaction, so no one sees stale visibility
+        UploadViewer.refresh(Upload.id == self.id)
+        TimelineEntry.refresh(Upload.id == self.id)
+        db.session.commit()
+
+    def _remove_shares(self) -> None:
         for u in self.also_shared_with:
             self.also_shared_with.remove(u)
-        db.session.commit()
 
     @classmethod
     def viewable_to(cls, user: User) -> BooleanClauseList:
@@ -586,6 +966,13 @@ class Upload(db.Model):
             BooleanClauseList that evals to true if a user is allowed to view
             the upload.
         """
+        if settings.VISIBILITY_INDEX:
+            return cls._indexed_viewable_to(user)
+        return cls._live_viewable_to(user)
+
+    @classmethod
+    def _live_viewable_to(cls, user: User) -> BooleanClauseList:
+        """Evaluate viewable_to from sharing and courtships directly."""
         # decided to avoid making this a hybrid method because I failed to call hybrid_method.expression.
         # https://docs.sqlalchemy.org/en/13/orm/extensions/hybrid.html#defining-expression-behavior-distinct-from-attribute-behavior
         # upload owners can always view their uploads
@@ -616,6 +1003,339 @@ class Upload(db.Model):
         )
         return or_(is_owner, shared_individually, shared_by_default)
 
+    @classmethod
+    def _indexed_viewable_to(cls, user: User) -> BooleanClauseList:
+        """Evaluate viewable_to with one lookup in the visibility index."""
+        return or_(
+            cls.user_id == user.id,
+            cls.visibility == VisibilityDefault.PUBLIC,
+            UploadViewer.query.filter(
+                and_(
+                    UploadViewer.upload_id == cls.id,
+                    UploadViewer.viewer_id == user.id,
+                )
+            ).exists(),
+        )
+
+
+# Upload Visibility Index
+class UploadViewer(db.Model):
+    """A user granted access to a non-public upload they do not own.
+
+    Materializes the sharing and courtship clauses of Upload.viewable_to so
+    that visibility is a single index lookup. Rows are only maintained and
+    read if settings.VISIBILITY_INDEX is set. Run
+    `flask rebuild-visibility-index` after turning it on.
+    """
+
+    __tablename__ = "upload_viewer"
+    upload_id = db.Column(
+        db.Integer,
+        db.ForeignKey("upload.id", ondelete="CASCADE"),
+        primary_key=True,
+    )
+    viewer_id = db.Column(
+        db.Integer,
+        db.ForeignKey("user.id", ondelete="CASCADE"),
+        primary_key=True,
+    )
+    __table_args__ = (
+        db.Index("ix_upload_viewer_viewer_upload", "viewer_id", "upload_id"),
+    )
+
+    @staticmethod
+    def _grants(*criteria):
+        """:return: a subquery of the (upload_id, viewer_id) pairs granted by
+        sharing or courtships to uploads matching the criteria
+        """
+        R = UserRelationship
+        for_coaches = Upload.visibility.in_(
+            (
+                VisibilityDefault.COACHES_ONLY,
+                VisibilityDefault.FRIENDS_AND_COACHES,
+            )
+        )
+        for_friends = Upload.visibility.in_(
+            (
+                VisibilityDefault.FRIENDS_ONLY,
+                VisibilityDefault.FRIENDS_AND_COACHES,
+            )
+        )
+
+        def grant(viewer_id, onclause, *where):
+            return (
+                select(
+                    Upload.id.label("upload_id"), viewer_id.label("viewer_id")
+                )
+                .join_from(Upload, onclause[0], onclause[1])
+                .where(Upload.visibility != VisibilityDefault.PUBLIC, *where)
+                .where(*criteria)
+            )
+
+        shared = also_shared_with.c
+        return union(
+            grant(
+                shared.user_id,
+                (also_shared_with, shared.upload_id == Upload.id),
+            ),
+            grant(
+                R.user_a_id,
+                (
+                    R,
+                    and_(
+                        R.user_b_id == Upload.user_id,
+                        R.type == RelationshipType.A_COACHES_B,
+                    ),
+                ),
+                for_coaches,
+            ),
+            grant(
+                R.user_b_id,
+                (
+                    R,
+                    and_(
+                        R.user_a_id == Upload.user_id,
+                        R.type == RelationshipType.FRIENDS,
+                    ),
+                ),
+                for_friends,
+            ),
+            grant(
+                R.user_a_id,
+                (
+                    R,
+                    and_(
+                        R.user_b_id == Upload.user_id,
+                        R.type == RelationshipType.FRIENDS,
+                    ),
+                ),
+                for_friends,
+            ),
+        ).subquery()
+
+    @staticmethod
+    def refresh(*criteria, viewer_ids: tuple[int, ...] | None = None) -> None:
+        """Recompute the index rows of uploads matching the criteria.
+
+        Does nothing unless settings.VISIBILITY_INDEX is set. The change is
+        committed along with the rest of the session.
+
+        :param criteria: Filters on Upload. Refreshes every upload if empty.
+        :param viewer_ids: If given, only rows for these viewers are updated
+        """
+        if not settings.VISIBILITY_INDEX:
+            return
+        db.session.flush()
+        stale = UploadViewer.__table__.delete().where(
+            UploadViewer.upload_id.in_(select(Upload.id).where(*criteria))
+        )
+        grants = UploadViewer._grants(*criteria)
+        fresh = select(grants.c.upload_id, grants.c.viewer_id)
+        if viewer_ids is not None:
+            stale = stale.where(UploadViewer.viewer_id.in_(viewer_ids))
+            fresh = fresh.where(grants.c.viewer_id.in_(viewer_ids))
+        db.session.execute(stale)
+        db.session.execute(
+            pg_insert(UploadViewer)
+            .from_select(["upload_id", "viewer_id"], fresh)
+            .on_conflict_do_nothing()
+        )
+
+    @staticmethod
+    def refresh_courtship(a_id: int, b_id: int) -> None:
+        """Refresh the index after a courtship between two users changed."""
+        UploadViewer.refresh(
+            Upload.user_id.in_((a_id, b_id)), viewer_ids=(a_id, b_id)
+        )
+
+    @staticmethod
+    def find_inconsistencies(
+        users: list[User],
+    ) -> dict[int, tuple[set[int], set[int]]]:
+        """Compare the index against the live visibility predicate.
+
+        :return: for every user whose visible uploads differ, the IDs of the
+            uploads the index is missing and the IDs it wrongly grants
+        """
+        inconsistencies = {}
+        for user in users:
+            live = {
+                id
+                for (id,) in db.session.query(Upload.id).filter(
+                    Upload._live_viewable_to(user)
+                )
+            }
+            indexed = {
+                id
+                for (id,) in db.session.query(Upload.id).filter(
+                    Upload._indexed_viewable_to(user)
+                )
+            }
+            if live != indexed:
+                inconsistencies[user.id] = (live - indexed, indexed - live)
+        return inconsistencies
+
+
+# Feed Timeline Table
+class TimelineEntry(db.Model):
+    """An upload in the feed of a user who has a courtship with its owner.
+
+    Entries are fanned out when uploads are shared and when courtships
+    change, so that a feed page is a range scan of the viewer's entries.
+    Run `flask backfill-timelines` to rebuild every timeline.
+    """
+
+    __tablename__ = "timeline_entry"
+    viewer_id = db.Column(
+        db.Integer,
+        db.ForeignKey("user.id", ondelete="CASCADE"),
+        primary_key=True,
+    )
+    upload_id = db.Column(
+        db.Integer,
+        db.ForeignKey("upload.id", ondelete="CASCADE"),
+        primary_key=True,
+    )
+    owner_id = db.Column(
+        db.Integer,
+        db.ForeignKey("user.id", ondelete="CASCADE"),
+        nullable=False,
+    )
+    # copied from the upload, which is never modified
+    created = db.Column(db.DateTime, nullable=False)
+    # the owner's role to the viewer: "friend", "coach", "student", or None
+    # while a courtship request is pending
+    courtship = db.Column(db.String, nullable=True)
+    # feed pages scan these indexes backwards, newest first
+    __table_args__ = (
+        db.Index(
+            "ix_timeline_entry_viewer_created",
+            "viewer_id",
+            "created",
+            "upload_id",
+        ),
+        db.Index(
+            "ix_timeline_entry_viewer_courtship_created",
+            "viewer_id",
+            "courtship",
+            "created",
+            "upload_id",
+        ),
+    )
+
+    @staticmethod
+    def _fan_out(*criteria):
+        """:return: a subquery of the timeline entries of the uploads that
+        match the criteria
+        """
+        R = UserRelationship
+        owner_is_a = R.user_a_id == Upload.user_id
+        viewer_id = case((owner_is_a, R.user_b_id), else_=R.user_a_id)
+        visible = or_(
+            Upload.visibility == VisibilityDefault.PUBLIC,
+            exists().where(
+                and_(
+                    also_shared_with.c.upload_id == Upload.id,
+                    also_shared_with.c.user_id == viewer_id,
+                )
+            ),
+            and_(
+                R.type == RelationshipType.FRIENDS,
+                Upload.visibility.in_(
+                    (
+                        VisibilityDefault.FRIENDS_ONLY,
+                        VisibilityDefault.FRIENDS_AND_COACHES,
+                    )
+                ),
+            ),
+            # the viewer coaches the owner
+            and_(
+                R.type == RelationshipType.A_COACHES_B,
+                ~owner_is_a,
+                Upload.visibility.in_(
+                    (
+                        VisibilityDefault.COACHES_ONLY,
+                        VisibilityDefault.FRIENDS_AND_COACHES,
+                    )
+                ),
+            ),
+        )
+        courtship = case(
+            (R.type == RelationshipType.FRIENDS, "friend"),
+            (
+                and_(R.type == RelationshipType.A_COACHES_B, owner_is_a),
+                "coach",
+            ),
+            (R.type == RelationshipType.A_COACHES_B, "student"),
+            else_=None,
+        )
+        return (
+            select(
+                viewer_id.label("viewer_id"),
+                Upload.id.label("upload_id"),
+                Upload.user_id.label("owner_id"),
+                Upload.created.label("created"),
+                courtship.label("courtship"),
+            )
+            .join_from(
+                Upload, R, or_(owner_is_a, R.user_b_id == Upload.user_id)
+            )
+            .where(visible, *criteria)
+            .subquery()
+        )
+
+    @staticmethod
+    def refresh(*criteria, viewer_ids: tuple[int, ...] | None = None) -> None:
+        """Recompute the timeline entries of uploads matching the criteria.
+
+        The change is committed along with the rest of the session.
+
+        :param criteria: Filters on Upload. Refreshes every upload if empty.
+        :param viewer_ids: If given, only these viewers' entries are updated
+        """
+        db.session.flush()
+        stale = TimelineEntry.__table__.delete().where(
+            TimelineEntry.upload_id.in_(select(Upload.id).where(*criteria))
+        )
+        entries = TimelineEntry._fan_out(*criteria)
+        fresh = select(entries)
+        if viewer_ids is not None:
+            stale = stale.where(TimelineEntry.viewer_id.in_(viewer_ids))
+            fresh = fresh.where(entries.c.viewer_id.in_(viewer_ids))
+        db.session.execute(stale)
+        db.session.execute(
+            pg_insert(TimelineEntry)
+            .from_select(list(entries.c.keys()), fresh)
+            .on_conflict_do_nothing()
+        )
+
+    @staticmethod
+    def refresh_courtship(a_id: int, b_id: int) -> None:
+        """Rebuild both users' timelines of each other's uploads."""
+        TimelineEntry.refresh(
+            Upload.user_id.in_((a_id, b_id)), viewer_ids=(a_id, b_id)
+        )
+
+    @staticmethod
+    def feed_query(viewer: User, courtship: str | None = None):
+        """:return: a query of the viewer's feed uploads, newest first
+
+        :param courtship: only include uploads of owners with this role
+        """
+        # owners are serialized with their uploads
+        query = (
+            Upload.query.join(
+                TimelineEntry, TimelineEntry.upload_id == Upload.id
+            )
+            .filter(TimelineEntry.viewer_id == viewer.id)
+            .options(joinedload(Upload.user))
+        )
+        if courtship is not None:
+            query = query.filter(TimelineEntry.courtship == courtship)
+        return query.order_by(
+            TimelineEntry.created.desc(), TimelineEntry.upload_id.desc()
+        )
+
 
 # Comment Table
 class Comment(db.Model):
@@ -639,13 +1359,124 @@ class Comment(db.Model):
     text = db.Column(db.String, nullable=False)
 
     def serialize(self, client: User):
-        return {
-            "id": self.id,
-            "created": self.created.isoformat(),
-            "author": self.author.serialize(client),
-            "text": self.text,
-            "upload_id": self.upload_id,
-        }
+        return Comment.serialize_many([self], client)[0]
+
+    @staticmethod
+    def serialize_many(comments: list[Comment], client: User) -> list[dict]:
+        """:return: a list of serialized Comments from the perspective of the client"""
+        authors = User.serialize_many([c.author for c in comments], client)
+        return [
+            {
+                "id": c.id,
+                "created": c.created.isoformat(),
+                "author": author,
+                "text": c.text,
+                "upload_id": c.upload_id,
+            }
+            for c, author in zip(comments, authors)
+        ]
+
+
+# Tombstone Table
+class UploadTombstone(db.Model):
+    """An upload removed from the DB whose S3 objects await deletion.
+
+    Tombstones are written in the same transaction that deletes the upload so
+    the reaper can always finish the deletion, even after a crash.
+    """
+
+    __tablename__ = "upload_tombstone"
+    # not a foreign key since the upload row is already gone
+    upload_id = db.Column(db.Integer, primary_key=True)
+    created = db.Column(
+        db.DateTime, nullable=False, default=datetime.datetime.utcnow
+    )
+    attempts = db.Column(db.Integer, nullable=False, default=0)
+    next_attempt = db.Column(
+        db.DateTime,
+        nullable=False,
+        default=datetime.datetime.utcnow,
+        index=True,
+    )
+    last_error = db.Column(db.String, nullable=True)
+
+    @staticmethod
+    def bury(upload_ids: list[int]) -> None:
+        """Schedule the S3 objects of the given uploads for deletion."""
+        db.session.add_all(UploadTombstone(upload_id=id) for id in upload_ids)
+
+
+# Outbound Email Table
+class OutboundEmail(db.Model):
+    """A rendered email waiting to be sent by the email worker.
+
+    Sent emails are deleted. Emails that failed EMAIL_MAX_ATTEMPTS times are
+    kept with their last error for inspection.
+    """
+
+    __tablename__ = "outbound_email"
+    id = db.Column(db.Integer, primary_key=True)
+    created = db.Column(
+        db.DateTime, nullable=False, default=datetime.datetime.utcnow
+    )
+    recipient = db.Column(db.String, nullable=False)
+    subject = db.Column(db.String, nullable=False)
+    html = db.Column(db.Text, nullable=False)
+    text = db.Column(db.Text, nullable=False)
+    attempts = db.Column(db.Integer, nullable=False, default=0)
+    next_attempt = db.Column(
+        db.DateTime,
+        nullable=False,
+        default=datetime.datetime.utcnow,
+        index=True,
+    )
+    last_error = db.Column(db.String, nullable=True)
+
+
+# Rate Limit Bucket Table
+class RateLimitBucket(db.Model):
+    """A token bucket used by ratelimit.DBBuckets.
+
+    Rather than a token count, the bucket stores the time it will be full
+    again. Taking a token pushes that time back by one interval, and is
+    refused if it would be more than a full bucket's worth of intervals away.
+    """
+
+    __tablename__ = "rate_limit_bucket"
+    key = db.Column(db.String, primary_key=True)
+    full_at = db.Column(db.DateTime, nullable=False)
+
+    @staticmethod
+    def take(key: str, capacity: int, interval: float) -> float:
+        """Take a token in the current transaction.
+
+        :return: 0 if a token was taken, or else the seconds until one refills
+        """
+        interval = datetime.timedelta(seconds=interval)
+        now = func.timezone("utc", func.now())
+        table = RateLimitBucket.__table__
+        full_at = func.greatest(table.c.full_at, now)
+        # a token is left if the bucket is full again by this time
+        need = now + (capacity - 1) * interval
+        taken = db.session.execute(
+            pg_insert(table)
+            .values(key=key, full_at=now + interval)
+            .on_conflict_do_update(
+                index_elements=[table.c.key],
+                set_={"full_at": full_at + interval},
+                where=full_at <= need,
+            )
+            .returning(table.c.key)
+        ).first()
+        if taken is not None:
+            return 0.0
+        return float(
+            db.session.execute(
+                select(func.extract("epoch", full_at - need)).where(
+                    table.c.key == key
+                )
+            ).scalar_one()
+        )
 
 
 # Bucket Table
@@ -671,32 +1502,259 @@ class Bucket(db.Model):
 
     def serialize(self, client: User):
         """:return: a serialized Bucket from the perspective of the client"""
+        return Bucket.serialize_many([self], client)[0]
+
+    @staticmethod
+    def serialize_many(buckets: list[Bucket], client: User) -> list[dict]:
+        """Serialize a list of buckets from the perspective of the client.
+
+        Sizes and last modified times are computed for the whole list with a
+        single grouped query.
+
+        :return: a list of serialized Buckets in the same order as buckets
+        """
+        ids = {b.id for b in buckets}
+        if len(ids) == 0:
+            return []
+        summaries = BucketSummary.get_many(ids)
+        # individually shared uploads that the client's audience class
+        # cannot already see
+        shared = (
+            db.session.query(
+                Upload.bucket_id, Upload.visibility, Upload.created
+            )
+            .join(also_shared_with, also_shared_with.c.upload_id == Upload.id)
+            .filter(
+                and_(
+                    Upload.bucket_id.in_(ids),
+                    also_shared_with.c.user_id == client.id,
+                )
+            )
+            .all()
+        )
+        extras = {b.id: [] for b in buckets}
+        owners = {b.id: b.user_id for b in buckets}
+        for bucket_id, visibility, created in shared:
+            audience = BucketSummary.audience(client, owners[bucket_id])
+            if visibility not in _AUDIENCE_VISIBILITIES[audience]:
+                extras[bucket_id].append(created)
+        response = []
+        for b in buckets:
+            audience = BucketSummary.audience(client, b.user_id)
+            size, last_created = summaries[b.id].visible_to(audience)
+            size += len(extras[b.id])
+            last_created = max(
+                (t for t in (last_created, *extras[b.id]) if t is not None),
+                default=None,
+            )
+            response.append(b.serialize_summary(size, last_created))
+        return response
+
+    def serialize_summary(
+        self, size: int, last_created: Optional[datetime.datetime]
+    ) -> dict:
+        """:return: a serialized Bucket given its size and the creation time
+        of its latest upload, from some client's perspective"""
         return {
             "id": self.id,
             "name": self.name,
-            "size": self._size(client),
-            "last_modified": self._get_last_modified(client),
+            "size": size,
+            # an update occurs when a bucket is created or an upload visible
+            # to the client is created inside it
+            "last_modified": (last_created or self.created).isoformat(),
         }
 
-    def _size(self, client: User) -> int:
-        """:return: A nonnegative count of all associated uploads"""
-        return Upload.query.filter(
-            and_(Upload.bucket_id == self.id, Upload.viewable_to(client))
-        ).count()
+    @staticmethod
+    def visible_to(viewer: User, *criteria) -> BaseQuery:
+        """Find the buckets a viewer can see in a single statement.
 
-    def _get_last_modified(self, client) -> str:
-        """:return: The ISO formatted timestamp of this bucket's last update.
+        A bucket is visible to its owner and to anyone who can view one of
+        its uploads.
 
-        An update occurs when a bucket is created or an upload visible to the
-        client has been created inside a bucket.
+        :param criteria: Filters on the buckets considered
+        :return: a query of (Bucket, size, last_created) rows, where size
+            counts the uploads visible to the viewer and last_created is the
+            creation time of the latest, or None if there are none
         """
-        most_recent = (
-            Upload.query.filter(
-                and_(Upload.bucket_id == self.id, Upload.viewable_to(client))
+        size = func.count(Upload.id)
+        return (
+            db.session.query(
+                Bucket,
+                size.label("size"),
+                func.max(Upload.created).label("last_created"),
+            )
+            .outerjoin(
+                Upload,
+                and_(
+                    Upload.bucket_id == Bucket.id, Upload.viewable_to(viewer)
+                ),
             )
-            .order_by(Upload.created.desc())
-            .first()
+            .filter(*criteria)
+            .group_by(Bucket.id)
+            .having(or_(Bucket.user_id == viewer.id, size > 0))
+        )
+
+
+# The visibility defaults that grant each audience class access to an upload.
+# Individual shares are not covered by audience classes.
+_AUDIENCE_VISIBILITIES = {
+    "owner": frozenset(VisibilityDefault),
+    "coach": frozenset(
+        (
+            VisibilityDefault.PUBLIC,
+            VisibilityDefault.FRIENDS_AND_COACHES,
+            VisibilityDefault.COACHES_ONLY,
+        )
+    ),
+    "friend": frozenset(
+        (
+            VisibilityDefault.PUBLIC,
+            VisibilityDefault.FRIENDS_AND_COACHES,
+            VisibilityDefault.FRIENDS_ONLY,
         )
-        if most_recent is None:
-            return self.created.isoformat()
-        return most_recent.created.isoformat()
+    ),
+    "public": frozenset((VisibilityDefault.PUBLIC,)),
+}
+
+# BucketSummary objects keyed by bucket ID. Only this process's writes
+# invalidate entries, so writes by other processes show after the TTL.
+_bucket_summaries = cachetools.TTLCache(
+    maxsize=settings.BUCKET_SUMMARY_CACHE_SIZE,
+    ttl=settings.BUCKET_SUMMARY_TTL_SECS,
+)
+_bucket_summaries_lock = threading.Lock()
+
+
+class BucketSummary:
+    """The upload count and latest upload time of a bucket per visibility
+    default, from which the totals of each audience class are derived.
+
+    Summaries are cached and are forgotten when an upload is created,
+    deleted, moved between buckets or has its visibility changed. Only the
+    writing process forgets them, so other processes may serve sizes and
+    last modified times that are up to BUCKET_SUMMARY_TTL_SECS old.
+    """
+
+    def __init__(
+        self, totals: dict[VisibilityDefault, tuple[int, datetime.datetime]]
+    ) -> None:
+        self.totals = totals
+
+    @staticmethod
+    def get_many(bucket_ids: set[int]) -> dict[int, BucketSummary]:
+        """:return: the summaries of buckets, loading any missing ones with a
+        single grouped query"""
+        with _bucket_summaries_lock:
+            found = {
+                i: _bucket_summaries[i]
+                for i in bucket_ids
+                if i in _bucket_summaries
+            }
+        missing = bucket_ids - found.keys()
+        if len(missing) > 0:
+            rows = (
+                db.session.query(
+                    Upload.bucket_id,
+                    Upload.visibility,
+                    func.count(Upload.id),
+                    func.max(Upload.created),
+                )
+                .filter(Upload.bucket_id.in_(missing))
+                .group_by(Upload.bucket_id, Upload.visibility)
+            )
+            loaded = {i: BucketSummary({}) for i in missing}
+            for bucket_id, visibility, count, latest in rows:
+                loaded[bucket_id].totals[visibility] = (count, latest)
+            with _bucket_summaries_lock:
+                _bucket_summaries.update(loaded)
+            found.update(loaded)
+        return found
+
+    @staticmethod
+    def forget(bucket_ids: Optional[Iterable[int]] = None) -> None:
+        """Drop the cached summaries of buckets, or of every bucket if None."""
+        with _bucket_summaries_lock:
+            if bucket_ids is None:
+                _bucket_summaries.clear()
+                return
+            for bucket_id in bucket_ids:
+                _bucket_summaries.pop(bucket_id, None)
+
+    @staticmethod
+    def audience(client: User, owner_id: int) -> str:
+        """:return: the audience class of the client for an owner's uploads"""
+        if client.id == owner_id:
+            return "owner"
+        if client.coaches(owner_id):
+            return "coach"
+        if client.friends_with(owner_id):
+            return "friend"
+        return "public"
+
+    def visible_to(
+        self, audience: str
+    ) -> tuple[int, Optional[datetime.datetime]]:
+        """:return: the number of uploads an audience class can see by
+        default, and the creation time of the latest, or None if there are
+        none"""
+        visibilities = _AUDIENCE_VISIBILITIES[audience]
+        size, latest = 0, None
+        for visibility, (count, created) in self.totals.items():
+            if visibility in visibilities:
+                size += count
+                latest = created if latest is None else max(latest, created)
+        return size, latest
+
+
+def _changed_buckets(session) -> set[int]:
+    """:return: the buckets whose summaries are changed by a flush"""
+    bucket_ids = set()
+    for obj in (*session.new, *session.deleted):
+        if isinstance(obj, Upload):
+            bucket_ids.add(obj.bucket_id)
+    for obj in session.dirty:
+        if not isinstance(obj, Upload):
+            continue
+        attrs = inspect(obj).attrs
+        # bucket_id keeps active history, so a move has the old ID
+        history = attrs.bucket_id.history
+        if history.has_changes():
+            bucket_ids.update(history.deleted)
+            bucket_ids.update(history.added)
+        if any(
+            attrs[attr].history.has_changes()
+            for attr in ("visibility", "created")
+        ):
+            bucket_ids.add(obj.bucket_id)
+    bucket_ids.discard(None)
+    return bucket_ids
+
+
+def _changed_users(session) -> set[int]:
+    """:return: the users whose cached auth columns may be changed by a
+    flush"""
+    user_ids = {obj.id for obj in session.deleted if isinstance(obj, User)}
+    for obj in session.dirty:
+        if isinstance(obj, User) and session.is_modified(obj):
+            user_ids.add(obj.id)
+    return user_ids
+
+
+@event.listens_for(db.session, "after_flush")
+def _forget_flushed(session, flush_context) -> None:
+    """Forget changed bucket summaries and users now, so that the flushing
+    session does not read stale ones, and again when the transaction ends, so
+    that entries read by other sessions in the meantime are dropped too."""
+    bucket_ids = _changed_buckets(session)
+    BucketSummary.forget(bucket_ids)
+    session.info.setdefault("changed_buckets", set()).update(bucket_ids)
+    user_ids = _changed_users(session)
+    User.forget_cached(user_ids)
+    session.info.setdefault("changed_users", set()).update(user_ids)
+
+
+@event.listens_for(db.session, "after_commit")
+@event.listens_for(db.session, "after_rollback")
+def _forget_committed(session) -> None:
+    BucketSummary.forget(session.info.pop("changed_buckets", ()))
+    User.forget_cached(session.info.pop("changed_users", ()))
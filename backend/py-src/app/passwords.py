@@ -0,0 +1,80 @@
+"""Salts, hashes and verifies passwords with bcrypt.
+
+bcrypt is deliberately slow CPU work. It runs on the request thread, where
+gunicorn's worker count already bounds how many hashes run at once, and
+releases the GIL while it works. The cost factor of new hashes is the
+BCRYPT_ROUNDS setting; existing hashes keep the cost they were made with.
+"""
+
+from __future__ import annotations
+import threading
+import time
+
+import bcrypt
+
+from .settings import BCRYPT_ROUNDS
+
+
+class HasherStats:
+    """Counters describing the passwords hashed in this process."""
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self.n_hashed = 0
+        self.secs_hashing = 0.0
+        self.max_secs = 0.0
+
+    def record(self, secs: float) -> None:
+        with self._lock:
+            self.n_hashed += 1
+            self.secs_hashing += secs
+            self.max_secs = max(self.max_secs, secs)
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return {
+                "n_hashed": self.n_hashed,
+                "mean_secs": (
+                    self.secs_hashing / self.n_hashed
+                    if self.n_hashed > 0
+                    else 0.0
+                ),
+                "max_secs": self.max_secs,
+            }
+
+
+class PasswordHasher:
+    """Hashes and verifies passwords, timing each one."""
+
+    def __init__(self, rounds: int) -> None:
+        """:param rounds: The bcrypt cost factor of new hashes"""
+        self.rounds = rounds
+        self.stats = HasherStats()
+
+    def hash(self, plaintext: str) -> str:
+        """:return: the salted hash of a password"""
+        before = time.perf_counter()
+        # bcrypt automatically stores the salt in the resulting string
+        hash = bcrypt.hashpw(plaintext.encode(), bcrypt.gensalt(self.rounds))
+        self.stats.record(time.perf_counter() - before)
+        return hash.decode()
+
+    def verify(self, plaintext: str, hash: str) -> bool:
+        """:return: True if a password matches a salted hash"""
+        before = time.perf_counter()
+        matches = bcrypt.checkpw(plaintext.encode(), hash.encode())
+        self.stats.record(time.perf_counter() - before)
+        return matches
+
+
+hasher = PasswordHasher(BCRYPT_ROUNDS)
+
+
+def salt_and_hash(plaintext: str) -> str:
+    """Salt and hash a plaintext password"""
+    return hasher.hash(plaintext)
+
+
+def verify_password(plaintext: str, hash: str) -> bool:
+    """Test if a plaintext password matches a hashed password"""
+    return hasher.verify(plaintext, hash)
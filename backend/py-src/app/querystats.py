@@ -0,0 +1,166 @@
+"""Counts and times the SQL statements run while serving each request.
+
+Engine events record every statement run inside a request. After the request
+its statement count, DB time, and slowest statement are added to per-route
+counters, sent as a Server-Timing header in debug mode, and checked for N+1
+patterns: the same statement shape run many times by one request.
+"""
+
+from __future__ import annotations
+import collections
+import logging
+import re
+import threading
+import time
+
+from flask import Flask, Response, g, has_app_context, request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+from . import settings
+
+logger = logging.getLogger(__name__)
+
+# lists of bound values, which vary in length with the rows they match
+_IN_LIST = re.compile(r"IN \((?:__\[POSTCOMPILE_\w+\]|[^()]*)\)")
+
+
+def statement_shape(statement: str) -> str:
+    """:return: a statement with the lengths of IN lists erased"""
+    return _IN_LIST.sub("IN (...)", statement)
+
+
+class RequestQueries:
+    """The statements run while serving one request."""
+
+    def __init__(self) -> None:
+        self.n_statements = 0
+        self.secs = 0.0
+        self.slowest_secs = 0.0
+        self.slowest = ""
+        self.shapes: collections.Counter[str] = collections.Counter()
+
+    def record(self, statement: str, secs: float) -> None:
+        self.n_statements += 1
+        self.secs += secs
+        if secs > self.slowest_secs:
+            self.slowest_secs = secs
+            self.slowest = statement
+        self.shapes[statement_shape(statement)] += 1
+
+    def repeated(self, threshold: int) -> list[tuple[str, int]]:
+        """:return: the shapes run at least threshold times, with counts"""
+        return [(s, n) for s, n in self.shapes.items() if n >= threshold]
+
+    def server_timing(self) -> str:
+        """:return: the value of a Server-Timing header"""
+        return (
+            f'db;dur={self.secs * 1000:.1f};desc="{self.n_statements} '
+            f'statements", db-slowest;dur={self.slowest_secs * 1000:.1f}'
+        )
+
+
+class RouteStats:
+    """Statement counters aggregated per route in this process."""
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._routes: dict[str, dict] = {}
+
+    def record(self, route: str, queries: RequestQueries, n_plus_one: int):
+        """
+        :param n_plus_one: The number of repeated shapes that were flagged
+        """
+        with self._lock:
+            stats = self._routes.setdefault(
+                route,
+                {
+                    "n_requests": 0,
+                    "n_statements": 0,
+                    "max_statements": 0,
+                    "db_secs": 0.0,
+                    "slowest_secs": 0.0,
+                    "slowest": "",
+                    "n_plus_one": 0,
+                },
+            )
+            stats["n_requests"] += 1
+            stats["n_statements"] += queries.n_statements
+            stats["max_statements"] = max(
+                stats["max_statements"], queries.n_statements
+            )
+            stats["db_secs"] += queries.secs
+            if queries.slowest_secs > stats["slowest_secs"]:
+                stats["slowest_secs"] = queries.slowest_secs
+                stats["slowest"] = queries.slowest
+            stats["n_plus_one"] += n_plus_one
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return {
+                route: {
+                    **stats,
+                    "mean_statements": (
+                        stats["n_statements"] / stats["n_requests"]
+                    ),
+                }
+                for route, stats in self._routes.items()
+            }
+
+    def reset(self) -> None:
+        with self._lock:
+            self._routes.clear()
+
+
+route_stats = RouteStats()
+
+
+# the start time is kept on the execution context, which is discarded along
+# with it if the statement fails and after_cursor_execute never runs
+def _before_execute(conn, cursor, statement, parameters, context, many):
+    if context is not None:
+        context._query_start = time.perf_counter()
+
+
+def _after_execute(conn, cursor, statement, parameters, context, many):
+    start = getattr(context, "_query_start", None)
+    secs = 0.0 if start is None else time.perf_counter() - start
+    # background jobs and statements outside of requests are not recorded
+    if has_app_context() and "queries" in g:
+        g.queries.record(statement, secs)
+
+
+def register_query_stats(app: Flask) -> None:
+    """Record the statements of every request served by an app."""
+    if not event.contains(Engine, "before_cursor_execute", _before_execute):
+        event.listen(Engine, "before_cursor_execute", _before_execute)
+        event.listen(Engine, "after_cursor_execute", _after_execute)
+
+    @app.before_request
+    def start_recording():
+        g.queries = RequestQueries()
+
+    @app.after_request
+    def record_queries(response: Response) -> Response:
+        queries: RequestQueries | None = g.pop("queries", None)
+        if queries is None:
+            return response
+        rule = request.url_rule
+        route = f"{request.method} {rule.rule if rule else '<unmatched>'}"
+        repeated = queries.repeated(settings.N_PLUS_ONE_THRESHOLD)
+        for shape, n in repeated:
+            logger.warning(
+                "Possible N+1: %s ran %d statements shaped like: %s",
+                route,
+                n,
+                shape,
+            )
+        route_stats.record(route, queries, len(repeated))
+        if settings.DEBUG:
+            response.headers.add("Server-Timing", queries.server_timing())
+        return response
+
+    @app.teardown_request
+    def stop_recording(exc):
+        # requests that raised skip after_request
+        g.pop("queries", None)
@@ -0,0 +1,97 @@
+"""Provides token bucket rate limits.
+
+A limit allows a burst of `capacity` actions per key and refills one token
+every `interval` seconds. The buckets are kept by a backend: MemoryBuckets
+for a single process, or DBBuckets to share them between every worker.
+"""
+
+from __future__ import annotations
+import math
+import threading
+import time
+from typing import Protocol
+
+from . import settings
+from .models import RateLimitBucket
+
+
+class Buckets(Protocol):
+    def take(self, key: str, capacity: int, interval: float) -> float:
+        """:return: 0 if a token was taken, or else the seconds until one
+        refills"""
+
+
+class MemoryBuckets:
+    """Buckets kept in this process. Each worker process limits separately."""
+
+    def __init__(self, max_size: int = settings.RATE_LIMIT_CACHE_SIZE):
+        """
+        :param max_size: The number of buckets after which full buckets are
+            forgotten
+        """
+        self.max_size = max_size
+        self._lock = threading.Lock()
+        self._full_at: dict[str, float] = {}
+
+    def take(self, key: str, capacity: int, interval: float) -> float:
+        now = time.monotonic()
+        with self._lock:
+            full_at = max(self._full_at.get(key, now), now)
+            wait = full_at - now - (capacity - 1) * interval
+            if wait > 0:
+                return wait
+            if len(self._full_at) >= self.max_size:
+                # a forgotten full bucket is the same as a new one
+                self._full_at = {
+                    k: t for k, t in self._full_at.items() if t > now
+                }
+            self._full_at[key] = full_at + interval
+            return 0.0
+
+
+class DBBuckets:
+    """Buckets in the rate_limit_bucket table, shared by every process.
+
+    Tokens are taken in the caller's transaction, so they are given back if
+    it rolls back.
+    """
+
+    def take(self, key: str, capacity: int, interval: float) -> float:
+        return RateLimitBucket.take(key, capacity, interval)
+
+
+def make_buckets(backend: str = settings.RATE_LIMIT_BACKEND) -> Buckets:
+    """:return: the backend named "db" or "memory" """
+    if backend == "db":
+        return DBBuckets()
+    if backend == "memory":
+        return MemoryBuckets()
+    raise ValueError(f"Unknown rate limit backend {backend}.")
+
+
+class RateLimit:
+    """A named token bucket limit, with one bucket per key."""
+
+    def __init__(
+        self, name: str, capacity: int, interval: float, buckets: Buckets
+    ) -> None:
+        """
+        :param name: Prefixes the keys of this limit's buckets
+        :param capacity: The number of actions allowed in a burst
+        :param interval: The seconds it takes to refill one token
+        """
+        self.name = name
+        self.capacity = capacity
+        self.interval = interval
+        self.buckets = buckets
+
+    def take(self, key: str | int) -> int:
+        """Take a token from a key's bucket.
+
+        :return: 0 if a token was taken, or else the whole seconds until one
+            refills
+        """
+        wait = self.buckets.take(
+            f"{self.name}:{key}", self.capacity, self.interval
+        )
+        return math.ceil(wait)
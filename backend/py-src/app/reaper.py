@@ -0,0 +1,122 @@
+"""Deletes the S3 objects of removed uploads in the background.
+
+Routes that delete uploads only write an UploadTombstone, so their latency no
+longer depends on how many objects an upload has. The reaper drains due
+tombstones in batches and retries failures with exponential backoff.
+"""
+
+from __future__ import annotations
+import datetime
+import threading
+import time
+
+from sqlalchemy import func
+
+from . import aws
+from .background import backoff
+from .extensions import db
+from .models import UploadTombstone
+from .settings import (
+    TOMBSTONE_BATCH_SIZE,
+    TOMBSTONE_RETRY_SECS,
+    TOMBSTONE_MAX_RETRY_SECS,
+)
+
+
+class ReaperStats:
+    """Counters describing the work done by the reaper in this process."""
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self.n_reaped = 0
+        self.n_failures = 0
+        self.n_keys_deleted = 0
+        self.secs_reaping = 0.0
+
+    def record(
+        self, n_reaped: int, n_failures: int, n_keys: int, secs: float
+    ) -> None:
+        with self._lock:
+            self.n_reaped += n_reaped
+            self.n_failures += n_failures
+            self.n_keys_deleted += n_keys
+            self.secs_reaping += secs
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return {
+                "n_reaped": self.n_reaped,
+                "n_failures": self.n_failures,
+                "n_keys_deleted": self.n_keys_deleted,
+                "secs_reaping": self.secs_reaping,
+                "keys_per_sec": (
+                    self.n_keys_deleted / self.secs_reaping
+                    if self.secs_reaping > 0
+                    else 0.0
+                ),
+            }
+
+
+reaper_stats = ReaperStats()
+
+
+def reap_tombstones(batch_size: int = TOMBSTONE_BATCH_SIZE) -> int:
+    """Delete the S3 objects of every due tombstone.
+
+    Due tombstones are locked with SKIP LOCKED so that reapers in several
+    processes never delete the same upload at once.
+
+    :param batch_size: The number of uploads deleted between commits
+    :return: The number of uploads fully deleted from S3
+    """
+    n_reaped = 0
+    while True:
+        now = datetime.datetime.utcnow()
+        batch: list[UploadTombstone] = (
+            UploadTombstone.query.filter(UploadTombstone.next_attempt <= now)
+            .order_by(UploadTombstone.next_attempt)
+            .limit(batch_size)
+            .with_for_update(skip_locked=True)
+            .all()
+        )
+        if len(batch) == 0:
+            return n_reaped
+        before = time.perf_counter()
+        reports = aws.delete_uploads([t.upload_id for t in batch])
+        n_failures = 0
+        for tombstone in batch:
+            report = reports[tombstone.upload_id]
+            if report.ok:
+                db.session.delete(tombstone)
+                continue
+            # failed tombstones are not due again in this run
+            n_failures += 1
+            tombstone.attempts += 1
+            tombstone.last_error = "; ".join(report.errors)
+            tombstone.next_attempt = now + backoff(
+                tombstone.attempts,
+                TOMBSTONE_RETRY_SECS,
+                TOMBSTONE_MAX_RETRY_SECS,
+            )
+        db.session.commit()
+        n_reaped += len(batch) - n_failures
+        reaper_stats.record(
+            len(batch) - n_failures,
+            n_failures,
+            sum(r.n_deleted for r in reports.values()),
+            time.perf_counter() - before,
+        )
+
+
+def tombstone_backlog() -> dict:
+    """:return: the number of pending tombstones and the oldest one's age"""
+    n_pending, oldest = db.session.query(
+        func.count(UploadTombstone.upload_id),
+        func.min(UploadTombstone.created),
+    ).one()
+    age = (
+        (datetime.datetime.utcnow() - oldest).total_seconds()
+        if oldest is not None
+        else 0.0
+    )
+    return {"n_pending": n_pending, "oldest_secs": age}
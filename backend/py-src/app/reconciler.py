@@ -0,0 +1,46 @@
+"""Keeps upload conversion state in sync with AWS MediaConvert.
+
+Serializing an upload never talks to AWS. Instead, the jobs of all uploads
+that are still converting are polled here in batches.
+"""
+
+from . import aws
+from .extensions import db
+from .models import Upload
+from .settings import CONVERT_RECONCILE_BATCH_SIZE
+
+
+def reconcile_convert_statuses(
+    batch_size: int = CONVERT_RECONCILE_BATCH_SIZE,
+) -> int:
+    """Poll the MediaConvert job of every converting upload once.
+
+    Uploads whose jobs have completed become stream ready. Canceled and
+    failed jobs are recorded and never polled again.
+
+    :param batch_size: The number of jobs polled between commits
+    :return: The number of uploads whose status changed
+    """
+    n_changed = 0
+    last_id = 0
+    while True:
+        # rows locked by a callback are left for the next poll, so a stale
+        # status is never written over the one the callback records
+        batch: list[Upload] = (
+            Upload.query.filter(Upload.converting(), Upload.id > last_id)
+            .order_by(Upload.id)
+            .limit(batch_size)
+            .with_for_update(skip_locked=True)
+            .all()
+        )
+        if len(batch) == 0:
+            return n_changed
+        last_id = batch[-1].id
+        statuses = aws.get_mediaconvert_statuses(
+            [up.mediaconvert_job_id for up in batch]
+        )
+        for up in batch:
+            status = statuses.get(up.mediaconvert_job_id)
+            if status is not None and up.set_convert_status(status):
+                n_changed += 1
+        db.session.commit()
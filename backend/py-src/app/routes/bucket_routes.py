@@ -6,8 +6,8 @@ import json
 from flask import request
 import flask_login
 from . import routes, success_response, failure_response
-from .. import aws, email
-from ..models import Bucket
+from .. import email
+from ..models import Bucket, UploadTombstone
 from ..extensions import db
 
 
@@ -60,12 +60,13 @@ def create_bucket():
 def get_buckets(user_id):
     me = flask_login.current_user
     user_id = me.id if user_id == "me" else user_id
-    buckets = Bucket.query.filter_by(user_id=user_id)
+    buckets = Bucket.visible_to(me, Bucket.user_id == user_id)
 
     return success_response(
         {
             "buckets": [
-                b.serialize(me) for b in buckets if me.can_view_bucket(b)
+                b.serialize_summary(size, last_created)
+                for b, size, last_created in buckets
             ]
         }
     )
@@ -123,7 +124,7 @@ def delete_bucket(bucket_id):
     # Delete bucket and associated uploads
     # Note that deleting like this respects the cascades defined at the ORM level
     # Bucket.query.filter_by(...).delete() does not respect cascades!
-    aws.delete_uploads([u.id for u in bucket.uploads])
+    UploadTombstone.bury([u.id for u in bucket.uploads])
     db.session.delete(bucket)
     db.session.commit()
 
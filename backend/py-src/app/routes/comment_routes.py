@@ -4,6 +4,7 @@ import json
 
 from flask import request
 import flask_login
+from sqlalchemy.orm import joinedload
 from . import routes, success_response, failure_response
 from .. import email
 from ..models import Comment, Upload
@@ -39,13 +40,13 @@ def get_all_comments():
     #     comments = comments.join(Comment.author, aliased=True).filter_by(type=user_type)
 
     # Create response
-    return success_response(
-        {
-            "comments": [
-                c.serialize(me) for c in comments if me.can_view_comment(c)
-            ]
-        }
+    visible = (
+        comments.join(Comment.upload)
+        .filter(Upload.viewable_to(me))
+        .options(joinedload(Comment.author))
+        .all()
     )
+    return success_response({"comments": Comment.serialize_many(visible, me)})
 
 
 @routes.route("/comments/", methods=["POST"])
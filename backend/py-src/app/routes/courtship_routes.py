@@ -4,17 +4,23 @@ import datetime
 import json
 
 
-from flask import request
-from flask_sqlalchemy import Pagination
-from sqlalchemy import or_, and_
-from sqlalchemy.sql import func
+from flask import current_app, request
+from sqlalchemy import or_
 import flask_login
 from . import routes, success_response, failure_response
-from .. import email
+from .pagination import (
+    InvalidPage,
+    Page,
+    encode_cursor,
+    paginate,
+    parse_page_args,
+)
+from .. import email, search
 from ..models import (
     User,
     Upload,
     UserRelationship,
+    TimelineEntry,
     RelationshipType,
     rel_req_of_str,
 )
@@ -30,34 +36,34 @@ def search_users():
     query = request.args.get("q")
     if query is None:
         return failure_response("Missing query URL parameter.", 400)
-    if request.args.get("page") is None:
-        return failure_response("Missing page URL parameter.", 400)
     # empty query returns no users
+    page = Page([], False, None)
     if len(query.strip()) > 0:
-        # Search
-        query = query.lower()
-        pagination: Pagination = User.query.filter(
-            and_(
-                # exclude client
-                User.id != me.id,
-                # search names and usernames
-                or_(
-                    func.lower(User.display_name).startswith(query),
-                    User.username.startswith(
-                        query
-                    ),  # username is already lowercase
-                ),
-            )
-        ).paginate(
-            error_out=True
-        )  # Pagination class automatically checks query for params
-        has_next = pagination.has_next
-        items = pagination.items
-        found = items if items is not None else []
+        try:
+            args = parse_page_args((int, str, int))
+        except InvalidPage as e:
+            return failure_response(e.message, 400)
+        # legacy page numbers are served by skipping earlier matches, and
+        # one extra match tells whether there is a next page
+        matches = search.search_users(
+            query,
+            me,
+            current_app.config["SEARCH_TRIGRAMS"],
+            args.offset + args.per_page + 1,
+            args.after,
+        )[args.offset :]
+        items = matches[: args.per_page]
+        has_next = len(matches) > args.per_page
+        page = Page(
+            [m.user for m in items],
+            has_next,
+            encode_cursor(items[-1].sort_key) if has_next else None,
+        )
     return success_response(
         {
-            "has_next": has_next,
-            "users": [u.serialize(me) for u in found],
+            "has_next": page.has_next,
+            "next_cursor": page.next_cursor,
+            "users": User.serialize_many(page.items, me),
         }
     )
 
@@ -98,6 +104,7 @@ def create_courtship_request():
 
     # Create courtship request
     db.session.add(courtship)
+    courtship.refresh_derived()
     db.session.commit()
 
     return success_response(other.serialize(me), code=201)
@@ -142,9 +149,12 @@ def get_courtship_requests():
         else:
             return failure_response("Invalid dir.", 400)
 
-    return success_response(
-        {"requests": [c.get_other(me).serialize(me) for c in courtships]}
+    others = (
+        courtships.join(User, User.id == UserRelationship.other_id_of(me.id))
+        .with_entities(User)
+        .all()
     )
+    return success_response({"requests": User.serialize_many(others, me)})
 
 
 @routes.route("/courtships/requests/<int:other_user_id>/", methods=["PUT"])
@@ -189,11 +199,13 @@ def update_incoming_courtship_request(other_user_id):
             rel.type = RelationshipType.A_COACHES_B
 
         rel.last_changed = datetime.datetime.utcnow()
+        rel.update_counts(1)
     elif status == "decline":
         # Delete relationship
         db.session.delete(rel)
     else:
         return failure_response("Invalid status.", 400)
+    rel.refresh_derived()
 
     db.session.commit()
     return success_response(code=204)
@@ -216,6 +228,7 @@ def delete_outgoing_courtship_request(other_user_id):
 
     # Delete relationship
     db.session.delete(rel)
+    rel.refresh_derived()
     db.session.commit()
 
     return success_response(code=204)
@@ -257,9 +270,12 @@ def get_all_courtships(user_id):
         else:
             return failure_response("Invalid type.", 400)
 
-    return success_response(
-        {"courtships": [c.get_other(me).serialize(me) for c in courtships]}
+    others = (
+        courtships.join(User, User.id == UserRelationship.other_id_of(user_id))
+        .with_entities(User)
+        .all()
     )
+    return success_response({"courtships": User.serialize_many(others, me)})
 
 
 @routes.route("/courtships/<int:other_user_id>/", methods=["DELETE"])
@@ -281,7 +297,9 @@ def remove_courtship(other_user_id):
         return failure_response("Courtship not found.", 404)
 
     # Delete courtship 💔
+    rel.update_counts(-1)
     db.session.delete(rel)
+    rel.refresh_derived()
     db.session.commit()
 
     return success_response(code=204)
@@ -299,42 +317,27 @@ def get_feed():
         if type not in ("friend", "coach", "student"):
             return failure_response("Invalid type.", 400)
 
-    # map type to filtering function
-    cship_type_fns = {
-        None: lambda other_id: True,
-        "friend": me.friends_with,
-        "student": me.coaches,
-        "coach": me.student_of,
-    }
-
-    if request.args.get("page") is None:
-        return failure_response("Missing page URL parameter.", 400)
-
-    pagination: Pagination = (
-        Upload.query.filter(
-            and_(
-                me.has_courtship_with(Upload.user_id),
-                Upload.viewable_to(me),
-                # exclude client's uploads
-                Upload.user_id != me.id,
-                # Upload.stream_ready, # TODO: only show uploads in feed that are completed
-                # filter by courtship type
-                cship_type_fns[type](Upload.user_id),
-            )
+    # TODO: only show uploads in feed that are completed
+    try:
+        page = paginate(
+            TimelineEntry.feed_query(me, type),
+            (TimelineEntry.created, TimelineEntry.upload_id),
+            lambda up: (up.created, up.id),
+            descending=True,
         )
-        .order_by(Upload.created.desc())
-        .paginate(error_out=True)
-    )  # Pagination class automatically checks query for params
-    has_next = pagination.has_next
-    uploads: list[Upload] = (
-        pagination.items if pagination.items is not None else []
-    )
+    except InvalidPage as e:
+        return failure_response(e.message, 400)
+    uploads: list[Upload] = page.items
+    users = User.serialize_many([up.user for up in uploads], me)
     return success_response(
         {
-            "has_next": has_next,
+            "has_next": page.has_next,
+            "next_cursor": page.next_cursor,
             "feed": [
-                {"user": up.user.serialize(me), "upload": up.serialize(me)}
-                for up in uploads
+                {"user": user, "upload": upload}
+                for user, upload in zip(
+                    users, Upload.serialize_many(uploads, me)
+                )
             ],
         }
     )
@@ -0,0 +1,142 @@
+"""Provides keyset (cursor) pagination for list routes.
+
+Clients page through results by passing back the opaque `next_cursor` of the
+previous page. Each page is a single indexed range scan that never counts or
+skips rows. The legacy `page` parameter is still accepted and is served with
+OFFSET.
+"""
+
+from __future__ import annotations
+import base64
+import binascii
+import datetime
+import json
+from dataclasses import dataclass
+from typing import Any, Callable
+
+from flask import request
+from flask_sqlalchemy import BaseQuery
+from sqlalchemy import tuple_
+from sqlalchemy.sql.expression import ColumnElement
+
+DEFAULT_PER_PAGE = 20
+MAX_PER_PAGE = 100
+
+
+class InvalidPage(Exception):
+    """The pagination parameters of a request are malformed."""
+
+    def __init__(self, message: str) -> None:
+        self.message = message
+        super().__init__(message)
+
+
+@dataclass
+class Page:
+    items: list
+    has_next: bool
+    # None on the last page
+    next_cursor: str | None
+
+
+def encode_cursor(values: tuple) -> str:
+    """:return: an opaque, URL-safe token holding the sort key values"""
+    raw = json.dumps(
+        [
+            v.isoformat() if isinstance(v, datetime.datetime) else v
+            for v in values
+        ]
+    )
+    return base64.urlsafe_b64encode(raw.encode()).decode()
+
+
+def decode_cursor(cursor: str, types: tuple[type, ...]) -> tuple:
+    """:return: the sort key values held by a cursor
+
+    :raise InvalidPage: if the cursor was not made for sort keys of these types
+    """
+    try:
+        values = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        assert type(values) == list and len(values) == len(types)
+        parsed = []
+        for value, python_type in zip(values, types):
+            if python_type == datetime.datetime:
+                value = datetime.datetime.fromisoformat(value)
+            assert type(value) == python_type
+            parsed.append(value)
+        return tuple(parsed)
+    except (
+        AssertionError,
+        binascii.Error,
+        TypeError,
+        UnicodeDecodeError,
+        ValueError,
+    ):
+        raise InvalidPage("Invalid cursor.")
+
+
+@dataclass
+class PageArgs:
+    per_page: int
+    # 1 when a cursor is given
+    page: int
+    # the sort key values after which the page starts, if a cursor is given
+    after: tuple | None
+
+    @property
+    def offset(self) -> int:
+        return (self.page - 1) * self.per_page
+
+
+def parse_page_args(types: tuple[type, ...]) -> PageArgs:
+    """Read the `cursor` or `page` and `per_page` URL parameters.
+
+    :param types: The types of the sort key values
+    :raise InvalidPage: if the URL parameters are malformed
+    """
+    per_page = request.args.get("per_page", DEFAULT_PER_PAGE, type=int)
+    if not 1 <= per_page <= MAX_PER_PAGE:
+        raise InvalidPage(f"per_page must be between 1 and {MAX_PER_PAGE}.")
+    cursor = request.args.get("cursor")
+    if cursor is not None:
+        return PageArgs(per_page, 1, decode_cursor(cursor, types))
+    page = request.args.get("page", 1, type=int)
+    if page < 1:
+        raise InvalidPage("Invalid page.")
+    return PageArgs(per_page, page, None)
+
+
+def paginate(
+    query: BaseQuery,
+    columns: tuple[ColumnElement, ...],
+    key: Callable[[Any], tuple],
+    descending: bool = False,
+) -> Page:
+    """Get the page of a query requested by the `cursor` or `page` and
+    `per_page` URL parameters.
+
+    :param query: The query to paginate. Its ordering is replaced.
+    :param columns: Unique sort key columns, ideally covered by an index
+    :param key: Gets the sort key values of a result
+    :param descending: Sort by columns in descending instead of ascending order
+    :raise InvalidPage: if the URL parameters are malformed
+    """
+    args = parse_page_args(tuple(c.type.python_type for c in columns))
+    per_page = args.per_page
+    query = query.order_by(None).order_by(
+        *(c.desc() if descending else c.asc() for c in columns)
+    )
+    if args.after is not None:
+        if descending:
+            query = query.filter(tuple_(*columns) < tuple_(*args.after))
+        else:
+            query = query.filter(tuple_(*columns) > tuple_(*args.after))
+    else:
+        query = query.offset(args.offset)
+    # fetch one extra row to learn whether there is a next page
+    rows = query.limit(per_page + 1).all()
+    items = rows[:per_page]
+    has_next = len(rows) > per_page
+    return Page(
+        items, has_next, encode_cursor(key(items[-1])) if has_next else None
+    )
@@ -1,16 +1,37 @@
 """Routes that pertain to uploads."""
 
+import hashlib
+import hmac
 import json
-from typing import TypedDict
+from functools import wraps
+from typing import Callable, TypedDict
+from urllib.parse import unquote_plus
 from flask import make_response, request
 import flask_login
+from sqlalchemy import and_
 
 from . import routes, success_response, failure_response
 from .. import aws, email
-from ..models import User, Bucket, Upload, VisibilityDefault, visib_of_str
+from ..models import (
+    User,
+    Bucket,
+    Upload,
+    UploadTombstone,
+    VisibilityDefault,
+    visib_of_str,
+)
 from ..cookiesigner import CookieSigner
 from ..extensions import db
-from ..settings import CF_PUBLIC_KEY_ID, S3_CF_DOMAIN, S3_CF_SUBDOMAIN
+from ..settings import (
+    CALLBACK_SECRET,
+    CF_COOKIE_REFRESH_SECS,
+    CF_COOKIE_TTL_HOURS,
+    CF_PUBLIC_KEY_ID,
+    S3_CF_DOMAIN,
+    S3_CF_SUBDOMAIN,
+    SIGNED_URL_CACHE_SIZE,
+    SIGNED_URL_WINDOW_SECS,
+)
 
 
 @routes.route("/users/me/uploads")
@@ -40,14 +61,8 @@ def get_all_uploads():
             return failure_response("User not found.")
         uploads = uploads.filter(Upload.viewable_to(sw_user))
 
-    return success_response(
-        {
-            "uploads": [
-                up.serialize(me)
-                for up in uploads.filter(Upload.viewable_to(me))
-            ]
-        }
-    )
+    uploads = uploads.filter(Upload.viewable_to(me)).all()
+    return success_response({"uploads": Upload.serialize_many(uploads, me)})
 
 
 @routes.route("/users/<int:other_id>/uploads")
@@ -56,8 +71,10 @@ def get_all_uploads():
 def get_all_uploads_other_user(other_id):
     me = flask_login.current_user
 
-    # Get other user's uploads
-    uploads = Upload.query.filter_by(user_id=other_id)
+    # Get other user's uploads that I can view
+    uploads = Upload.query.filter(
+        and_(Upload.user_id == other_id, Upload.viewable_to(me))
+    )
 
     # Optionally filter by bucket
     bucket_id = request.args.get("bucket")
@@ -65,14 +82,23 @@ def get_all_uploads_other_user(other_id):
         uploads = uploads.filter_by(bucket_id=bucket_id)
 
     return success_response(
-        {
-            "uploads": [
-                up.serialize(me) for up in uploads if me.can_view_upload(up)
-            ]
-        }
+        {"uploads": Upload.serialize_many(uploads.all(), me)}
     )
 
 
+# Cookies are scoped to the CloudFront domain so that they are also sent back
+# to this API, which lets get_upload skip signing when they are still valid.
+# cookies only grant access to one upload's stream, and are reused by every
+# viewer of the upload within a signed URL window
+_cookie_signer = CookieSigner(
+    expiration_in_hrs=CF_COOKIE_TTL_HOURS,
+    cf_key_id=CF_PUBLIC_KEY_ID,
+    window_secs=SIGNED_URL_WINDOW_SECS,
+    cache_size=SIGNED_URL_CACHE_SIZE,
+)
+_hls_root = f"https://{S3_CF_SUBDOMAIN}.{S3_CF_DOMAIN}"
+
+
 @routes.route("/uploads/<int:upload_id>/")
 @flask_login.login_required
 @email.email_conf_required
@@ -91,37 +117,22 @@ def get_upload(upload_id):
     response = upload.serialize(me)
 
     if upload.stream_ready:
-        signer = CookieSigner(expiration_in_hrs=1, cf_key_id=CF_PUBLIC_KEY_ID)
-        url = (
-            "https://"
-            + S3_CF_SUBDOMAIN
-            + "."
-            + S3_CF_DOMAIN
-            + "/uploads/"
-            + str(upload_id)
-            + "/hls/"
-        )
-        cookies = signer.generate_signed_cookies(url=(url + "*"))
+        url = f"{_hls_root}/uploads/{upload_id}/hls/"
         response["url"] = url + "index.m3u8"
         response = make_response(response)
-        response.set_cookie(
-            key="CloudFront-Policy",
-            value=cookies["CloudFront-Policy"],
-            domain=S3_CF_DOMAIN,
-            secure=True,
-        )
-        response.set_cookie(
-            key="CloudFront-Signature",
-            value=cookies["CloudFront-Signature"],
-            domain=S3_CF_DOMAIN,
-            secure=True,
-        )
-        response.set_cookie(
-            key="CloudFront-Key-Pair-Id",
-            value=cookies["CloudFront-Key-Pair-Id"],
-            domain=S3_CF_DOMAIN,
-            secure=True,
-        )
+        # skip signing if the client's cookies already grant access
+        if not _cookie_signer.cookies_cover(
+            request.cookies, url + "index.m3u8", CF_COOKIE_REFRESH_SECS
+        ):
+            cookies = _cookie_signer.generate_signed_cookies(url=url + "*")
+            for key, value in cookies.items():
+                response.set_cookie(
+                    key=key,
+                    value=value,
+                    max_age=CF_COOKIE_TTL_HOURS * 3600,
+                    domain=S3_CF_DOMAIN,
+                    secure=True,
+                )
         return response
 
     return success_response(response)
@@ -243,7 +254,8 @@ def create_upload_url():
 @flask_login.login_required
 @email.email_conf_required
 def start_convert(upload_id):
-    upload = Upload.query.filter_by(id=upload_id).first()
+    # locked so that this and the S3 upload callback start one conversion
+    upload = Upload.query.filter_by(id=upload_id).with_for_update().first()
 
     if upload is None:
         return failure_response("Upload not found.")
@@ -252,14 +264,21 @@ def start_convert(upload_id):
     if not user.can_modify_upload(upload):
         return failure_response("User forbidden to modify upload.", 403)
 
-    # create convert job
-    convert_job_id = aws.create_mediaconvert_job(upload_id, upload.filename)
-    upload.mediaconvert_job_id = convert_job_id
-    db.session.commit()
+    # conversion may have already been started by the S3 upload callback
+    if upload.mediaconvert_job_id is None:
+        start_conversion(upload)
+        db.session.commit()
 
     return success_response(code=204)
 
 
+def start_conversion(upload: Upload) -> None:
+    """Create a MediaConvert job for an upload. Does not commit."""
+    convert_job_id = aws.create_mediaconvert_job(upload.id, upload.filename)
+    upload.mediaconvert_job_id = convert_job_id
+    upload.set_convert_status(aws.ConvertStatus.SUBMITTED)
+
+
 @routes.route("/uploads/<int:upload_id>/", methods=["PUT"])
 @flask_login.login_required
 @email.email_conf_required
@@ -298,8 +317,7 @@ def edit_upload(upload_id):
         try:
             vis_default, shared_with = parse_visibility_req(me, visibility)
             upload.visibility = vis_default
-            upload.unshare_with_all()
-            upload.share_with(shared_with)
+            upload.share_with(shared_with, replace=True)
         except BadRequest as b:
             return failure_response(b.message, b.code)
 
@@ -323,7 +341,7 @@ def delete_upload(upload_id):
 
     # Delete upload
     db.session.delete(upload)
-    aws.delete_uploads([upload_id])
+    UploadTombstone.bury([upload_id])
     db.session.commit()
 
     return success_response(code=204)
@@ -348,9 +366,101 @@ def get_download_url(upload_id):
     )
 
 
-# TODO: autodetect S3 uploads
-# @routes.route("/api/callback/s3upload/", methods=['POST'])
-# def upload_callback():
-#     """Called by AWS after a successful upload to the S3 bucket"""
-#     # TODO: create mediaconvert job and add upload to database
-#     pass
+def callback_signature_required(route: Callable) -> Callable:
+    """Decorator that rejects callbacks that were not signed by AWS forwarders.
+
+    The X-Callback-Signature header must contain the hex encoded
+    HMAC-SHA256 of the raw request body keyed with CALLBACK_SECRET.
+    """
+
+    @wraps(route)
+    def verify(*args, **kwargs):
+        expected = hmac.new(
+            CALLBACK_SECRET.encode(), request.get_data(), hashlib.sha256
+        ).hexdigest()
+        signature = request.headers.get("X-Callback-Signature", "")
+        if not hmac.compare_digest(expected, signature):
+            return failure_response("Invalid callback signature.", 401)
+        return route(*args, **kwargs)
+
+    return verify
+
+
+def parse_callback_body() -> dict:
+    """:return: the JSON object posted to a callback route
+
+    :raise BadRequest: if the body is not a JSON object
+    """
+    try:
+        body = json.loads(request.data)
+    except ValueError:
+        raise BadRequest("Callback body is not valid JSON.", 400)
+    if not isinstance(body, dict):
+        raise BadRequest("Callback body is not a JSON object.", 400)
+    return body
+
+
+@routes.route("/callbacks/s3upload/", methods=["POST"])
+@callback_signature_required
+def upload_callback():
+    """Called by AWS after objects are created in the S3 bucket.
+
+    Starts converting each original upload. Accepts S3 event notifications.
+    """
+    try:
+        records = parse_callback_body().get("Records", [])
+        keys = [unquote_plus(r["s3"]["object"]["key"]) for r in records]
+    except BadRequest as b:
+        return failure_response(b.message, b.code)
+    except (KeyError, TypeError, AttributeError):
+        return failure_response("Invalid S3 event record.", 400)
+    for key in keys:
+        # original uploads are stored at uploads/<upload id>/<filename>
+        parts = key.split("/", 2)
+        if len(parts) != 3 or parts[0] != "uploads" or not parts[1].isdigit():
+            continue
+        _, upload_id, filename = parts
+        # locked so that concurrent events start one conversion
+        upload = (
+            Upload.query.filter_by(id=int(upload_id)).with_for_update().first()
+        )
+        # ignore deleted uploads, convert output, and duplicate events
+        if (
+            upload is None
+            or upload.filename != filename
+            or upload.mediaconvert_job_id is not None
+        ):
+            continue
+        start_conversion(upload)
+    db.session.commit()
+    return success_response(code=204)
+
+
+@routes.route("/callbacks/mediaconvert/", methods=["POST"])
+@callback_signature_required
+def mediaconvert_callback():
+    """Called by AWS when a MediaConvert job changes state.
+
+    Accepts "MediaConvert Job State Change" EventBridge events. Events that
+    arrive after a later state of the same job are ignored.
+    """
+    try:
+        detail = parse_callback_body().get("detail")
+    except BadRequest as b:
+        return failure_response(b.message, b.code)
+    if not isinstance(detail, dict):
+        return failure_response("Invalid MediaConvert event.", 400)
+    job_id = detail.get("jobId")
+    status = aws.ConvertStatus.__members__.get(str(detail.get("status")))
+    if not isinstance(job_id, str) or status is None:
+        return failure_response("Invalid MediaConvert event.", 400)
+    upload = (
+        Upload.query.filter_by(mediaconvert_job_id=job_id)
+        .with_for_update()
+        .first()
+    )
+    if upload is None:
+        return failure_response("Upload not found.", 404)
+    upload.set_convert_status(status)
+    db.session.commit()
+    return success_response(code=204)
@@ -1,15 +1,11 @@
-import bcrypt
 import json
 import re
 import jwt
-from jwt.algorithms import RSAAlgorithm
-import requests
-import time
 
 import flask_login
 from . import routes, success_response, failure_response
 
-from .. import aws
+from .. import jwks
 from ..cookiesigner import CookieSigner
 from ..email import (
     EmailFailed,
@@ -19,28 +15,17 @@ from ..email import (
     send_forgot_pwd_email,
     confirm_user_token,
 )
-from ..models import User, LoginMethods
+from ..models import User, LoginMethods, UploadTombstone
+from ..passwords import salt_and_hash, verify_password
 from ..settings import G_CLIENT_IDS, APPLE_CLIENT_ID
 from ..extensions import db
 
 from flask import request
 
 from google.oauth2 import id_token
-from google.auth.transport import requests as g_requests
 from google.auth.exceptions import GoogleAuthError
 
 
-def salt_and_hash(plaintext: str) -> str:
-    """Salt and hash a plaintext password"""
-    # bcrypt automatically stores the salt in the resulting string
-    return bcrypt.hashpw(plaintext.encode(), bcrypt.gensalt()).decode()
-
-
-def verify_password(plaintext: str, hash: str) -> bool:
-    """Test if a plaintext password matches a hashed password"""
-    return bcrypt.checkpw(plaintext.encode(), hash.encode())
-
-
 class InvalidStr(Exception):
     """Generic exception that describes why a string is invalid."""
 
@@ -298,10 +283,11 @@ def register():
         password_hash=salt_and_hash(password),
     )
 
+    # flush for the user ID, which the confirmation email's token contains
     db.session.add(user)
-    db.session.commit()
+    db.session.flush()
 
-    # Send confirmation email - must be after commit bc function uses user ID
+    # Queue confirmation email, committing it along with the user
     send_conf_email(user)
 
     # Begin user session
@@ -345,41 +331,6 @@ def login_w_password(email: str, plaintext: str) -> User:
     return user
 
 
-APPLE_PUBLIC_KEYS = None  # cache
-APPLE_KEY_CACHE_EXP = 60 * 60 * 24  # expire after 1 day
-APPLE_LAST_KEY_FETCH = 0
-
-
-def _fetch_apple_public_key(unverified_kid):
-    """Fetch a specific public RSA key posted by Apple.
-
-    :param unverified_kid: the unverified key ID specified in a JWT header
-    :raise IndexError: if the unverified_kid does not match any public keys
-    """
-    # from https://gist.github.com/davidhariri/b053787aabc9a8a9cc0893244e1549fe
-    # Check to see if the public key is unset or is stale before returning
-    global APPLE_LAST_KEY_FETCH
-    global APPLE_PUBLIC_KEYS
-
-    if (APPLE_LAST_KEY_FETCH + APPLE_KEY_CACHE_EXP) < int(
-        time.time()
-    ) or APPLE_PUBLIC_KEYS is None:
-        key_payload = requests.get(
-            "https://appleid.apple.com/auth/keys"
-        ).json()
-        APPLE_PUBLIC_KEYS = key_payload["keys"]
-        APPLE_LAST_KEY_FETCH = int(time.time())
-
-    try:
-        matching_key = next(
-            k for k in APPLE_PUBLIC_KEYS if k["kid"] == unverified_kid
-        )
-    except StopIteration:
-        raise IndexError("Cannot find Key ID in Apple's public keys.")
-    matching_key = RSAAlgorithm.from_jwk(json.dumps(matching_key))
-    return matching_key
-
-
 def login_w_apple(token: str) -> tuple[User, bool]:
     """Retrieve or create a user who has signed in with Apple.
 
@@ -391,7 +342,7 @@ def login_w_apple(token: str) -> tuple[User, bool]:
         kid_from_header = jwt.get_unverified_header(token)["kid"]
         decoded = jwt.decode(
             token,
-            _fetch_apple_public_key(kid_from_header),
+            jwks.apple_keys.get(kid_from_header),
             audience=APPLE_CLIENT_ID,
             algorithms=["RS256"],
             options={"verify_signature": True},
@@ -415,6 +366,8 @@ def login_w_apple(token: str) -> tuple[User, bool]:
         raise LoginError("Apple token has expired.", 400)
     except jwt.exceptions.InvalidAudienceError:
         raise LoginError("Apple token has invalid audience (client ID).", 400)
+    except jwks.KeysUnavailable:
+        raise LoginError("Could not fetch Apple's public keys.", 503)
     except (
         jwt.exceptions.InvalidTokenError,
         IndexError,
@@ -484,12 +437,18 @@ def login_w_google(token: str) -> tuple[User, bool]:
         )
     else:
         # Verify token with specified OAuth client IDs
+        # Google's certificates are served from the cache
         try:
+            kid = jwt.get_unverified_header(token)["kid"]
             idinfo = id_token.verify_oauth2_token(
-                token, g_requests.Request(), G_CLIENT_IDS
+                token,
+                jwks.CachedCertsRequest(jwks.google_keys, kid),
+                G_CLIENT_IDS,
             )
-        except ValueError:
+        except (ValueError, KeyError, jwt.exceptions.InvalidTokenError):
             raise LoginError("Token verification failed. Unauthorized.", 401)
+        except jwks.KeysUnavailable:
+            raise LoginError("Could not fetch Google's public keys.", 503)
         except GoogleAuthError:
             raise LoginError("Invalid token issuer. Unauthorized.", 401)
         # parse user information
@@ -696,7 +655,8 @@ def delete_me():
     me: User = flask_login.current_user
 
     # TODO: delete profile picture
-    aws.delete_uploads([u.id for u in me.uploads])
+    UploadTombstone.bury([u.id for u in me.uploads])
+    me.leave_courtships()
     # Delete user.
     # It is the DB's responsibility to ensure deletion of rows containing
     # foreign keys. Cascades at the DB-level are signficantly faster than ORM.
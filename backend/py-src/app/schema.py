@@ -0,0 +1,64 @@
+"""Upgrades databases created before the current models.
+
+db.create_all() creates missing tables but never alters existing ones. The
+columns and indexes added to existing tables are listed here and added by
+`flask upgrade-db`, which also builds the user search indexes and fills the
+tables and columns that are derived from other rows. Every step is
+idempotent, so the command can be run on each deploy.
+"""
+
+from __future__ import annotations
+
+from sqlalchemy import text
+
+from . import settings
+from .extensions import db
+from .models import TimelineEntry, Upload, UploadViewer, User
+from .search import create_search_indexes
+
+# columns and indexes added to tables that existed before them
+_ADDED_TO_EXISTING_TABLES = (
+    'ALTER TABLE "user" '
+    "ADD COLUMN IF NOT EXISTS n_friends INTEGER NOT NULL DEFAULT 0, "
+    "ADD COLUMN IF NOT EXISTS n_coaches INTEGER NOT NULL DEFAULT 0, "
+    "ADD COLUMN IF NOT EXISTS n_students INTEGER NOT NULL DEFAULT 0",
+    "ALTER TABLE upload "
+    "ADD COLUMN IF NOT EXISTS mediaconvert_status convertstatus",
+    "CREATE INDEX IF NOT EXISTS ix_user_relationship_user_b_id "
+    "ON user_relationship (user_b_id)",
+)
+
+
+def upgrade_schema() -> list[str]:
+    """Bring the tables up to date with the models and fill derived data.
+
+    Courtship counts are always recounted. The feed timelines and the
+    visibility index are only built when they are empty, since they are kept
+    up to date once built.
+
+    :return: a description of each step that was taken
+    """
+    steps = []
+    db.create_all()
+    # enum types are only created along with new tables
+    Upload.__table__.c.mediaconvert_status.type.create(
+        db.session.connection(), checkfirst=True
+    )
+    for ddl in _ADDED_TO_EXISTING_TABLES:
+        db.session.execute(text(ddl))
+    steps.append("Added any missing columns and indexes.")
+    User.recount_courtships()
+    steps.append("Recounted courtships.")
+    if TimelineEntry.query.first() is None:
+        TimelineEntry.refresh()
+        steps.append("Built the feed timelines.")
+    if settings.VISIBILITY_INDEX and UploadViewer.query.first() is None:
+        UploadViewer.refresh()
+        steps.append("Built the visibility index.")
+    db.session.commit()
+    # built concurrently, outside of the transaction above
+    if create_search_indexes():
+        steps.append("Created any missing search indexes.")
+    else:
+        steps.append("Created any missing search indexes, without pg_trgm.")
+    return steps
@@ -0,0 +1,167 @@
+"""Ranked user search served by prefix and trigram indexes.
+
+Matches are found in tiers, best first. Each tier is read in the order of a
+btree index on `(key COLLATE "C", id)`, so prefix tiers are index range scans
+that stop as soon as a page is full, however many users match. If the pg_trgm
+extension can be installed, GIN trigram indexes also serve substring and
+typo-tolerant tiers.
+
+The indexes are built by `flask upgrade-db`. At startup the app only checks
+whether pg_trgm is installed.
+"""
+
+from __future__ import annotations
+from dataclasses import dataclass
+
+from sqlalchemy import func, or_, text, tuple_
+from sqlalchemy.exc import DBAPIError
+from sqlalchemy.sql.expression import ColumnElement
+
+from .extensions import db
+from .models import User
+
+# the "C" collation compares bytes, so btree indexes under it serve both
+# LIKE prefix patterns and ordering
+_PREFIX_INDEXES = {
+    "ix_user_username_prefix": '"user" ((username COLLATE "C"), id)',
+    "ix_user_display_name_prefix": (
+        '"user" ((lower(display_name) COLLATE "C"), id)'
+    ),
+}
+_TRIGRAM_INDEXES = {
+    "ix_user_username_trgm": '"user" USING gin (username gin_trgm_ops)',
+    "ix_user_display_name_trgm": (
+        '"user" USING gin (lower(display_name) gin_trgm_ops)'
+    ),
+}
+# trigram indexes cannot serve substring patterns shorter than a trigram
+MIN_FUZZY_LEN = 3
+
+
+@dataclass
+class Match:
+    # 0 is the best tier
+    tier: int
+    user: User
+    # the user's sort key within the tier
+    key: str
+
+    @property
+    def sort_key(self) -> tuple[int, str, int]:
+        """:return: the position of the match among all matches"""
+        return self.tier, self.key, self.user.id
+
+
+def _create_index(conn, name: str, on: str) -> None:
+    """Build an index without blocking writes to its table.
+
+    :param conn: A connection in autocommit mode
+    :param on: The table and definition of the index
+    """
+    # a failed concurrent build leaves an invalid index behind, which
+    # IF NOT EXISTS would keep
+    invalid = conn.execute(
+        text(
+            "SELECT 1 FROM pg_index JOIN pg_class ON pg_class.oid = indexrelid "
+            "WHERE relname = :name AND NOT indisvalid"
+        ),
+        {"name": name},
+    ).first()
+    if invalid is not None:
+        conn.execute(text(f"DROP INDEX CONCURRENTLY IF EXISTS {name}"))
+    conn.execute(
+        text(f"CREATE INDEX CONCURRENTLY IF NOT EXISTS {name} ON {on}")
+    )
+
+
+def create_search_indexes() -> bool:
+    """Create any missing search indexes. Must not be called inside a
+    transaction.
+
+    :return: True if trigram matching is supported by the database
+    """
+    engine = db.engine.execution_options(isolation_level="AUTOCOMMIT")
+    with engine.connect() as conn:
+        for name, on in _PREFIX_INDEXES.items():
+            _create_index(conn, name, on)
+        try:
+            conn.execute(text("CREATE EXTENSION IF NOT EXISTS pg_trgm"))
+        except DBAPIError:
+            return False
+        for name, on in _TRIGRAM_INDEXES.items():
+            _create_index(conn, name, on)
+    return True
+
+
+def trigrams_available() -> bool:
+    """:return: True if the pg_trgm extension is installed"""
+    installed = db.session.execute(
+        text("SELECT 1 FROM pg_extension WHERE extname = 'pg_trgm'")
+    ).first()
+    return installed is not None
+
+
+def _tiers(
+    q: str, trigrams: bool
+) -> list[tuple[ColumnElement, ColumnElement]]:
+    """:return: the (predicate, sort key) of each tier, best first"""
+    # username is already lowercase
+    username = User.username.collate("C")
+    name = func.lower(User.display_name)
+    name_key = name.collate("C")
+    tiers = [
+        (User.username == q, username),
+        (username.startswith(q, autoescape=True), username),
+        (name_key.startswith(q, autoescape=True), name_key),
+    ]
+    if trigrams and len(q) >= MIN_FUZZY_LEN:
+        tiers += [
+            (name.contains(" " + q, autoescape=True), name_key),
+            (
+                or_(
+                    User.username.contains(q, autoescape=True),
+                    name.contains(q, autoescape=True),
+                ),
+                name_key,
+            ),
+            (or_(User.username.op("%")(q), name.op("%")(q)), name_key),
+        ]
+    return tiers
+
+
+def search_users(
+    q: str,
+    client: User,
+    trigrams: bool,
+    limit: int,
+    after: tuple[int, str, int] | None = None,
+) -> list[Match]:
+    """Find users by username or display name, best matches first.
+
+    Matches are ranked by tier: exact username, username prefix, display name
+    prefix and, with trigrams, display name word prefix, substring of either,
+    and similar spelling of either. Users are only matched by their best tier.
+
+    :param q: The search text. Case insensitive.
+    :param client: The searching user, who is never found
+    :param trigrams: Whether substring and fuzzy matching are enabled
+    :param limit: The maximum number of matches to find
+    :param after: Only find matches after this `Match.sort_key`
+    """
+    tiers = _tiers(q.strip().lower(), trigrams)
+    first = 0 if after is None else after[0]
+    matches = []
+    for i in range(first, len(tiers)):
+        if len(matches) >= limit:
+            break
+        predicate, key = tiers[i]
+        query = db.session.query(User, key).filter(
+            User.id != client.id,
+            predicate,
+            *(~better for better, _ in tiers[:i]),
+        )
+        if i == first and after is not None:
+            query = query.filter(tuple_(key, User.id) > tuple_(*after[1:]))
+        rows = query.order_by(key, User.id).limit(limit - len(matches))
+        matches += [Match(i, user, k) for user, k in rows]
+    return matches
@@ -2,6 +2,7 @@
 Most configuration is set via environment variables.
 For local development, use a .env file to set environment variables.
 """
+
 import os
 from environs import Env
 
@@ -25,10 +26,95 @@ S3_BUCKET_REGION = env.str("S3_BUCKET_REGION")
 S3_CF_DOMAIN = env.str("S3_CF_DOMAIN")
 S3_CF_SUBDOMAIN = env.str("S3_CF_SUBDOMAIN")
 VIEW_DOCS_KEY = env.str("VIEW_DOCS_KEY", default=os.urandom(24))
+# required to read the internal metrics endpoint. Must be set, since a
+# random default would differ between worker processes.
+METRICS_KEY = env.str("METRICS_KEY")
+# shared secret used by AWS event forwarders to sign callback requests
+CALLBACK_SECRET = env.str("CALLBACK_SECRET")
+
+# signed URL expirations are rounded up to the end of a window of this many
+# seconds so that URLs can be reused by the server, clients, and the CDN
+SIGNED_URL_WINDOW_SECS = env.int("SIGNED_URL_WINDOW_SECS", default=900)
+SIGNED_URL_CACHE_SIZE = env.int("SIGNED_URL_CACHE_SIZE", default=10000)
+# threads used to list and to delete upload objects in S3
+S3_DELETE_WORKERS = env.int("S3_DELETE_WORKERS", default=8)
+
+# CloudFront cookies granting access to the HLS stream of one upload
+CF_COOKIE_TTL_HOURS = env.int("CF_COOKIE_TTL_HOURS", default=1)
+# cookies are reissued when they have fewer than this many seconds left
+CF_COOKIE_REFRESH_SECS = env.int("CF_COOKIE_REFRESH_SECS", default=300)
+
+# read upload visibility from the materialized upload_viewer table instead
+# of evaluating sharing and courtships in every query
+VISIBILITY_INDEX = env.bool("VISIBILITY_INDEX", default=False)
+
+# bucket sizes and last modified times are cached for this many seconds.
+# Each process forgets the entries its own writes change, but the other
+# worker processes serve their cached sizes until the entries expire. Kept
+# short, since that lag is visible to users.
+BUCKET_SUMMARY_TTL_SECS = env.int("BUCKET_SUMMARY_TTL_SECS", default=5)
+BUCKET_SUMMARY_CACHE_SIZE = env.int("BUCKET_SUMMARY_CACHE_SIZE", default=10000)
+
+# the login method and email confirmation of authenticated users are cached
+# for this many seconds. Changes by other processes show once entries expire.
+USER_CACHE_TTL_SECS = env.int("USER_CACHE_TTL_SECS", default=30)
+USER_CACHE_SIZE = env.int("USER_CACHE_SIZE", default=10000)
+
+# the bcrypt cost factor of new password hashes
+BCRYPT_ROUNDS = env.int("BCRYPT_ROUNDS", default=12)
+
+# the public keys of Apple and Google sign-in are refreshed in the background
+# once older than the TTL, and fetched before use once older than the max
+# staleness. Keys are fetched at most once per min refetch interval, so
+# unknown key IDs and too stale keys fail fast while a provider is down.
+JWKS_TTL_SECS = env.int("JWKS_TTL_SECS", default=3600)
+JWKS_MAX_STALE_SECS = env.int("JWKS_MAX_STALE_SECS", default=86400)
+JWKS_MIN_REFETCH_SECS = env.int("JWKS_MIN_REFETCH_SECS", default=60)
+JWKS_FETCH_TIMEOUT_SECS = env.float("JWKS_FETCH_TIMEOUT_SECS", default=5)
+
+# token bucket rate limits are kept in the "db", shared by every process, or
+# in "memory", limiting each process separately
+RATE_LIMIT_BACKEND = env.str("RATE_LIMIT_BACKEND", default="db")
+RATE_LIMIT_CACHE_SIZE = env.int("RATE_LIMIT_CACHE_SIZE", default=10000)
+
+# requests that run the same statement at least this many times are logged
+# as possible N+1 queries
+N_PLUS_ONE_THRESHOLD = env.int("N_PLUS_ONE_THRESHOLD", default=10)
+
+# background workers, which only run in the `flask run-workers` process
+# seconds between MediaConvert status polls, 0 disables the poller.
+# Conversions are normally finished by the MediaConvert callback. The poller
+# catches uploads whose callback was lost, which would otherwise never
+# become stream ready.
+CONVERT_RECONCILE_INTERVAL = env.int(
+    "CONVERT_RECONCILE_INTERVAL", default=300
+)
+CONVERT_RECONCILE_BATCH_SIZE = env.int(
+    "CONVERT_RECONCILE_BATCH_SIZE", default=50
+)
+# seconds between runs of the reaper that deletes removed uploads from S3,
+# 0 disables the reaper
+TOMBSTONE_REAP_INTERVAL = env.int("TOMBSTONE_REAP_INTERVAL", default=30)
+TOMBSTONE_BATCH_SIZE = env.int("TOMBSTONE_BATCH_SIZE", default=20)
+# failed deletions are retried after this many seconds, doubling per attempt
+TOMBSTONE_RETRY_SECS = env.int("TOMBSTONE_RETRY_SECS", default=60)
+TOMBSTONE_MAX_RETRY_SECS = env.int("TOMBSTONE_MAX_RETRY_SECS", default=86400)
 
 # mail settings
 SES_REGION = "us-east-2"
 SES_SENDER = "My Ace <noreply@mail.myace.ai>"
+# seconds between sends of queued emails, 0 disables the sender
+EMAIL_SEND_INTERVAL = env.int("EMAIL_SEND_INTERVAL", default=5)
+EMAIL_BATCH_SIZE = env.int("EMAIL_BATCH_SIZE", default=50)
+# the maximum number of concurrent SES requests per process
+EMAIL_SEND_WORKERS = env.int("EMAIL_SEND_WORKERS", default=4)
+EMAIL_MAX_ATTEMPTS = env.int("EMAIL_MAX_ATTEMPTS", default=8)
+EMAIL_RETRY_SECS = env.int("EMAIL_RETRY_SECS", default=30)
+EMAIL_MAX_RETRY_SECS = env.int("EMAIL_MAX_RETRY_SECS", default=3600)
+# each user may be sent a burst of this many confirmation and password reset
+# emails, and one more every EMAIL_RATE_LIMIT_SECS
+EMAIL_RATE_LIMIT_BURST = env.int("EMAIL_RATE_LIMIT_BURST", default=1)
+EMAIL_RATE_LIMIT_SECS = env.int("EMAIL_RATE_LIMIT_SECS", default=90)
 
 # Application configuration
 ENV = env.str("FLASK_ENV", default="production")
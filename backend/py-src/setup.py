@@ -9,6 +9,7 @@ setup(
         "bcrypt",
         "boto3",
         "botocore",
+        "cachetools",
         "cffi",
         "cryptography",
         "environs",
@@ -0,0 +1,4 @@
+"""Microbenchmarks. Run a module directly, e.g.
+
+python -m tests.benchmarks.bench_cf_signing
+"""
@@ -0,0 +1,62 @@
+"""Compare CloudFront URL signing with and without the shared signing service.
+
+The legacy path parses the PEM private key and builds a CloudFrontSigner for
+every URL, which is what each thumbnail in a list response used to cost.
+"""
+
+import argparse
+import datetime
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from botocore.signers import CloudFrontSigner
+from cryptography.hazmat.backends import default_backend
+from cryptography.hazmat.primitives import hashes, serialization
+from cryptography.hazmat.primitives.asymmetric import padding
+
+from app import aws
+from app.settings import CF_PRIVATE_KEY, CF_PUBLIC_KEY_ID
+
+
+def legacy_presigned_url(key: str, expiration: datetime.datetime) -> str:
+    """The per-call signing path that predates CloudFrontSigningService."""
+
+    def rsa_sign(message):
+        private_key = serialization.load_pem_private_key(
+            CF_PRIVATE_KEY, password=None, backend=default_backend()
+        )
+        return private_key.sign(message, padding.PKCS1v15(), hashes.SHA1())
+
+    signer = CloudFrontSigner(CF_PUBLIC_KEY_ID, rsa_sign)
+    return signer.generate_presigned_url(
+        f"{aws.cf_domain}/{key}", date_less_than=expiration
+    )
+
+
+def service_presigned_url(key: str, expiration: datetime.datetime) -> str:
+    return aws.cf_signing.generate_presigned_url(
+        f"{aws.cf_domain}/{key}", expiration
+    )
+
+
+def bench(sign, n: int, n_threads: int) -> float:
+    """:return: URLs signed per second"""
+    expiration = datetime.datetime.utcnow() + datetime.timedelta(hours=1)
+    keys = [f"uploads/{i}/thumbnail.0000000.jpg" for i in range(n)]
+    before = time.perf_counter()
+    with ThreadPoolExecutor(n_threads) as pool:
+        list(pool.map(lambda k: sign(k, expiration), keys))
+    return n / (time.perf_counter() - before)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("-n", type=int, default=2000, help="URLs to sign")
+    parser.add_argument("--threads", type=int, default=1)
+    args = parser.parse_args()
+    legacy = bench(legacy_presigned_url, args.n, args.threads)
+    service = bench(service_presigned_url, args.n, args.threads)
+    print(f"per-call key parsing: {legacy:10.1f} URLs/sec")
+    print(f"signing service:      {service:10.1f} URLs/sec")
+    print(f"speedup:              {service / legacy:10.2f}x")
+    print(f"service counters:     {aws.cf_signing.stats()}")
@@ -0,0 +1,64 @@
+"""Compare sequential and parallel deletion of uploads from S3.
+
+Both paths run against an in-memory S3 stand-in whose requests sleep to mimic
+network round trips. The sequential path is the single-page listing loop that
+predates the thread pools, except that it follows continuation tokens so both
+paths delete the same keys.
+"""
+
+import argparse
+import time
+
+from app import aws
+from app.settings import S3_BUCKET_NAME
+from tests.fakes import FakeS3
+
+
+def sequential_delete_uploads(upload_ids: list[int]) -> None:
+    """List and delete each upload one request at a time."""
+    for id in upload_ids:
+        kwargs = {"Bucket": S3_BUCKET_NAME, "Prefix": f"uploads/{id}/"}
+        while True:
+            res = aws._s3.list_objects_v2(**kwargs)
+            keys = [obj["Key"] for obj in res.get("Contents", [])]
+            if keys:
+                aws._s3.delete_objects(
+                    Bucket=S3_BUCKET_NAME,
+                    Delete={"Objects": [{"Key": k} for k in keys]},
+                )
+            if not res.get("IsTruncated"):
+                break
+            kwargs["ContinuationToken"] = res["NextContinuationToken"]
+
+
+def bench(delete, n_uploads: int, n_segments: int, latency: float) -> float:
+    """:return: seconds taken to delete every upload"""
+    s3 = FakeS3(latency=latency)
+    for id in range(n_uploads):
+        s3.put_keys(
+            f"uploads/{id}/hls/segment{i:05}.ts" for i in range(n_segments)
+        )
+    aws._s3 = s3
+    before = time.perf_counter()
+    delete(list(range(n_uploads)))
+    elapsed = time.perf_counter() - before
+    assert not s3.keys, "not every key was deleted"
+    return elapsed
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--uploads", type=int, default=20)
+    parser.add_argument("--segments", type=int, default=2500)
+    parser.add_argument(
+        "--latency", type=float, default=0.05, help="seconds per request"
+    )
+    args = parser.parse_args()
+    params = (args.uploads, args.segments, args.latency)
+    sequential = bench(sequential_delete_uploads, *params)
+    parallel = bench(aws.delete_uploads, *params)
+    n_keys = args.uploads * args.segments
+    print(f"keys deleted:         {n_keys:10}")
+    print(f"sequential:           {sequential:10.2f} s")
+    print(f"parallel, pipelined:  {parallel:10.2f} s")
+    print(f"speedup:              {sequential / parallel:10.2f}x")
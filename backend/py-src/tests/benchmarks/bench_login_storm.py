@@ -0,0 +1,95 @@
+"""Measure the latency of an unrelated route during a storm of logins.
+
+Threads log in with a password as fast as they can while the main thread
+times requests to /health/, once for each bcrypt cost factor given. Under
+gunicorn the storm can take at most one core per worker; this shows what the
+cost factor does to login throughput and to the other routes meanwhile.
+
+WARNING: this drops and recreates every table. Only point it at a scratch
+database.
+"""
+
+import argparse
+import statistics
+import threading
+import time
+
+from app import create_app, passwords
+from app.extensions import db
+from app.models import User
+from app.passwords import PasswordHasher
+
+EMAIL = "storm@email.com"
+PASSWORD = "Password1!"
+
+
+def storm(
+    app, hasher: PasswordHasher, n_threads: int, secs: float
+) -> tuple[list[float], dict[int, int]]:
+    """:return: the /health/ latencies in ms and the login status counts"""
+    passwords.hasher = hasher
+    stopped = threading.Event()
+    statuses: dict[int, int] = {}
+    lock = threading.Lock()
+
+    def log_in():
+        client = app.test_client()
+        body = {"method": "password", "email": EMAIL, "password": PASSWORD}
+        while not stopped.is_set():
+            status = client.post("/login/", json=body).status_code
+            with lock:
+                statuses[status] = statuses.get(status, 0) + 1
+
+    threads = [threading.Thread(target=log_in) for _ in range(n_threads)]
+    for t in threads:
+        t.start()
+    client = app.test_client()
+    latencies = []
+    deadline = time.perf_counter() + secs
+    while time.perf_counter() < deadline:
+        before = time.perf_counter()
+        assert client.get("/health/").status_code == 200
+        latencies.append((time.perf_counter() - before) * 1000)
+        time.sleep(0.01)
+    stopped.set()
+    for t in threads:
+        t.join()
+    return latencies, statuses
+
+
+def report(name: str, latencies: list[float], statuses: dict[int, int]):
+    quantiles = statistics.quantiles(latencies, n=100)
+    print(
+        f"{name:>9}: /health/ p50 {quantiles[49]:7.1f} ms, "
+        f"p99 {quantiles[98]:7.1f} ms, max {max(latencies):7.1f} ms; "
+        f"logins by status {dict(sorted(statuses.items()))}"
+    )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--threads", type=int, default=16)
+    parser.add_argument("--secs", type=float, default=10)
+    parser.add_argument("--rounds", type=int, nargs="+", default=[10, 12])
+    parser.add_argument(
+        "--yes", action="store_true", help="confirm dropping every table"
+    )
+    args = parser.parse_args()
+    if not args.yes:
+        parser.error("this drops every table, pass --yes to continue")
+
+    app = create_app()
+    for rounds in args.rounds:
+        hasher = PasswordHasher(rounds)
+        with app.app_context():
+            db.drop_all()
+            db.create_all()
+            db.session.add(
+                User("Storm", EMAIL, password_hash=hasher.hash(PASSWORD))
+            )
+            db.session.commit()
+            db.session.remove()
+        latencies, statuses = storm(app, hasher, args.threads, args.secs)
+        report(f"{rounds} rounds", latencies, statuses)
+    with app.app_context():
+        db.drop_all()
@@ -0,0 +1,105 @@
+"""Compare user search before and after the search indexes at 1M users.
+
+The legacy query filters by lowercased display name and username prefixes
+with no usable index, and counts every match. The ranked search reads the
+first page of the same matches tier by tier from the prefix indexes (and the
+trigram indexes, if pg_trgm is available).
+
+WARNING: this drops and recreates every table. Only point it at a scratch
+database.
+"""
+
+import argparse
+import time
+
+from sqlalchemy import and_, func, or_, text
+
+from app import create_app
+from app.extensions import db
+from app.models import User
+from app.search import create_search_indexes, search_users
+
+QUERIES = ("a", "ma", "mar", "jo", "lee", "zzq", "user12345")
+
+POPULATE = """
+INSERT INTO "user" (username, email, display_name, biography, login_method,
+                    google_id, n_friends, n_coaches, n_students)
+SELECT 'user' || i, 'user' || i || '@email.com',
+       (ARRAY['Mary', 'John', 'Maria', 'Joe', 'Lee', 'Ana', 'Marco'])
+           [1 + i % 7] || ' ' || initcap(substr(md5(i::text), 1, 6)),
+       '', 'GOOGLE', 'google' || i, 0, 0, 0
+FROM generate_series(1, :n) AS i
+"""
+
+
+def legacy_search(q: str, client: User) -> list:
+    """The first page of the unindexed filter that predates the search module."""
+    return (
+        User.query.filter(
+            and_(
+                User.id != client.id,
+                or_(
+                    func.lower(User.display_name).startswith(q),
+                    User.username.startswith(q),
+                ),
+            )
+        )
+        .paginate(page=1, per_page=20, error_out=False)
+        .items
+    )
+
+
+def ranked_search(q: str, client: User, trigrams: bool) -> list:
+    """The first page of the ranked search, as served by the route."""
+    return search_users(q, client, trigrams, 21)[:20]
+
+
+def bench(search, n_repeats: int) -> float:
+    """:return: the mean milliseconds per query"""
+    before = time.perf_counter()
+    for _ in range(n_repeats):
+        for q in QUERIES:
+            search(q)
+    return (time.perf_counter() - before) / n_repeats / len(QUERIES) * 1000
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--users", type=int, default=1_000_000)
+    parser.add_argument("--repeats", type=int, default=5)
+    parser.add_argument(
+        "--yes", action="store_true", help="confirm dropping every table"
+    )
+    args = parser.parse_args()
+    if not args.yes:
+        parser.error("this drops every table, pass --yes to continue")
+
+    app = create_app()
+    with app.app_context():
+        db.drop_all()
+        db.create_all()
+        before = time.perf_counter()
+        db.session.execute(text(POPULATE), {"n": args.users})
+        db.session.commit()
+        db.session.execute(text("ANALYZE"))
+        print(
+            f"populated {args.users} users in "
+            f"{time.perf_counter() - before:.1f} s"
+        )
+        client = User.query.first()
+        legacy = bench(lambda q: legacy_search(q, client), args.repeats)
+        before = time.perf_counter()
+        trigrams = create_search_indexes()
+        db.session.execute(text("ANALYZE"))
+        print(
+            f"built search indexes (trigrams: {trigrams}) in "
+            f"{time.perf_counter() - before:.1f} s"
+        )
+        ranked = bench(
+            lambda q: ranked_search(q, client, trigrams), args.repeats
+        )
+        print(f"legacy filter:  {legacy:8.2f} ms/query")
+        print(f"ranked search:  {ranked:8.2f} ms/query")
+        print(f"speedup:        {legacy / ranked:8.2f}x")
+        db.session.remove()
+        db.drop_all()
@@ -0,0 +1,205 @@
+"""Compare visibility queries with and without the upload visibility index.
+
+Populates the configured database with synthetic users, courtships and
+uploads, then times the queries behind profile upload counts and the feed
+with the live predicate and with the materialized index. The first feed page
+is also read from the fan-out timelines.
+
+WARNING: this drops and recreates every table. Only point it at a scratch
+database.
+"""
+
+import argparse
+import random
+import time
+
+from sqlalchemy import and_, func, insert, text
+
+from app import create_app, settings
+from app.extensions import db
+from app.models import (
+    Bucket,
+    LoginMethods,
+    TimelineEntry,
+    RelationshipType,
+    Upload,
+    UploadViewer,
+    User,
+    UserRelationship,
+    VisibilityDefault,
+    also_shared_with,
+)
+
+
+def populate(n_users: int, n_uploads: int, n_friends: int, n_coaches: int):
+    """Insert synthetic rows with bulk core INSERTs."""
+    rng = random.Random(0)
+    db.session.execute(
+        insert(User.__table__),
+        [
+            {
+                "username": f"user{i}",
+                "email": f"user{i}@email.com",
+                "display_name": f"User {i}",
+                "login_method": LoginMethods.GOOGLE,
+                "google_id": f"google{i}",
+            }
+            for i in range(n_users)
+        ],
+    )
+    ids = [id for (id,) in db.session.query(User.id).order_by(User.id)]
+    rels = []
+    for i, a in enumerate(ids):
+        for d in range(1, n_friends + n_coaches + 1):
+            rels.append(
+                {
+                    "user_a_id": a,
+                    "user_b_id": ids[(i + d) % n_users],
+                    "type": (
+                        RelationshipType.FRIENDS
+                        if d <= n_friends
+                        else RelationshipType.A_COACHES_B
+                    ),
+                }
+            )
+    db.session.execute(insert(UserRelationship.__table__), rels)
+    db.session.execute(
+        insert(Bucket.__table__),
+        [{"user_id": id, "name": "bucket"} for id in ids],
+    )
+    buckets = dict(db.session.query(Bucket.user_id, Bucket.id))
+    visibilities = list(VisibilityDefault)
+    uploads = []
+    for i in range(n_uploads):
+        owner = ids[i % n_users]
+        uploads.append(
+            {
+                "user_id": owner,
+                "bucket_id": buckets[owner],
+                "filename": "vid.mp4",
+                "display_title": f"Upload {i}",
+                "visibility": visibilities[i % len(visibilities)],
+            }
+        )
+    db.session.execute(insert(Upload.__table__), uploads)
+    upload_ids = [id for (id,) in db.session.query(Upload.id)]
+    shares = {
+        (id, rng.choice(ids)) for id in rng.sample(upload_ids, n_uploads // 10)
+    }
+    db.session.execute(
+        insert(also_shared_with),
+        [{"upload_id": u, "user_id": v} for u, v in shares],
+    )
+    db.session.commit()
+
+
+def profile_counts(viewer: User, owners: list[int]) -> list:
+    """The grouped count behind User.serialize_many."""
+    return (
+        db.session.query(Upload.user_id, func.count(Upload.id))
+        .filter(and_(Upload.user_id.in_(owners), Upload.viewable_to(viewer)))
+        .group_by(Upload.user_id)
+        .order_by(Upload.user_id)
+        .all()
+    )
+
+
+def feed_page(viewer: User, owners: list[int]) -> list:
+    """The first page of the feed."""
+    return [
+        up.id
+        for up in Upload.query.filter(
+            and_(
+                viewer.has_courtship_with(Upload.user_id),
+                Upload.viewable_to(viewer),
+                Upload.user_id != viewer.id,
+            )
+        )
+        .order_by(Upload.created.desc(), Upload.id.desc())
+        .limit(20)
+    ]
+
+
+def timeline_page(viewer: User, owners: list[int]) -> list:
+    """The first page of the feed read from the viewer's timeline."""
+    return [up.id for up in TimelineEntry.feed_query(viewer).limit(20)]
+
+
+def visible_count(viewer: User, owners: list[int]) -> int:
+    """Every upload visible to the viewer."""
+    return (
+        db.session.query(func.count(Upload.id))
+        .filter(Upload.viewable_to(viewer))
+        .scalar()
+    )
+
+
+def bench(query, viewers: list[User], owners: list[int], indexed: bool):
+    """:return: the mean seconds per query and the results"""
+    settings.VISIBILITY_INDEX = indexed
+    results = []
+    before = time.perf_counter()
+    for viewer in viewers:
+        results.append(query(viewer, owners))
+    return (time.perf_counter() - before) / len(viewers), results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--users", type=int, default=2000)
+    parser.add_argument("--uploads", type=int, default=100_000)
+    parser.add_argument("--friends", type=int, default=10)
+    parser.add_argument("--coaches", type=int, default=5)
+    parser.add_argument("--viewers", type=int, default=50)
+    parser.add_argument(
+        "--yes", action="store_true", help="confirm dropping every table"
+    )
+    args = parser.parse_args()
+    if not args.yes:
+        parser.error("this drops every table, pass --yes to continue")
+
+    app = create_app()
+    with app.app_context():
+        db.drop_all()
+        db.create_all()
+        before = time.perf_counter()
+        populate(args.users, args.uploads, args.friends, args.coaches)
+        print(f"populated in {time.perf_counter() - before:.1f} s")
+        settings.VISIBILITY_INDEX = True
+        before = time.perf_counter()
+        UploadViewer.refresh()
+        db.session.commit()
+        print(
+            f"built index of {UploadViewer.query.count()} rows in "
+            f"{time.perf_counter() - before:.1f} s"
+        )
+        before = time.perf_counter()
+        TimelineEntry.refresh()
+        db.session.commit()
+        print(
+            f"backfilled {TimelineEntry.query.count()} timeline entries in "
+            f"{time.perf_counter() - before:.1f} s"
+        )
+        db.session.execute(text("ANALYZE"))
+        rng = random.Random(1)
+        viewers = rng.sample(User.query.all(), args.viewers)
+        owners = [u.id for u in rng.sample(User.query.all(), 20)]
+        for query in (profile_counts, feed_page, visible_count):
+            live, expected = bench(query, viewers, owners, indexed=False)
+            indexed, actual = bench(query, viewers, owners, indexed=True)
+            assert actual == expected, f"{query.__name__} results differ"
+            print(
+                f"{query.__name__:15} live {live * 1000:8.2f} ms"
+                f"   indexed {indexed * 1000:8.2f} ms"
+                f"   speedup {live / indexed:6.2f}x"
+            )
+        live, expected = bench(feed_page, viewers, owners, indexed=False)
+        timeline, actual = bench(timeline_page, viewers, owners, indexed=False)
+        assert actual == expected, "timeline results differ"
+        print(
+            f"{'timeline_page':15} live {live * 1000:8.2f} ms"
+            f"  timeline {timeline * 1000:8.2f} ms"
+            f"   speedup {live / timeline:6.2f}x"
+        )
+        db.session.remove()
+        db.drop_all()
@@ -0,0 +1,141 @@
+"""Records the SQL statements and AWS calls made by each request, so that
+tests can hold routes to a budget and catch N+1 regressions."""
+
+from __future__ import annotations
+import contextlib
+import functools
+from dataclasses import dataclass, field
+from typing import Iterator
+
+from flask.testing import FlaskClient
+from sqlalchemy import event
+
+from app import aws, email
+from app.extensions import db
+
+# the module attributes holding each AWS client
+AWS_CLIENTS = (
+    (aws, "_s3"),
+    (aws, "_cloudfront"),
+    (aws, "_mediaconvert"),
+    (email, "_ses"),
+)
+# client methods that sign locally instead of calling AWS
+LOCAL_METHODS = {"generate_presigned_post", "generate_presigned_url"}
+
+
+@dataclass
+class RequestUsage:
+    """The SQL statements and AWS calls made while serving one request."""
+
+    method: str
+    url: str
+    statements: list[str] = field(default_factory=list)
+    aws_calls: list[str] = field(default_factory=list)
+
+    def __str__(self) -> str:
+        return f"{self.method} {self.url}"
+
+
+class _CountingClient:
+    """Forwards to an AWS client and records the API calls made through it."""
+
+    def __init__(self, client, name: str, serving: list[RequestUsage]):
+        self._client = client
+        self._name = name
+        self._serving = serving
+
+    def __getattr__(self, attr: str):
+        value = getattr(self._client, attr)
+        if not callable(value) or attr in LOCAL_METHODS:
+            return value
+
+        @functools.wraps(value)
+        def call(*args, **kwargs):
+            if self._serving:
+                self._serving[-1].aws_calls.append(f"{self._name}.{attr}")
+            return value(*args, **kwargs)
+
+        return call
+
+
+@contextlib.contextmanager
+def record_statements() -> Iterator[list[str]]:
+    """Record every SQL statement run inside the block."""
+    statements: list[str] = []
+
+    def record_statement(conn, cursor, statement, *args):
+        statements.append(statement)
+
+    event.listen(db.engine, "before_cursor_execute", record_statement)
+    try:
+        yield statements
+    finally:
+        event.remove(db.engine, "before_cursor_execute", record_statement)
+
+
+@contextlib.contextmanager
+def record_requests(client: FlaskClient) -> Iterator[list[RequestUsage]]:
+    """Record the usage of every request a client makes inside the block.
+
+    Statements and AWS calls made by the test itself are not recorded.
+    """
+    usages: list[RequestUsage] = []
+    serving: list[RequestUsage] = []
+
+    def record_statement(conn, cursor, statement, *args):
+        if serving:
+            serving[-1].statements.append(statement)
+
+    def recording_open(*args, **kwargs):
+        url = args[0] if args else kwargs.get("path", "/")
+        usage = RequestUsage(kwargs.get("method", "GET"), url)
+        serving.append(usage)
+        try:
+            return open(*args, **kwargs)
+        finally:
+            serving.pop()
+            usages.append(usage)
+
+    open = client.open
+    aws_clients = [(m, attr, getattr(m, attr)) for m, attr in AWS_CLIENTS]
+    for module, attr, original in aws_clients:
+        setattr(
+            module,
+            attr,
+            _CountingClient(original, attr.lstrip("_"), serving),
+        )
+    client.open = recording_open
+    event.listen(db.engine, "before_cursor_execute", record_statement)
+    try:
+        yield usages
+    finally:
+        event.remove(db.engine, "before_cursor_execute", record_statement)
+        del client.open
+        for module, attr, original in aws_clients:
+            setattr(module, attr, original)
+
+
+@contextlib.contextmanager
+def within_budget(
+    client: FlaskClient, statements: int, aws_calls: int = 0
+) -> Iterator[list[RequestUsage]]:
+    """Fail if any request made inside the block exceeds a budget.
+
+    :param statements: The most SQL statements allowed per request
+    :param aws_calls: The most AWS API calls allowed per request
+    """
+    with record_requests(client) as usages:
+        yield usages
+    over = [
+        f"{usage} ran {len(usage.statements)} statement(s) and made "
+        f"{len(usage.aws_calls)} AWS call(s):\n  "
+        + "\n  ".join(usage.statements + usage.aws_calls)
+        for usage in usages
+        if len(usage.statements) > statements
+        or len(usage.aws_calls) > aws_calls
+    ]
+    assert len(over) == 0, (
+        f"Over the budget of {statements} statement(s) and {aws_calls} AWS "
+        "call(s) per request:\n" + "\n".join(over)
+    )
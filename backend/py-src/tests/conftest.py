@@ -1,14 +1,22 @@
 """Defines fixtures available to all tests."""
+
+import functools
 import logging
+import os
 
 import pytest
 
-from app import create_app
-from app.models import db as _db
+# the cheapest bcrypt cost keeps password tests fast
+os.environ.setdefault("BCRYPT_ROUNDS", "4")
+
+from app import aws, create_app, email, settings
+from app.models import BucketSummary, User, db as _db
 
 from .functional import USER_A_TOKEN, USER_B_TOKEN, USER_C_TOKEN
 
 from .functional.routes import login_w_google, is_user_logged_in
+from .fakes import FakeMediaConvert, FakeS3, FakeSES
+from .budget import record_statements, within_budget
 
 
 @pytest.fixture
@@ -34,6 +42,9 @@ def db(app):
     # Explicitly close DB connection
     _db.session.close()
     _db.drop_all()
+    # IDs are reused by the next test's database
+    BucketSummary.forget()
+    User.forget_cached()
 
 
 @pytest.fixture(scope="function")
@@ -42,3 +53,48 @@ def test_client(app, db):
     with app.test_client() as client:
         # must be inside application context
         yield client
+
+
+@pytest.fixture
+def query_budget(test_client):
+    """Fail if a request made by the test client inside a block runs more
+    SQL statements or AWS calls than its budget.
+
+        with query_budget(statements=6):
+            routes.get_feed(test_client)
+    """
+    return functools.partial(within_budget, test_client)
+
+
+@pytest.fixture
+def statements(db):
+    """:return: the SQL statements run so far by the test. Clear the list to
+    count the statements run from then on."""
+    with record_statements() as recorded:
+        yield recorded
+
+
+@pytest.fixture
+def fake_mediaconvert(monkeypatch):
+    """Replace the MediaConvert client with an in-memory fake."""
+    fake = FakeMediaConvert()
+    monkeypatch.setattr(aws, "_mediaconvert", fake)
+    yield fake
+
+
+@pytest.fixture
+def fake_s3(monkeypatch):
+    """Replace the S3 client with an in-memory fake."""
+    fake = FakeS3()
+    monkeypatch.setattr(aws, "_s3", fake)
+    yield fake
+
+
+@pytest.fixture
+def fake_ses(monkeypatch):
+    """Replace the SES client with an in-memory fake that always sends."""
+    fake = FakeSES()
+    monkeypatch.setattr(email, "_ses", fake)
+    # emails are not sent at all in debug mode
+    monkeypatch.setattr(settings, "DEBUG", False)
+    yield fake
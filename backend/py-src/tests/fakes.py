@@ -0,0 +1,136 @@
+"""In-memory stand-ins for the AWS clients used by the app.
+
+Each fake implements only the subset of its boto3 client's interface that the
+app calls, with the same request and response shapes.
+"""
+
+from __future__ import annotations
+import itertools
+import threading
+import time
+
+from botocore.exceptions import ClientError
+
+
+class FakeMediaConvert:
+    """A local MediaConvert client whose jobs change status on demand."""
+
+    def __init__(self) -> None:
+        self.jobs: dict[str, dict] = {}
+        self.n_get_job_calls = 0
+        self._ids = itertools.count(1)
+
+    def create_job(self, **job_object) -> dict:
+        job = dict(job_object, Id=f"job-{next(self._ids)}", Status="SUBMITTED")
+        self.jobs[job["Id"]] = job
+        return {"Job": job}
+
+    def get_job(self, Id: str) -> dict:
+        self.n_get_job_calls += 1
+        if Id not in self.jobs:
+            raise ClientError(
+                {"Error": {"Code": "NotFoundException", "Message": Id}},
+                "GetJob",
+            )
+        return {"Job": self.jobs[Id]}
+
+    def set_status(self, job_id: str, status: str) -> None:
+        """Simulate a job changing state, e.g. to "COMPLETE"."""
+        self.jobs[job_id]["Status"] = status
+
+
+class FakeS3:
+    """A local S3 client holding one bucket of keys.
+
+    :param latency: seconds each request sleeps, to mimic network round trips
+    :param page_size: the maximum number of keys listed per request
+    """
+
+    def __init__(self, latency: float = 0, page_size: int = 1000) -> None:
+        self.keys: set[str] = set()
+        self.undeletable: set[str] = set()
+        self.n_requests = 0
+        self.latency = latency
+        self.page_size = page_size
+        self._lock = threading.Lock()
+
+    def put_keys(self, keys) -> None:
+        self.keys.update(keys)
+
+    def _request(self) -> None:
+        with self._lock:
+            self.n_requests += 1
+        if self.latency > 0:
+            time.sleep(self.latency)
+
+    def generate_presigned_post(
+        self, Bucket: str, Key: str, ExpiresIn: int = 3600
+    ) -> dict:
+        # signing happens locally, so it is not counted as a request
+        return {
+            "url": f"https://{Bucket}.s3.amazonaws.com/",
+            "fields": {"key": Key, "policy": "fake", "signature": "fake"},
+        }
+
+    def list_objects_v2(
+        self, Bucket: str, Prefix: str = "", ContinuationToken: str = ""
+    ) -> dict:
+        self._request()
+        with self._lock:
+            matches = sorted(
+                k
+                for k in self.keys
+                if k.startswith(Prefix) and k > ContinuationToken
+            )
+        page = matches[: self.page_size]
+        res = {"KeyCount": len(page), "IsTruncated": len(matches) > len(page)}
+        if page:
+            res["Contents"] = [{"Key": k} for k in page]
+        if res["IsTruncated"]:
+            res["NextContinuationToken"] = page[-1]
+        return res
+
+    def delete_objects(self, Bucket: str, Delete: dict) -> dict:
+        self._request()
+        objects = Delete["Objects"]
+        assert len(objects) <= 1000, "S3 deletes at most 1000 keys at a time"
+        errors = []
+        with self._lock:
+            for obj in objects:
+                if obj["Key"] in self.undeletable:
+                    errors.append({"Key": obj["Key"], "Code": "AccessDenied"})
+                else:
+                    self.keys.discard(obj["Key"])
+        return {"Errors": errors} if errors else {}
+
+
+class FakeSES:
+    """A local SES client that records the emails it sends."""
+
+    def __init__(self) -> None:
+        self.sent: list[dict] = []
+        self.n_failures_left = 0
+        self._lock = threading.Lock()
+
+    def fail_next(self, n: int) -> None:
+        """Make the next n sends fail as if SES were throttling."""
+        self.n_failures_left = n
+
+    def send_email(
+        self, Destination: dict, Message: dict, Source: str
+    ) -> dict:
+        with self._lock:
+            if self.n_failures_left > 0:
+                self.n_failures_left -= 1
+                raise ClientError(
+                    {"Error": {"Code": "Throttling", "Message": "Slow down"}},
+                    "SendEmail",
+                )
+            self.sent.append(
+                {
+                    "to": Destination["ToAddresses"][0],
+                    "subject": Message["Subject"]["Data"],
+                    "text": Message["Body"]["Text"]["Data"],
+                }
+            )
+            return {"MessageId": f"message-{len(self.sent)}"}
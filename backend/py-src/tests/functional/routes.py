@@ -1,12 +1,17 @@
 """Provides helper functions to interact with backend server."""
+
 from __future__ import annotations
 from typing import Any
 from dataclasses import dataclass
 import os
 import datetime
+import hashlib
+import hmac
 import json
 
 from flask.testing import FlaskClient
+from app.settings import CALLBACK_SECRET
+from ..budget import record_requests
 from . import (
     HOST,
 )
@@ -17,6 +22,14 @@ def log_response(res) -> str:
     return f"Response status code: {res.status_code}\nData:\n{res.data}"
 
 
+def count_statements(client: FlaskClient, url: str) -> int:
+    """:return: the number of SQL statements run while serving a GET"""
+    with record_requests(client) as usages:
+        res = client.get(url)
+    assert res.status_code == 200, log_response(res)
+    return len(usages[0].statements)
+
+
 def _add_params(url: str, params: dict[str, Any]) -> str:
     """Append query parameters onto URL."""
     if len(params) == 0:
@@ -295,11 +308,26 @@ def delete_user(client: FlaskClient) -> None:
     assert not is_logged_in(client)
 
 
-def search(client: FlaskClient, q: str) -> list[User]:
-    """Perform a user search query."""
-    res = client.get(f"{HOST}/users/search?q={q}")
+def search(
+    client: FlaskClient,
+    q: str,
+    cursor: str | None = None,
+    per_page: int | None = None,
+) -> tuple[list[User], str | None]:
+    """Perform a user search query.
+
+    :return: a page of users and the cursor of the next page, if any
+    """
+    params: dict[str, Any] = {"q": q}
+    if cursor is not None:
+        params["cursor"] = cursor
+    if per_page is not None:
+        params["per_page"] = per_page
+    res = client.get(_add_params(f"{HOST}/users/search", params))
     assert res.status_code == 200, log_response(res)
-    return [parse_user_json(u) for u in json.loads(res.data)]
+    data = json.loads(res.data)
+    assert data["has_next"] == (data["next_cursor"] is not None)
+    return [parse_user_json(u) for u in data["users"]], data["next_cursor"]
 
 
 def get_all_uploads(
@@ -430,6 +458,28 @@ def create_upload(
     return get_upload(client, id)
 
 
+def post_callback(
+    client: FlaskClient, path: str, body: dict | bytes, signed: bool = True
+) -> int:
+    """POST an AWS event to a callback route.
+
+    :param body: The event, or the raw bytes to post
+    :return: the response status code
+    """
+    data = body if isinstance(body, bytes) else json.dumps(body).encode()
+    signature = hmac.new(
+        CALLBACK_SECRET.encode(), data, hashlib.sha256
+    ).hexdigest()
+    headers = {"X-Callback-Signature": signature if signed else "invalid"}
+    res = client.post(
+        f"{HOST}/callbacks/{path}/",
+        data=data,
+        headers=headers,
+        content_type="application/json",
+    )
+    return res.status_code
+
+
 def get_download_url(client: FlaskClient, upload_id: int) -> str:
     """Get a presigned URL to download a specified upload."""
     res = client.get(f"{HOST}/uploads/{upload_id}/download/")
@@ -560,6 +610,37 @@ def delete_courtship(client: FlaskClient, other_id: int) -> None:
     assert res.status_code == 204
 
 
+def get_feed(
+    client: FlaskClient,
+    type: str | None = None,
+    cursor: str | None = None,
+    page: int | None = None,
+    per_page: int | None = None,
+) -> tuple[list[tuple[User, Upload]], str | None]:
+    """Get a page of the current user's feed.
+
+    :return: the page's users and uploads and the next page's cursor, if any
+    """
+    params: dict[str, Any] = {}
+    for name, value in (
+        ("type", type),
+        ("cursor", cursor),
+        ("page", page),
+        ("per_page", per_page),
+    ):
+        if value is not None:
+            params[name] = value
+    res = client.get(_add_params(f"{HOST}/feed", params))
+    assert res.status_code == 200, log_response(res)
+    data = json.loads(res.data)
+    assert data["has_next"] == (data["next_cursor"] is not None)
+    feed = [
+        (parse_user_json(e["user"]), parse_upload_json(e["upload"]))
+        for e in data["feed"]
+    ]
+    return feed, data["next_cursor"]
+
+
 # non-route helper
 def establish_courtship(
     client: FlaskClient,
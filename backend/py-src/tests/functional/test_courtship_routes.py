@@ -0,0 +1,199 @@
+"""Functional tests for all routes tagged with 'Courtship'."""
+
+from flask.testing import FlaskClient
+
+from . import (
+    routes,
+    HOST,
+    USER_A_TOKEN,
+    USER_B_TOKEN,
+    USER_C_TOKEN,
+)
+from app.extensions import db
+from app.models import RelationshipType, User, UserRelationship
+
+
+def feed_titles(client: FlaskClient, type: str | None = None) -> list[str]:
+    """:return: the titles of every upload in the current user's feed"""
+    feed, next_cursor = routes.get_feed(client, type=type)
+    assert next_cursor is None
+    return [upload.display_title for _, upload in feed]
+
+
+def test_feed(test_client: FlaskClient):
+    """Ensure feeds follow sharing, courtship, and upload changes."""
+    user_b, _ = routes.login_w_google(test_client, USER_B_TOKEN)
+    user_c, _ = routes.login_w_google(test_client, USER_C_TOKEN)
+    user_a, _ = routes.login_w_google(test_client, USER_A_TOKEN)
+    bucket = routes.create_bucket(test_client, "bucket")
+    upload_ids = {}
+    for default, shared_with in (
+        ("private", [user_c.id]),
+        ("coaches-only", []),
+        ("friends-only", []),
+        ("friends-and-coaches", []),
+        ("public", []),
+    ):
+        upload_ids[default], _, _ = routes.create_upload_url(
+            test_client,
+            "vid.mp4",
+            default,
+            bucket.id,
+            routes.VisibilitySetting(default, shared_with),
+        )
+    assert feed_titles(test_client) == []
+    # a pending request only reveals public uploads
+    routes.login_w_google(test_client, USER_B_TOKEN)
+    routes.create_courtship_req(test_client, user_a.id, "friend-req")
+    assert feed_titles(test_client) == ["public"]
+    routes.login_w_google(test_client, USER_A_TOKEN)
+    routes.update_incoming_court_req(test_client, user_b.id, "accept")
+    routes.login_w_google(test_client, USER_B_TOKEN)
+    friend_feed = ["public", "friends-and-coaches", "friends-only"]
+    assert feed_titles(test_client) == friend_feed
+    assert feed_titles(test_client, "friend") == friend_feed
+    assert feed_titles(test_client, "coach") == []
+    # A coaches C
+    routes.establish_courtship(
+        test_client, USER_C_TOKEN, USER_A_TOKEN, "coach-req"
+    )
+    routes.login_w_google(test_client, USER_C_TOKEN)
+    assert feed_titles(test_client, "coach") == ["public", "private"]
+    c_bucket = routes.create_bucket(test_client, "c bucket")
+    routes.create_upload_url(
+        test_client,
+        "vid.mp4",
+        "for coaches",
+        c_bucket.id,
+        routes.VisibilitySetting("coaches-only", []),
+    )
+    routes.login_w_google(test_client, USER_A_TOKEN)
+    assert feed_titles(test_client, "student") == ["for coaches"]
+    assert feed_titles(test_client, "friend") == []
+    # visibility edits and deletions are reflected in feeds
+    routes.edit_upload(
+        test_client,
+        upload_ids["friends-only"],
+        visibility=routes.VisibilitySetting("private", []),
+    )
+    routes.delete_upload(test_client, upload_ids["public"])
+    routes.login_w_google(test_client, USER_B_TOKEN)
+    assert feed_titles(test_client) == ["friends-and-coaches"]
+    # ending a courtship empties the feed
+    routes.delete_courtship(test_client, user_a.id)
+    assert feed_titles(test_client) == []
+
+
+def test_feed_pagination(test_client: FlaskClient):
+    """Ensure cursors and pages both walk the whole feed in order."""
+    routes.login_w_google(test_client, USER_B_TOKEN)
+    routes.login_w_google(test_client, USER_A_TOKEN)
+    bucket = routes.create_bucket(test_client, "bucket")
+    for i in range(7):
+        routes.create_upload_url(
+            test_client,
+            "vid.mp4",
+            f"upload {i}",
+            bucket.id,
+            routes.VisibilitySetting("public", []),
+        )
+    routes.establish_courtship(
+        test_client, USER_B_TOKEN, USER_A_TOKEN, "friend-req"
+    )
+    expected = [f"upload {i}" for i in reversed(range(7))]
+    # follow cursors
+    titles = []
+    feed, cursor = routes.get_feed(test_client, per_page=3)
+    titles.extend(up.display_title for _, up in feed)
+    while cursor is not None:
+        feed, cursor = routes.get_feed(test_client, cursor=cursor, per_page=3)
+        titles.extend(up.display_title for _, up in feed)
+    assert titles == expected
+    # legacy page numbers still work
+    titles = []
+    for page in (1, 2, 3):
+        feed, _ = routes.get_feed(test_client, page=page, per_page=3)
+        titles.extend(up.display_title for _, up in feed)
+    assert titles == expected
+    # malformed cursors are rejected
+    for params in ("cursor=garbage", "cursor=WzFd", "per_page=0"):
+        res = test_client.get(f"{HOST}/feed?{params}")
+        assert res.status_code == 400
+
+
+def test_search_pagination(test_client: FlaskClient):
+    """Ensure search results are paged by username."""
+    routes.login_w_google(test_client, USER_B_TOKEN)
+    routes.update_user(test_client, username="tennisbob")
+    routes.login_w_google(test_client, USER_C_TOKEN)
+    routes.update_user(test_client, username="tenniscal")
+    routes.login_w_google(test_client, USER_A_TOKEN)
+    found, cursor = routes.search(test_client, "tennis", per_page=1)
+    assert [u.username for u in found] == ["tennisbob"]
+    found, cursor = routes.search(test_client, "tennis", cursor, per_page=1)
+    assert [u.username for u in found] == ["tenniscal"]
+    assert cursor is None
+    # blank queries find nobody
+    assert routes.search(test_client, " ") == ([], None)
+
+
+def test_courtship_list_statement_counts(test_client: FlaskClient):
+    """Ensure courtship and request lists load counterparts in bulk and
+    list the counterparts of the requested user."""
+    user_b, _ = routes.login_w_google(test_client, USER_B_TOKEN)
+    user_a, _ = routes.login_w_google(test_client, USER_A_TOKEN)
+
+    def add_students(start: int, stop: int) -> None:
+        """Make user A coach, and be requested by, new users."""
+        for i in range(start, stop):
+            student = User(
+                f"Student {i}", f"s{i}@email.com", google_id=f"s{i}"
+            )
+            requester = User(f"Req {i}", f"r{i}@email.com", google_id=f"r{i}")
+            db.session.add_all([student, requester])
+            db.session.flush()
+            db.session.add_all(
+                [
+                    UserRelationship(
+                        user_a_id=user_a.id,
+                        user_b_id=student.id,
+                        type=RelationshipType.A_COACHES_B,
+                    ),
+                    UserRelationship(
+                        user_a_id=requester.id,
+                        user_b_id=user_a.id,
+                        type=RelationshipType.FRIEND_REQUESTED,
+                    ),
+                ]
+            )
+        db.session.commit()
+
+    # authenticated users are cached after their first request
+    routes.get_user(test_client)
+    counts = []
+    for start, stop in ((0, 2), (2, 8)):
+        add_students(start, stop)
+        counts.append(
+            (
+                routes.count_statements(
+                    test_client, f"{HOST}/users/me/courtships?type=student"
+                ),
+                routes.count_statements(
+                    test_client, f"{HOST}/courtships/requests?dir=in"
+                ),
+            )
+        )
+    assert counts[0] == counts[1]
+    students = routes.get_all_courtships(test_client, "me", type="student")
+    assert sorted(u.dname for u in students) == sorted(
+        f"Student {i}" for i in range(8)
+    )
+    assert all(u.courtship.type == "student" for u in students)
+    requests = routes.get_courtship_reqs(test_client, dir="in")
+    assert len(requests) == 8
+    assert routes.get_courtship_reqs(test_client, dir="out") == []
+    # another user sees user A's students, not user A
+    routes.login_w_google(test_client, USER_B_TOKEN)
+    students = routes.get_all_courtships(test_client, user_a.id)
+    assert len(students) == 8
+    assert user_a.id not in {u.id for u in students}
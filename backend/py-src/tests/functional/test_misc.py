@@ -1,8 +1,12 @@
 import json
+import logging
+import threading
 from flask.testing import FlaskClient
 
-from . import routes, HOST
-from app.settings import VIEW_DOCS_KEY
+from . import routes, HOST, USER_A_TOKEN
+from app import make_workers, settings
+from app.querystats import route_stats
+from app.settings import METRICS_KEY, VIEW_DOCS_KEY
 
 
 def test_health_check(test_client: FlaskClient):
@@ -23,3 +27,44 @@ def test_docs(test_client: FlaskClient):
     res = test_client.get(f"{HOST}/docs?key={VIEW_DOCS_KEY}")
     assert res.status_code == 200
     assert "MyAce API Documentation" in res.data.decode("utf-8")
+
+
+def test_query_stats(test_client: FlaskClient, monkeypatch, caplog):
+    """Test the per-route statement counters and N+1 detection."""
+    route_stats.reset()
+    routes.login_w_google(test_client, USER_A_TOKEN)
+    # timings are only sent in debug mode
+    monkeypatch.setattr(settings, "DEBUG", False)
+    res = test_client.get(f"{HOST}/feed")
+    assert res.status_code == 200
+    assert "Server-Timing" not in res.headers
+    monkeypatch.setattr(settings, "DEBUG", True)
+    monkeypatch.setattr(settings, "N_PLUS_ONE_THRESHOLD", 2)
+    with caplog.at_level(logging.WARNING, logger="app.querystats"):
+        res = test_client.get(f"{HOST}/feed")
+    assert res.headers["Server-Timing"].startswith("db;dur=")
+    # the login loads the user once per request, so nothing is repeated
+    assert "N+1" not in caplog.text
+    monkeypatch.setattr(settings, "N_PLUS_ONE_THRESHOLD", 1)
+    with caplog.at_level(logging.WARNING, logger="app.querystats"):
+        test_client.get(f"{HOST}/feed")
+    assert "Possible N+1: GET /feed" in caplog.text
+    # Invalid key -> unauthorized
+    res = test_client.get(f"{HOST}/internal/metrics?key=abc123")
+    assert res.status_code == 401
+    res = test_client.get(f"{HOST}/internal/metrics?key={METRICS_KEY}")
+    assert res.status_code == 200
+    feed = json.loads(res.data)["routes"]["GET /feed"]
+    assert feed["n_requests"] == 3
+    assert 0 < feed["max_statements"] <= feed["n_statements"]
+    assert feed["n_plus_one"] > 0
+    backlog = json.loads(res.data)["reaper"]["tombstone_backlog"]
+    assert backlog == {"n_pending": 0, "oldest_secs": 0.0}
+
+
+def test_workers_not_started(app):
+    """Ensure building the app does not start any background worker."""
+    names = {worker.name for worker in make_workers(app)}
+    assert names == {"convert-reconciler", "tombstone-reaper", "email-sender"}
+    running = {thread.name for thread in threading.enumerate()}
+    assert running.isdisjoint(names)
@@ -0,0 +1,251 @@
+"""Budgets of the SQL statements and AWS calls each route makes per request.
+
+Read budgets are checked with one and with four times the rows, so routes
+that query once per row, such as an N+1 in serialize, exceed them.
+"""
+
+import json
+
+import pytest
+from flask.testing import FlaskClient
+
+from . import routes, HOST, USER_A_TOKEN, USER_B_TOKEN, USER_C_TOKEN
+from app import email
+from app.email import generate_user_token
+
+PASSWORD = "Password1!"
+
+# (viewer token, URL, statements) where A coaches B and is friends with C.
+# "{a}" is A's ID and "{upload}" is an upload that C comments on.
+READ_BUDGETS = (
+    (USER_B_TOKEN, "/feed", 8),
+    (USER_B_TOKEN, "/feed?per_page=50", 8),
+    (USER_C_TOKEN, "/feed?type=friend", 8),
+    (USER_A_TOKEN, "/users/me/buckets", 2),
+    (USER_B_TOKEN, "/users/{a}/buckets", 2),
+    (USER_A_TOKEN, "/users/me/uploads", 6),
+    (USER_B_TOKEN, "/users/{a}/uploads", 6),
+    (USER_B_TOKEN, "/uploads/{upload}/", 6),
+    (USER_B_TOKEN, "/uploads/{upload}/download/", 3),
+    (USER_B_TOKEN, "/comments?upload={upload}", 5),
+    (USER_A_TOKEN, "/users/me/courtships", 3),
+    (USER_B_TOKEN, "/users/{a}/courtships", 3),
+    (USER_A_TOKEN, "/courtships/requests", 1),
+    (USER_B_TOKEN, "/users/{a}/", 3),
+    (USER_B_TOKEN, "/users/search?q=j", 5),
+    (USER_B_TOKEN, "/usernames/someone/check/", 1),
+)
+
+
+def add_rows(client: FlaskClient, n: int, upload_id: int, b_id: int) -> None:
+    """Add n buckets of A's uploads with every visibility, and n comments
+    from A and from C."""
+    for i in range(n):
+        routes.login_w_google(client, USER_A_TOKEN)
+        bucket = routes.create_bucket(client, f"bucket{n}-{i}")
+        for default, shared in (
+            ("public", []),
+            ("coaches-only", []),
+            ("private", [b_id]),
+            ("friends-only", []),
+        ):
+            routes.create_upload_url(
+                client,
+                "vid.mp4",
+                default,
+                bucket.id,
+                routes.VisibilitySetting(default, shared),
+            )
+        routes.create_comment(client, "a", upload_id)
+        routes.login_w_google(client, USER_C_TOKEN)
+        routes.create_comment(client, "c", upload_id)
+
+
+@pytest.fixture
+def rows(test_client: FlaskClient) -> tuple[routes.User, int]:
+    """:return: user A and the ID of the upload C comments on"""
+    user_a, _ = routes.login_w_google(test_client, USER_A_TOKEN)
+    routes.establish_courtship(
+        test_client, USER_B_TOKEN, USER_A_TOKEN, "student-req"
+    )
+    routes.establish_courtship(
+        test_client, USER_C_TOKEN, USER_A_TOKEN, "friend-req"
+    )
+    routes.login_w_google(test_client, USER_A_TOKEN)
+    upload_id, _, _ = routes.create_upload_url(
+        test_client,
+        "vid.mp4",
+        "Commented",
+        routes.create_bucket(test_client, "commented").id,
+        routes.VisibilitySetting("public", []),
+    )
+    return user_a, upload_id
+
+
+def test_read_budgets(test_client: FlaskClient, query_budget, rows):
+    """Ensure reads stay within their budgets as rows are added."""
+    user_a, upload_id = rows
+    user_b, _ = routes.login_w_google(test_client, USER_B_TOKEN)
+    n_comments = 0
+    for n in (1, 4):
+        add_rows(test_client, n, upload_id, user_b.id)
+        n_comments += 2 * n
+        for token, url, statements in READ_BUDGETS:
+            routes.login_w_google(test_client, token)
+            url = url.format(a=user_a.id, upload=upload_id)
+            with query_budget(statements):
+                res = test_client.get(f"{HOST}{url}")
+            assert res.status_code == 200, routes.log_response(res)
+            if url.startswith("/comments"):
+                assert len(json.loads(res.data)["comments"]) == n_comments
+
+
+def test_write_budgets(
+    test_client: FlaskClient, query_budget, rows, fake_mediaconvert
+):
+    """Ensure writes stay within their budgets."""
+    user_a, upload_id = rows
+    user_b, _ = routes.login_w_google(test_client, USER_B_TOKEN)
+    user_c, _ = routes.login_w_google(test_client, USER_C_TOKEN)
+    add_rows(test_client, 4, upload_id, user_b.id)
+
+    routes.login_w_google(test_client, USER_A_TOKEN)
+    with query_budget(6):
+        bucket = routes.create_bucket(test_client, "new")
+        routes.edit_bucket(test_client, bucket.id, "renamed")
+    with query_budget(8):
+        id, _, _ = routes.create_upload_url(
+            test_client,
+            "vid.mp4",
+            "New",
+            bucket.id,
+            routes.VisibilitySetting("public", []),
+        )
+    with query_budget(2, aws_calls=1):
+        res = test_client.post(f"{HOST}/uploads/{id}/convert/")
+    assert res.status_code == 204, routes.log_response(res)
+    with query_budget(16):
+        routes.edit_upload(
+            test_client,
+            id,
+            visibility=routes.VisibilitySetting("friends-only", [user_b.id]),
+        )
+    with query_budget(9):
+        routes.edit_upload(test_client, id, display_title="Renamed")
+    with query_budget(7):
+        comment = routes.create_comment(test_client, "hi", id)
+    with query_budget(3):
+        routes.delete_comment(test_client, comment.id)
+        routes.delete_upload(test_client, id)
+        routes.delete_bucket(test_client, bucket.id)
+    with query_budget(5):
+        routes.update_user(test_client, biography="Updated")
+
+    routes.login_w_google(test_client, USER_C_TOKEN)
+    with query_budget(9):
+        routes.create_courtship_req(test_client, user_b.id, "friend-req")
+    with query_budget(4):
+        routes.login_w_google(test_client, USER_B_TOKEN)
+    with query_budget(7):
+        routes.update_incoming_court_req(test_client, user_c.id, "accept")
+        routes.delete_courtship(test_client, user_c.id)
+
+
+def add_owner(client: FlaskClient, i: int, viewer_id: int) -> None:
+    """Register a user who befriends the viewer and then uploads."""
+    owner = routes.register(
+        client, f"owner{i}@email.com", PASSWORD, f"owner{i}", f"Owner {i}"
+    )
+    client.get(f"{HOST}/callbacks/confirm/{generate_user_token(owner.id)}/")
+    routes.create_courtship_req(client, viewer_id, "friend-req")
+    routes.login_w_google(client, USER_B_TOKEN)
+    routes.update_incoming_court_req(client, owner.id, "accept")
+    routes.login_w_password(client, f"owner{i}@email.com", PASSWORD)
+    routes.create_upload_url(
+        client,
+        "vid.mp4",
+        f"Upload {i}",
+        routes.create_bucket(client, f"bucket{i}").id,
+        routes.VisibilitySetting("public", []),
+    )
+
+
+def test_feed_owner_budget(test_client: FlaskClient, query_budget):
+    """Ensure the feed costs the same however many people posted in it."""
+    viewer, _ = routes.login_w_google(test_client, USER_B_TOKEN)
+    counts = []
+    n_added = 0
+    for n_owners in (1, 4):
+        while n_added < n_owners:
+            n_added += 1
+            add_owner(test_client, n_added, viewer.id)
+        routes.login_w_google(test_client, USER_B_TOKEN)
+        with query_budget(7):
+            feed, _ = routes.get_feed(test_client)
+        assert len({user.id for user, _ in feed}) == n_owners
+        counts.append(routes.count_statements(test_client, f"{HOST}/feed"))
+    assert counts[0] == counts[1]
+
+
+def test_account_budgets(
+    test_client: FlaskClient, query_budget, monkeypatch, fake_ses
+):
+    """Ensure registration, logins, and password resets stay within their
+    budgets."""
+    # allow the password reset right after the confirmation email
+    monkeypatch.setattr(email.email_limit, "capacity", 2)
+    with query_budget(8):
+        user = routes.register(
+            test_client, "new@email.com", PASSWORD, "new_user", "New User"
+        )
+    token = generate_user_token(user.id)
+    with query_budget(2):
+        res = test_client.get(f"{HOST}/callbacks/confirm/{token}/")
+    assert res.status_code == 200, routes.log_response(res)
+    with query_budget(3):
+        res = test_client.get(f"{HOST}/users/me/")
+    assert res.status_code == 200, routes.log_response(res)
+    routes.logout(test_client)
+    with query_budget(3):
+        routes.login_w_password(test_client, "new@email.com", PASSWORD)
+    # the first Google login creates the user
+    with query_budget(7):
+        routes.login_w_google(test_client, USER_A_TOKEN)
+    with query_budget(4):
+        res = test_client.post(
+            f"{HOST}/users/forgot/", json={"email": "new@email.com"}
+        )
+    assert res.status_code == 204, routes.log_response(res)
+    with query_budget(2):
+        res = test_client.post(
+            f"{HOST}/callbacks/forgot/",
+            json={"token": token, "password": "Password2!"},
+        )
+    assert res.status_code == 200, routes.log_response(res)
+    # sending the queued emails is not part of any request
+    assert len(fake_ses.sent) == 0
+
+
+def test_callback_budgets(
+    test_client: FlaskClient, query_budget, fake_mediaconvert
+):
+    """Ensure the AWS event callbacks stay within their budgets."""
+    routes.login_w_google(test_client, USER_A_TOKEN)
+    upload_id, _, _ = routes.create_upload_url(
+        test_client,
+        "vid.mp4",
+        "Upload",
+        routes.create_bucket(test_client, "bucket").id,
+        routes.VisibilitySetting("public", []),
+    )
+    key = f"uploads/{upload_id}/vid.mp4"
+    created = {"Records": [{"s3": {"object": {"key": key}}}]}
+    with query_budget(2, aws_calls=1):
+        assert routes.post_callback(test_client, "s3upload", created) == 204
+    (job_id,) = fake_mediaconvert.jobs
+    state_change = {"detail": {"jobId": job_id, "status": "COMPLETE"}}
+    with query_budget(2):
+        assert (
+            routes.post_callback(test_client, "mediaconvert", state_change)
+            == 204
+        )
@@ -1,4 +1,5 @@
 """Functional tests for all routes tagged with 'Upload'."""
+
 import pytest
 from flask.testing import FlaskClient
 
@@ -10,6 +11,8 @@ from . import (
     USER_C_TOKEN,
 )
 from .routes import Upload, establish_courtship
+from app import aws, models, settings
+from app.models import UploadTombstone, UploadViewer, User
 
 
 @pytest.fixture
@@ -186,7 +189,7 @@ def test_edit_upload(test_client):
     assert final in routes.get_all_uploads(test_client, shared_with=user_b.id)
 
 
-def test_delete_upload(test_client):
+def test_delete_upload(test_client, fake_s3):
     """Ensure user can only delete their uploads and verify deletion works."""
     # setup two users with one upload each
     user_b, _ = routes.login_w_google(test_client, USER_B_TOKEN)
@@ -214,3 +217,219 @@ def test_delete_upload(test_client):
     routes.delete_upload(test_client, upload_a_id)
     with pytest.raises(AssertionError) as e_info:
         routes.get_upload(test_client, upload_a_id)
+    # S3 objects are left for the reaper
+    assert fake_s3.n_requests == 0
+    assert UploadTombstone.query.get(upload_a_id) is not None
+
+
+def test_conversion_callbacks(test_client, fake_mediaconvert):
+    """Ensure AWS callbacks start conversion and mark uploads ready."""
+    user_a, _ = routes.login_w_google(test_client, USER_A_TOKEN)
+    bucket = routes.create_bucket(test_client, "bucket")
+    upload_id, _, _ = routes.create_upload_url(
+        test_client,
+        "my vid.mp4",
+        "Upload",
+        bucket.id,
+        routes.VisibilitySetting("private", []),
+    )
+    created = {
+        "Records": [
+            {"s3": {"object": {"key": f"uploads/{upload_id}/my+vid.mp4"}}}
+        ]
+    }
+    # unsigned callbacks are rejected
+    assert routes.post_callback(test_client, "s3upload", created, False) == 401
+    assert len(fake_mediaconvert.jobs) == 0
+    # the original upload starts converting exactly once
+    assert routes.post_callback(test_client, "s3upload", created) == 204
+    assert routes.post_callback(test_client, "s3upload", created) == 204
+    assert len(fake_mediaconvert.jobs) == 1
+    (job_id,) = fake_mediaconvert.jobs
+    # convert output does not start another job
+    output = {
+        "Records": [
+            {"s3": {"object": {"key": f"uploads/{upload_id}/hls/index.m3u8"}}}
+        ]
+    }
+    assert routes.post_callback(test_client, "s3upload", output) == 204
+    assert len(fake_mediaconvert.jobs) == 1
+    assert not routes.get_upload(test_client, upload_id).stream_ready
+    # job completion marks the upload ready without polling
+    state_change = {
+        "detail-type": "MediaConvert Job State Change",
+        "detail": {"jobId": job_id, "status": "COMPLETE"},
+    }
+    assert (
+        routes.post_callback(test_client, "mediaconvert", state_change) == 204
+    )
+    assert fake_mediaconvert.n_get_job_calls == 0
+    assert routes.get_upload(test_client, upload_id).stream_ready
+    # late events do not move a finished job backwards
+    state_change["detail"]["status"] = "PROGRESSING"
+    assert (
+        routes.post_callback(test_client, "mediaconvert", state_change) == 204
+    )
+    upload = models.Upload.query.get(upload_id)
+    assert upload.mediaconvert_status == aws.ConvertStatus.COMPLETE
+    assert upload.stream_ready
+
+
+def test_malformed_callbacks(test_client, fake_mediaconvert):
+    """Ensure malformed or unknown AWS events are rejected without effect."""
+    for path in ("s3upload", "mediaconvert"):
+        assert routes.post_callback(test_client, path, b"{not json") == 400
+        assert routes.post_callback(test_client, path, b"[]") == 400
+    bad_record = {"Records": [{"s3": {}}]}
+    assert routes.post_callback(test_client, "s3upload", bad_record) == 400
+    bad_status = {"detail": {"jobId": "job", "status": "DONE"}}
+    assert routes.post_callback(test_client, "mediaconvert", bad_status) == 400
+    unknown_job = {"detail": {"jobId": "job", "status": "COMPLETE"}}
+    assert (
+        routes.post_callback(test_client, "mediaconvert", unknown_job) == 404
+    )
+    assert len(fake_mediaconvert.jobs) == 0
+
+
+def test_stream_cookies(test_client, fake_mediaconvert):
+    """Ensure stream cookies are only signed when the client lacks them."""
+    user_a, _ = routes.login_w_google(test_client, USER_A_TOKEN)
+    bucket = routes.create_bucket(test_client, "bucket")
+    upload_id, _, _ = routes.create_upload_url(
+        test_client,
+        "vid.mp4",
+        "Upload",
+        bucket.id,
+        routes.VisibilitySetting("private", []),
+    )
+    test_client.post(f"{HOST}/uploads/{upload_id}/convert/")
+    (job_id,) = fake_mediaconvert.jobs
+    state_change = {"detail": {"jobId": job_id, "status": "COMPLETE"}}
+    assert (
+        routes.post_callback(test_client, "mediaconvert", state_change) == 204
+    )
+    # the first view issues cookies
+    res = test_client.get(f"{HOST}/uploads/{upload_id}/")
+    assert res.status_code == 200
+    cookies = {}
+    for header in res.headers.getlist("Set-Cookie"):
+        key, value = header.split(";")[0].split("=", 1)
+        cookies[key] = value
+    assert set(cookies) == {
+        "CloudFront-Policy",
+        "CloudFront-Signature",
+        "CloudFront-Key-Pair-Id",
+    }
+    # views with valid cookies skip signing
+    for key, value in cookies.items():
+        test_client.set_cookie("localhost", key, value)
+    res = test_client.get(f"{HOST}/uploads/{upload_id}/")
+    assert res.status_code == 200
+    assert len(res.headers.getlist("Set-Cookie")) == 0
+
+
+def test_visibility_index(test_client, monkeypatch):
+    """Ensure the visibility index follows sharing and courtship changes."""
+    monkeypatch.setattr(settings, "VISIBILITY_INDEX", True)
+
+    def assert_consistent():
+        assert UploadViewer.find_inconsistencies(User.query.all()) == {}
+
+    user_b, _ = routes.login_w_google(test_client, USER_B_TOKEN)
+    user_c, _ = routes.login_w_google(test_client, USER_C_TOKEN)
+    user_a, _ = routes.login_w_google(test_client, USER_A_TOKEN)
+    bucket = routes.create_bucket(test_client, "bucket")
+    upload_ids = {}
+    for default, shared_with in (
+        ("private", [user_c.id]),
+        ("coaches-only", []),
+        ("friends-only", []),
+        ("friends-and-coaches", []),
+        ("public", []),
+    ):
+        upload_ids[default], _, _ = routes.create_upload_url(
+            test_client,
+            "vid.mp4",
+            default,
+            bucket.id,
+            routes.VisibilitySetting(default, shared_with),
+        )
+    assert_consistent()
+    # B coaches A and C befriends A
+    establish_courtship(test_client, USER_B_TOKEN, USER_A_TOKEN, "student-req")
+    establish_courtship(test_client, USER_C_TOKEN, USER_A_TOKEN, "friend-req")
+    assert_consistent()
+    assert len(routes.get_other_users_uploads(test_client, user_a.id)) == 4
+    routes.login_w_google(test_client, USER_B_TOKEN)
+    assert len(routes.get_other_users_uploads(test_client, user_a.id)) == 3
+    # B stops coaching A
+    routes.delete_courtship(test_client, user_a.id)
+    assert_consistent()
+    assert len(routes.get_other_users_uploads(test_client, user_a.id)) == 1
+    # A shares an upload with B directly
+    routes.login_w_google(test_client, USER_A_TOKEN)
+    routes.edit_upload(
+        test_client,
+        upload_ids["coaches-only"],
+        visibility=routes.VisibilitySetting("private", [user_b.id]),
+    )
+    assert_consistent()
+    routes.login_w_google(test_client, USER_B_TOKEN)
+    assert len(routes.get_other_users_uploads(test_client, user_a.id)) == 2
+
+
+def test_list_statement_counts(test_client: FlaskClient):
+    """Ensure listing uploads and comments runs a constant number of SQL
+    statements, however many rows are listed."""
+    user_a, _ = routes.login_w_google(test_client, USER_A_TOKEN)
+    user_b, _ = routes.login_w_google(test_client, USER_B_TOKEN)
+    routes.login_w_google(test_client, USER_C_TOKEN)
+    routes.establish_courtship(
+        test_client, USER_B_TOKEN, USER_A_TOKEN, "student-req"
+    )
+    routes.login_w_google(test_client, USER_A_TOKEN)
+    commented_id, _, _ = routes.create_upload_url(
+        test_client,
+        "vid.mp4",
+        "Commented",
+        routes.create_bucket(test_client, "commented").id,
+        routes.VisibilitySetting("public", []),
+    )
+
+    def add_rows(n: int) -> None:
+        for i in range(n):
+            routes.login_w_google(test_client, USER_A_TOKEN)
+            bucket = routes.create_bucket(test_client, f"bucket{n}-{i}")
+            for default, shared in (
+                ("public", []),
+                ("coaches-only", []),
+                ("private", [user_b.id]),
+                ("friends-only", []),
+            ):
+                routes.create_upload_url(
+                    test_client,
+                    "vid.mp4",
+                    default,
+                    bucket.id,
+                    routes.VisibilitySetting(default, shared),
+                )
+            routes.create_comment(test_client, "a", commented_id)
+            routes.login_w_google(test_client, USER_C_TOKEN)
+            routes.create_comment(test_client, "c", commented_id)
+
+    counts = []
+    for n in (1, 4):
+        add_rows(n)
+        routes.login_w_google(test_client, USER_B_TOKEN)
+        uploads = f"{HOST}/users/{user_a.id}/uploads"
+        comments = f"{HOST}/comments?upload={commented_id}"
+        counts.append(
+            (
+                routes.count_statements(test_client, uploads),
+                routes.count_statements(test_client, comments),
+            )
+        )
+    assert counts[0] == counts[1]
+    # the friends-only uploads are hidden from user B
+    assert len(routes.get_other_users_uploads(test_client, user_a.id)) == 16
+    assert len(routes.get_all_comments(test_client, commented_id)) == 10
@@ -1,4 +1,5 @@
 """Functional tests for all routes tagged with 'User'."""
+
 import pytest
 from dataclasses import dataclass
 
@@ -14,6 +15,8 @@ from . import (
     USER_C_TOKEN,
 )
 from .routes import User, Courtship
+from app import email as email_module, models
+from app.email import send_queued_emails
 
 VALID_PWD = "HelloWorld1!"
 
@@ -44,6 +47,29 @@ def test_register_preexisitng_email(test_client: FlaskClient):
         routes.login_w_google(test_client, USER_A_TOKEN)
 
 
+def test_register_commits_once(test_client: FlaskClient, monkeypatch):
+    """Ensure no user is created if their confirmation email is not queued."""
+
+    def fail(*args, **kwargs):
+        raise RuntimeError("Failed to queue the email.")
+
+    monkeypatch.setattr(email_module, "enqueue_email", fail)
+    monkeypatch.setitem(
+        test_client.application.config, "PROPAGATE_EXCEPTIONS", True
+    )
+    body = {
+        "username": "johnsmith",
+        "display_name": "John Smith",
+        "email": USER_A_EMAIL,
+        "password": VALID_PWD,
+    }
+    with pytest.raises(RuntimeError):
+        test_client.post(f"{HOST}/register/", json=body)
+    # as the session is when a request ends
+    models.db.session.rollback()
+    assert models.User.query.filter_by(email=USER_A_EMAIL).first() is None
+
+
 def test_invalid_register(test_client: FlaskClient):
     """Test register routes with invalid fields."""
     # register user B with Google
@@ -346,3 +372,29 @@ def test_delete_user(test_client: FlaskClient):
     # ensure another login attempt with return "user created"
     user, created = routes.login_w_google(test_client, USER_A_TOKEN)
     assert created
+
+
+def test_emails_are_queued(test_client: FlaskClient, fake_ses):
+    """Ensure routes queue emails instead of sending them inline."""
+    routes.register(
+        test_client, USER_A_EMAIL, VALID_PWD, "johnsmith", "John Smith"
+    )
+    assert len(fake_ses.sent) == 0
+    assert send_queued_emails() == 1
+    (conf_email,) = fake_ses.sent
+    assert conf_email["to"] == USER_A_EMAIL
+    assert "/callbacks/confirm/" in conf_email["text"]
+
+
+def test_email_rate_limit(test_client: FlaskClient):
+    """Ensure confirmation and password reset emails share a rate limit."""
+    # registering sends the first confirmation email
+    routes.register(
+        test_client, "test@gmail.com", "TestPwd!", "test_user", "Display Name"
+    )
+    res = test_client.post(f"{HOST}/users/resend/")
+    assert res.status_code == 429, res.data
+    res = test_client.post(
+        f"{HOST}/users/forgot/", json={"email": "test@gmail.com"}
+    )
+    assert res.status_code == 429, res.data
@@ -0,0 +1,30 @@
+"""Unit tests for deleting upload objects from S3."""
+from app import aws
+
+
+def test_delete_uploads(fake_s3):
+    """Ensure every page of an upload is deleted and neighbours are kept."""
+    fake_s3.page_size = 100
+    big = [f"uploads/1/hls/segment{i:05}.ts" for i in range(2500)]
+    fake_s3.put_keys(big)
+    fake_s3.put_keys(["uploads/2/vid.mp4", "uploads/2/hls/index.m3u8"])
+    # upload 10 shares upload 1's prefix without the trailing slash
+    fake_s3.put_keys(["uploads/10/vid.mp4"])
+    reports = aws.delete_uploads([1, 2, 3], max_workers=4)
+    assert fake_s3.keys == {"uploads/10/vid.mp4"}
+    assert reports[1].n_deleted == 2500 and reports[1].ok
+    assert reports[2].n_deleted == 2 and reports[2].ok
+    # uploads missing from S3 are not an error
+    assert reports[3].n_deleted == 0 and reports[3].ok
+
+
+def test_delete_uploads_errors(fake_s3):
+    """Ensure keys S3 refuses to delete are reported per upload."""
+    fake_s3.put_keys(["uploads/1/a.mp4", "uploads/1/b.mp4", "uploads/2/c"])
+    fake_s3.undeletable.add("uploads/1/b.mp4")
+    reports = aws.delete_uploads([1, 2])
+    assert not reports[1].ok
+    assert reports[1].n_deleted == 1
+    assert "uploads/1/b.mp4" in reports[1].errors[0]
+    assert reports[2].ok
+    assert fake_s3.keys == {"uploads/1/b.mp4"}
@@ -0,0 +1,49 @@
+"""Unit tests for the outbound email queue."""
+import datetime
+
+from app import settings
+from app.email import enqueue_email, send_queued_emails
+from app.models import OutboundEmail
+
+
+def test_send_queued_emails(db, fake_ses):
+    """Ensure queued emails are only sent after commit, then removed."""
+    for i in range(5):
+        enqueue_email(f"user{i}@email.com", f"Subject {i}", "<p>hi</p>", "hi")
+    db.session.rollback()
+    assert send_queued_emails() == 0
+    for i in range(5):
+        enqueue_email(f"user{i}@email.com", f"Subject {i}", "<p>hi</p>", "hi")
+    db.session.commit()
+    assert len(fake_ses.sent) == 0
+    assert send_queued_emails(batch_size=2) == 5
+    assert sorted(e["subject"] for e in fake_ses.sent) == [
+        f"Subject {i}" for i in range(5)
+    ]
+    assert OutboundEmail.query.count() == 0
+
+
+def test_send_queued_emails_retries(db, fake_ses, monkeypatch):
+    """Ensure failed emails are retried with backoff and eventually dropped."""
+    monkeypatch.setattr(settings, "EMAIL_MAX_ATTEMPTS", 2)
+    enqueue_email("user@email.com", "Subject", "<p>hi</p>", "hi")
+    db.session.commit()
+    fake_ses.fail_next(1)
+    assert send_queued_emails() == 0
+    (email,) = OutboundEmail.query.all()
+    assert email.attempts == 1
+    assert "Slow down" in email.last_error
+    assert email.next_attempt > datetime.datetime.utcnow()
+    # the email is not due yet
+    assert send_queued_emails() == 0
+    assert len(fake_ses.sent) == 0
+    # a failure on the last attempt gives up on the email
+    fake_ses.fail_next(1)
+    email.next_attempt = datetime.datetime.utcnow()
+    db.session.commit()
+    assert send_queued_emails() == 0
+    assert email.attempts == 2
+    email.next_attempt = datetime.datetime.utcnow()
+    db.session.commit()
+    assert send_queued_emails() == 0
+    assert len(fake_ses.sent) == 0
@@ -0,0 +1,204 @@
+"""Unit tests for the identity provider key cache."""
+
+import datetime
+import json
+import threading
+import time
+
+import jwt
+import pytest
+import requests
+from cryptography import x509
+from cryptography.hazmat.primitives import hashes, serialization
+from cryptography.hazmat.primitives.asymmetric import rsa
+from cryptography.x509.oid import NameOID
+from google.oauth2 import id_token
+from jwt.algorithms import RSAAlgorithm
+
+from app import jwks
+from app.jwks import CachedCertsRequest, KeySet, KeysUnavailable
+from app.routes.user_routes import LoginError, login_w_google
+from app.settings import G_CLIENT_IDS
+
+URL = "https://keys.example.com"
+
+
+def make_key(kid: str) -> tuple[rsa.RSAPrivateKey, dict]:
+    """:return: a private key and the JWK of its public key"""
+    private = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+    jwk = json.loads(RSAAlgorithm.to_jwk(private.public_key()))
+    return private, {**jwk, "kid": kid, "alg": "RS256", "use": "sig"}
+
+
+class FakeProvider:
+    """Serves a JWKS document and counts how often it is fetched."""
+
+    def __init__(self, *jwks: dict) -> None:
+        self.jwks = list(jwks)
+        self.n_fetches = 0
+        self.error: Exception | None = None
+        # set to make fetches wait until released
+        self.release: threading.Event | None = None
+        self.fetched = threading.Event()
+
+    def fetch(self, url: str) -> dict:
+        assert url == URL
+        self.n_fetches += 1
+        if self.release is not None:
+            self.release.wait()
+        self.fetched.set()
+        if self.error is not None:
+            raise self.error
+        return {"keys": list(self.jwks)}
+
+
+def test_keys_cached_and_rotated():
+    """Ensure keys are fetched once and unknown key IDs refetch them."""
+    private_a, jwk_a = make_key("a")
+    provider = FakeProvider(jwk_a)
+    keys = KeySet(URL, provider.fetch, ttl=60, max_stale=60, min_refetch=60)
+    token = jwt.encode({"sub": "1"}, private_a, "RS256", {"kid": "a"})
+    for _ in range(3):
+        decoded = jwt.decode(token, keys.get("a"), algorithms=["RS256"])
+        assert decoded == {"sub": "1"}
+    assert provider.n_fetches == 1
+    # a rotated in key is not fetched until the refetch interval passes
+    _, jwk_b = make_key("b")
+    provider.jwks.append(jwk_b)
+    with pytest.raises(KeyError):
+        keys.get("b")
+    assert provider.n_fetches == 1
+    keys.min_refetch = 0
+    assert keys.get("b") is not None
+    assert provider.n_fetches == 2
+    with pytest.raises(KeyError):
+        keys.get("c")
+    assert provider.n_fetches == 3
+
+
+def test_stale_keys_served_while_refreshing():
+    """Ensure stale keys are served while a background thread refetches."""
+    _, jwk_a = make_key("a")
+    provider = FakeProvider(jwk_a)
+    keys = KeySet(URL, provider.fetch, ttl=0, max_stale=60, min_refetch=0)
+    key = keys.get("a")
+    provider.release = threading.Event()
+    provider.fetched.clear()
+    # the refresh is blocked, so these are served from the stale keys
+    assert keys.get("a") is key
+    assert keys.get("a") is key
+    provider.release.set()
+    provider.fetched.wait(5)
+    # only one refresh was started
+    assert provider.n_fetches == 2
+
+
+def test_fetch_failures():
+    """Ensure failed fetches raise only when no usable keys are cached."""
+    _, jwk_a = make_key("a")
+    provider = FakeProvider(jwk_a)
+    provider.error = requests.ConnectionError()
+    keys = KeySet(URL, provider.fetch, ttl=0, max_stale=60, min_refetch=60)
+    with pytest.raises(KeysUnavailable):
+        keys.get("a")
+    # logins fail fast until the refetch interval passes
+    provider.error = None
+    with pytest.raises(KeysUnavailable):
+        keys.get("a")
+    assert provider.n_fetches == 1
+    keys.min_refetch = 0
+    key = keys.get("a")
+    provider.error = requests.ConnectionError()
+    provider.fetched.clear()
+    keys.min_refetch = 0
+    assert keys.get("a") is key
+    provider.fetched.wait(5)
+    assert keys.get("a") is key
+    # keys too stale to serve are fetched first
+    keys.max_stale = 0
+    with pytest.raises(KeysUnavailable):
+        keys.get("a")
+    # and are not refetched by every login while the provider is down
+    n_fetches = provider.n_fetches
+    keys.min_refetch = 60
+    for _ in range(3):
+        with pytest.raises(KeysUnavailable):
+            keys.get("a")
+    assert provider.n_fetches == n_fetches
+    # unknown key IDs are rejected without a fetch as well
+    keys.max_stale = 60
+    with pytest.raises(KeyError):
+        keys.get("b")
+    assert provider.n_fetches == n_fetches
+
+
+def make_cert(private: rsa.RSAPrivateKey) -> str:
+    """:return: a self-signed PEM certificate of a private key"""
+    name = x509.Name([x509.NameAttribute(NameOID.COMMON_NAME, "test")])
+    now = datetime.datetime.utcnow()
+    cert = (
+        x509.CertificateBuilder()
+        .subject_name(name)
+        .issuer_name(name)
+        .public_key(private.public_key())
+        .serial_number(1)
+        .not_valid_before(now - datetime.timedelta(days=1))
+        .not_valid_after(now + datetime.timedelta(days=1))
+        .sign(private, hashes.SHA256())
+    )
+    return cert.public_bytes(serialization.Encoding.PEM).decode()
+
+
+def test_google_tokens(monkeypatch):
+    """Ensure google-auth verifies Google tokens against cached certs."""
+    private = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+    fetches = []
+
+    def fetch(url: str) -> dict:
+        fetches.append(url)
+        return {"g": make_cert(private)}
+
+    keys = KeySet(
+        jwks.GOOGLE_CERTS_URL,
+        fetch,
+        jwks.parse_certs,
+        ttl=60,
+        max_stale=60,
+        min_refetch=60,
+    )
+    monkeypatch.setattr(jwks, "google_keys", keys)
+    now = int(time.time())
+    claims = {
+        "iss": "https://accounts.google.com",
+        "aud": G_CLIENT_IDS[0],
+        "sub": "gid",
+        "email": "google@email.com",
+        "name": "Google User",
+        "iat": now,
+        "exp": now + 3600,
+    }
+
+    def sign(**changes) -> str:
+        return jwt.encode(
+            {**claims, **changes}, private, "RS256", {"kid": "g"}
+        )
+
+    token = sign()
+    for _ in range(3):
+        idinfo = id_token.verify_oauth2_token(
+            token, CachedCertsRequest(keys, "g"), G_CLIENT_IDS
+        )
+        assert idinfo["sub"] == "gid"
+    assert fetches == [jwks.GOOGLE_CERTS_URL]
+    rejected = (
+        sign(aud="another client"),
+        sign(iss="https://accounts.example.com"),
+        sign(iat=now - 7200, exp=now - 3600),
+        jwt.encode(claims, private, "RS256", {"kid": "unknown"}),
+        "not a token",
+    )
+    for token in rejected:
+        with pytest.raises(LoginError) as e_info:
+            login_w_google(token)
+        assert e_info.value.code == 401
+    assert len(fetches) == 1
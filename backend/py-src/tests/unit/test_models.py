@@ -1,7 +1,12 @@
 """Unit tests for application models."""
+
 import pytest
-from sqlalchemy import or_
+from sqlalchemy import and_, or_
+from app import settings
 from app.models import (
+    LoginMethods,
+    TimelineEntry,
+    UploadViewer,
     User,
     UserRelationship,
     RelationshipType,
@@ -9,6 +14,7 @@ from app.models import (
     VisibilityDefault,
     Bucket,
     Comment,
+    _changed_buckets,
 )
 
 
@@ -92,6 +98,40 @@ def test_n_uploads(db):
     assert user_2.can_view_upload(upload_3)
 
 
+def test_unshare_with_all(db, monkeypatch):
+    """Ensure unsharing refreshes the visibility index and timelines."""
+    monkeypatch.setattr(settings, "VISIBILITY_INDEX", True)
+    owner = User("Owner", "owner@email.com", google_id="test1")
+    viewer = User("Viewer", "viewer@email.com", google_id="test2")
+    add_and_commit(db, owner, viewer)
+    # timelines only hold the uploads of courted users
+    add_and_commit(
+        db,
+        UserRelationship(
+            user_a_id=owner.id,
+            user_b_id=viewer.id,
+            type=RelationshipType.FRIENDS,
+        ),
+    )
+    bucket = Bucket(user_id=owner.id, name="bucket")
+    add_and_commit(db, bucket)
+    upload = Upload(
+        filename="test.mp4",
+        display_title="Shared",
+        user_id=owner.id,
+        bucket_id=bucket.id,
+        visibility=VisibilityDefault.PRIVATE,
+    )
+    add_and_commit(db, upload)
+    upload.share_with([viewer])
+    assert UploadViewer.query.filter_by(viewer_id=viewer.id).count() == 1
+    assert TimelineEntry.query.filter_by(viewer_id=viewer.id).count() == 1
+    upload.unshare_with_all()
+    assert UploadViewer.find_inconsistencies([owner, viewer]) == {}
+    assert UploadViewer.query.filter_by(viewer_id=viewer.id).count() == 0
+    assert TimelineEntry.query.filter_by(viewer_id=viewer.id).count() == 0
+
+
 def test_delete_user(db):
     """Ensure user deletion cascades at the database level.
 
@@ -186,3 +226,317 @@ def test_delete_user(db):
         ).count()
         == 0
     )
+
+
+def test_serialize_many(db):
+    """Ensure batch serialization agrees with the per-user count helpers."""
+    user_1 = User("User 1", "user1@email.com", google_id="test1")
+    user_2 = User("User 2", "user2@email.com", google_id="test2")
+    user_3 = User("User 3", "user3@email.com", google_id="test3")
+    add_and_commit(db, user_1, user_2, user_3)
+    u1_bucket = Bucket(user_id=user_1.id, name="User 1's bucket")
+    add_and_commit(db, u1_bucket)
+    add_and_commit(
+        db,
+        Upload(
+            filename="test.mp4",
+            display_title="Test upload 1",
+            user_id=user_1.id,
+            bucket_id=u1_bucket.id,
+            visibility=VisibilityDefault.COACHES_ONLY,
+        ),
+    )
+    # user_1 coaches user_2, user_1 is friends with user_3,
+    # user_2 has a pending friend request to user_3
+    add_and_commit(
+        db,
+        UserRelationship(
+            user_a_id=user_1.id,
+            user_b_id=user_2.id,
+            type=RelationshipType.A_COACHES_B,
+        ),
+        UserRelationship(
+            user_a_id=user_3.id,
+            user_b_id=user_1.id,
+            type=RelationshipType.FRIENDS,
+        ),
+        UserRelationship(
+            user_a_id=user_2.id,
+            user_b_id=user_3.id,
+            type=RelationshipType.FRIEND_REQUESTED,
+        ),
+    )
+    User.recount_courtships()
+    db.session.commit()
+    users = [user_1, user_2, user_3]
+    for client in users:
+        serialized = User.serialize_many(users, client)
+        assert [s["id"] for s in serialized] == [u.id for u in users]
+        for user, s in zip(users, serialized):
+            assert s["n_uploads"] == user.n_uploads_visible_to(client)
+            assert s["n_courtships"] == {
+                "friends": user.count_friends(),
+                "coaches": user.count_coaches(),
+                "students": user.count_students(),
+            }
+            rel = client.get_relationship_with(user)
+            expected = None if rel is None else rel.serialize(client)
+            assert s["courtship"] == expected
+            assert ("email" in s) == (user.id == client.id)
+    assert User.serialize_many([], user_1) == []
+
+
+def test_courtship_counts(db):
+    """Ensure denormalized courtship counts follow relationship changes."""
+    coach = User("Coach", "coach@email.com", google_id="test1")
+    student = User("Student", "student@email.com", google_id="test2")
+    friend = User("Friend", "friend@email.com", google_id="test3")
+    add_and_commit(db, coach, student, friend)
+    coaching = UserRelationship(
+        user_a_id=coach.id,
+        user_b_id=student.id,
+        type=RelationshipType.A_COACHES_B,
+    )
+    friendship = UserRelationship(
+        user_a_id=friend.id,
+        user_b_id=coach.id,
+        type=RelationshipType.FRIENDS,
+    )
+    add_and_commit(db, coaching, friendship)
+    coaching.update_counts(1)
+    friendship.update_counts(1)
+    db.session.commit()
+    assert (coach.n_friends, coach.n_coaches, coach.n_students) == (1, 0, 1)
+    assert (student.n_friends, student.n_coaches) == (0, 1)
+    assert friend.n_friends == 1
+    # the bulk repair agrees with the incremental counts
+    User.recount_courtships()
+    db.session.commit()
+    assert (coach.n_friends, coach.n_coaches, coach.n_students) == (1, 0, 1)
+    # removing the coach releases the counts of everyone they court
+    coach.leave_courtships()
+    db.session.delete(coach)
+    db.session.commit()
+    assert student.n_coaches == 0
+    assert friend.n_friends == 0
+
+
+def test_courtships_cache(db, statements):
+    """Ensure courtships are loaded once per request and forgotten when a
+    relationship changes."""
+    user_1 = User("User 1", "user1@email.com", google_id="test1")
+    user_2 = User("User 2", "user2@email.com", google_id="test2")
+    user_3 = User("User 3", "user3@email.com", google_id="test3")
+    add_and_commit(db, user_1, user_2, user_3)
+    add_and_commit(
+        db,
+        UserRelationship(
+            user_a_id=user_1.id,
+            user_b_id=user_2.id,
+            type=RelationshipType.A_COACHES_B,
+        ),
+        UserRelationship(
+            user_a_id=user_3.id,
+            user_b_id=user_1.id,
+            type=RelationshipType.FRIEND_REQUESTED,
+        ),
+    )
+    statements.clear()
+    courtships = user_1.courtships
+    assert courtships.students == {user_2.id}
+    assert courtships.pending == {user_3.id}
+    assert user_1.coaches(user_2.id)
+    assert user_2.student_of(user_1.id)
+    assert not user_1.friends_with(user_3.id)
+    assert user_1.has_courtship_with(user_3.id)
+    assert user_1.courtships.get(user_3.id).serialize(user_1) == {
+        "type": "friend-req",
+        "dir": "in",
+    }
+    # one query for each user's courtships
+    assert sum("FROM user_relationship" in s for s in statements) == 2
+    rel = user_3.get_relationship_with(user_1)
+    rel.type = RelationshipType.FRIENDS
+    db.session.commit()
+    assert user_1.friends_with(user_3.id)
+    assert user_1.courtships.pending == set()
+
+
+def test_bucket_summaries(db, statements):
+    """Ensure cached bucket summaries match each viewer's visible uploads and
+    are forgotten when uploads change."""
+    owner = User("Owner", "owner@email.com", google_id="test1")
+    coach = User("Coach", "coach@email.com", google_id="test2")
+    friend = User("Friend", "friend@email.com", google_id="test3")
+    stranger = User("Stranger", "stranger@email.com", google_id="test4")
+    add_and_commit(db, owner, coach, friend, stranger)
+    add_and_commit(
+        db,
+        UserRelationship(
+            user_a_id=coach.id,
+            user_b_id=owner.id,
+            type=RelationshipType.A_COACHES_B,
+        ),
+        UserRelationship(
+            user_a_id=owner.id,
+            user_b_id=friend.id,
+            type=RelationshipType.FRIENDS,
+        ),
+    )
+    bucket = Bucket(user_id=owner.id, name="bucket")
+    other_bucket = Bucket(user_id=owner.id, name="other")
+    add_and_commit(db, bucket, other_bucket)
+    uploads = {
+        v: Upload(
+            filename="test.mp4",
+            display_title=v.name,
+            user_id=owner.id,
+            bucket_id=bucket.id,
+            visibility=v,
+        )
+        for v in VisibilityDefault
+    }
+    add_and_commit(db, *uploads.values())
+    uploads[VisibilityDefault.PRIVATE].share_with([stranger])
+    viewers = (owner, coach, friend, stranger)
+
+    def sizes():
+        return [bucket.serialize(v)["size"] for v in viewers]
+
+    def check():
+        for viewer in viewers:
+            assert bucket.serialize(viewer)["size"] == (
+                Upload.query.filter(
+                    and_(
+                        Upload.bucket_id == bucket.id,
+                        Upload.viewable_to(viewer),
+                    )
+                ).count()
+            )
+
+    assert sizes() == [5, 3, 3, 2]
+    check()
+    # summaries are read from the cache
+    statements.clear()
+    sizes()
+    assert not any("GROUP BY upload.bucket_id" in s for s in statements)
+    # visibility edits, moves, deletes and creates are seen
+    uploads[VisibilityDefault.FRIENDS_ONLY].visibility = (
+        VisibilityDefault.COACHES_ONLY
+    )
+    # only bucket IDs, never the old visibility
+    assert _changed_buckets(db.session) == {bucket.id}
+    db.session.commit()
+    assert sizes() == [5, 4, 2, 2]
+    uploads[VisibilityDefault.PUBLIC].bucket_id = other_bucket.id
+    assert _changed_buckets(db.session) == {bucket.id, other_bucket.id}
+    db.session.commit()
+    assert sizes() == [4, 3, 1, 1]
+    assert other_bucket.serialize(stranger)["size"] == 1
+    db.session.delete(uploads[VisibilityDefault.COACHES_ONLY])
+    db.session.commit()
+    assert sizes() == [3, 2, 1, 1]
+    add_and_commit(
+        db,
+        Upload(
+            filename="test.mp4",
+            display_title="new",
+            user_id=owner.id,
+            bucket_id=bucket.id,
+            visibility=VisibilityDefault.PUBLIC,
+        ),
+    )
+    assert sizes() == [4, 3, 2, 2]
+    check()
+
+
+def test_visible_buckets(db, statements):
+    """Ensure the visible buckets query agrees with can_view_bucket and
+    serialization and runs a single statement."""
+    coach = User("Coach", "coach@email.com", google_id="test0")
+    add_and_commit(db, coach)
+    students = [
+        User(f"Student {i}", f"student{i}@email.com", google_id=f"test{i}")
+        for i in range(1, 4)
+    ]
+    add_and_commit(db, *students)
+    add_and_commit(
+        db,
+        *(
+            UserRelationship(
+                user_a_id=coach.id,
+                user_b_id=s.id,
+                type=RelationshipType.A_COACHES_B,
+            )
+            for s in students
+        ),
+    )
+    buckets = []
+    for student in students:
+        for visibility in (
+            None,
+            VisibilityDefault.PRIVATE,
+            VisibilityDefault.FRIENDS_ONLY,
+            VisibilityDefault.COACHES_ONLY,
+            VisibilityDefault.PUBLIC,
+        ):
+            bucket = Bucket(user_id=student.id, name=str(visibility))
+            add_and_commit(db, bucket)
+            buckets.append(bucket)
+            if visibility is not None:
+                add_and_commit(
+                    db,
+                    Upload(
+                        filename="test.mp4",
+                        display_title="Test",
+                        user_id=student.id,
+                        bucket_id=bucket.id,
+                        visibility=visibility,
+                    ),
+                )
+    for viewer in (coach, *students):
+        # courtships are loaded once per request, before any bucket query
+        viewer.courtships
+        statements.clear()
+        rows = Bucket.visible_to(viewer).all()
+        assert len(statements) == 1
+        assert {b.id for b, _, _ in rows} == {
+            b.id for b in buckets if viewer.can_view_bucket(b)
+        }
+        visible = [b for b, _, _ in rows]
+        assert [
+            b.serialize_summary(size, last_created)
+            for b, size, last_created in rows
+        ] == Bucket.serialize_many(visible, viewer)
+    # the coach sees the coaches-only and public buckets of each student
+    assert Bucket.visible_to(coach).count() == 2 * len(students)
+
+
+def test_load_cached(db, statements):
+    """Ensure authenticated users are loaded without a query once cached and
+    are forgotten when they change."""
+    user = User("User", "user@email.com", password_hash="abc")
+    add_and_commit(db, user)
+    user_id = user.id
+    statements.clear()
+    assert User.load_cached(user_id).email_confirmed is False
+    assert len(statements) == 1
+    # a later request attaches the cached user without a query
+    db.session.remove()
+    statements.clear()
+    cached = User.load_cached(user_id)
+    assert cached.login_method == LoginMethods.EMAIL
+    assert cached.email_confirmed is False
+    assert len(statements) == 0
+    # other columns are loaded on demand
+    assert cached.username == user.username
+    assert len(statements) == 1
+    # changes are seen by the next request
+    cached.email_confirmed = True
+    db.session.commit()
+    db.session.remove()
+    assert User.load_cached(user_id).email_confirmed is True
+    db.session.delete(User.query.get(user_id))
+    db.session.commit()
+    db.session.remove()
+    assert User.load_cached(user_id) is None
@@ -0,0 +1,15 @@
+"""Unit tests for password hashing."""
+
+from app.passwords import PasswordHasher
+
+
+def test_hashes_verify():
+    """Ensure hashes use the configured cost and verify."""
+    hasher = PasswordHasher(rounds=4)
+    h = hasher.hash("Password1!")
+    assert h.startswith("$2b$04$")
+    assert hasher.verify("Password1!", h)
+    assert not hasher.verify("Password2!", h)
+    stats = hasher.stats.snapshot()
+    assert stats["n_hashed"] == 3
+    assert stats["max_secs"] >= stats["mean_secs"] > 0
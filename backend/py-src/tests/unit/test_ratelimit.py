@@ -0,0 +1,38 @@
+"""Unit tests for the token bucket rate limits."""
+
+import time
+
+from app.ratelimit import DBBuckets, MemoryBuckets, RateLimit
+
+
+def check_limit(limit: RateLimit) -> None:
+    """Ensure a limit with a capacity of 2 allows a burst of 2 per key."""
+    assert limit.take(1) == 0
+    assert limit.take(1) == 0
+    assert 0 < limit.take(1) <= limit.interval
+    assert limit.take(2) == 0
+
+
+def test_memory_buckets():
+    """Ensure in-memory buckets refill and forget full buckets."""
+    check_limit(RateLimit("test", 2, 60, MemoryBuckets()))
+    buckets = MemoryBuckets(max_size=1)
+    limit = RateLimit("test", 1, 0.01, buckets)
+    assert limit.take(1) == 0
+    assert limit.take(1) == 1
+    time.sleep(0.02)
+    # the refilled bucket is forgotten to make room for the next key
+    assert limit.take(2) == 0
+    assert list(buckets._full_at) == ["test:2"]
+
+
+def test_db_buckets(db):
+    """Ensure DB buckets are shared and follow the caller's transaction."""
+    check_limit(RateLimit("test", 2, 60, DBBuckets()))
+    limit = RateLimit("other", 1, 60, DBBuckets())
+    assert limit.take(1) == 0
+    # rolling back gives the token back
+    db.session.rollback()
+    assert limit.take(1) == 0
+    db.session.commit()
+    assert limit.take(1) == 60
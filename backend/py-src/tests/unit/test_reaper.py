@@ -0,0 +1,45 @@
+"""Unit tests for the tombstone reaper."""
+
+import datetime
+
+from app.models import UploadTombstone
+from app.reaper import reap_tombstones, tombstone_backlog
+
+
+def test_reap_tombstones(db, fake_s3):
+    """Ensure due tombstones are deleted from S3 and then removed."""
+    for id in range(1, 6):
+        fake_s3.put_keys(f"uploads/{id}/hls/{i}.ts" for i in range(10))
+    UploadTombstone.bury([1, 2, 3])
+    db.session.commit()
+    assert tombstone_backlog()["n_pending"] == 3
+    assert reap_tombstones(batch_size=2) == 3
+    assert tombstone_backlog()["n_pending"] == 0
+    assert all(
+        k.startswith(("uploads/4/", "uploads/5/")) for k in fake_s3.keys
+    )
+    assert len(fake_s3.keys) == 20
+
+
+def test_reap_tombstones_retries(db, fake_s3):
+    """Ensure failed deletions are retried later with backoff."""
+    fake_s3.put_keys(["uploads/1/a.mp4", "uploads/1/b.mp4"])
+    fake_s3.undeletable.add("uploads/1/b.mp4")
+    UploadTombstone.bury([1])
+    db.session.commit()
+    assert reap_tombstones() == 0
+    (tombstone,) = UploadTombstone.query.all()
+    assert tombstone.attempts == 1
+    assert "uploads/1/b.mp4" in tombstone.last_error
+    assert tombstone.next_attempt > datetime.datetime.utcnow()
+    # the tombstone is not due yet
+    n_requests = fake_s3.n_requests
+    assert reap_tombstones() == 0
+    assert fake_s3.n_requests == n_requests
+    # once due, a successful retry removes it
+    fake_s3.undeletable.clear()
+    tombstone.next_attempt = datetime.datetime.utcnow()
+    db.session.commit()
+    assert reap_tombstones() == 1
+    assert UploadTombstone.query.count() == 0
+    assert len(fake_s3.keys) == 0
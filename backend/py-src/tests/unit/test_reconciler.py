@@ -0,0 +1,61 @@
+"""Unit tests for the MediaConvert status reconciler."""
+
+from app import aws
+from app.models import User, Upload, VisibilityDefault, Bucket
+from app.reconciler import reconcile_convert_statuses
+
+
+def add_converting_uploads(db, fake_mediaconvert, n: int) -> list[Upload]:
+    """Create a user with n uploads whose convert jobs were just submitted."""
+    user = User("User 1", "user1@email.com", google_id="test1")
+    db.session.add(user)
+    db.session.commit()
+    bucket = Bucket(user_id=user.id, name="bucket")
+    db.session.add(bucket)
+    db.session.commit()
+    uploads = []
+    for i in range(n):
+        up = Upload(
+            filename="test.mp4",
+            display_title=f"Test upload {i}",
+            user_id=user.id,
+            bucket_id=bucket.id,
+            visibility=VisibilityDefault.PRIVATE,
+        )
+        up.mediaconvert_job_id = aws.create_mediaconvert_job(i, "test.mp4")
+        up.set_convert_status(aws.ConvertStatus.SUBMITTED)
+        uploads.append(up)
+    db.session.add_all(uploads)
+    db.session.commit()
+    return uploads
+
+
+def test_reconcile(db, fake_mediaconvert):
+    """Ensure finished jobs are recorded and only unfinished jobs are polled."""
+    uploads = add_converting_uploads(db, fake_mediaconvert, 5)
+    # nothing has changed yet
+    assert reconcile_convert_statuses(batch_size=2) == 0
+    assert fake_mediaconvert.n_get_job_calls == 5
+    # finish some jobs
+    fake_mediaconvert.set_status(uploads[0].mediaconvert_job_id, "COMPLETE")
+    fake_mediaconvert.set_status(uploads[1].mediaconvert_job_id, "ERROR")
+    fake_mediaconvert.set_status(uploads[2].mediaconvert_job_id, "PROGRESSING")
+    assert reconcile_convert_statuses(batch_size=2) == 3
+    assert uploads[0].stream_ready
+    assert uploads[1].mediaconvert_status == aws.ConvertStatus.ERROR
+    assert not uploads[1].stream_ready
+    assert not uploads[2].stream_ready
+    # finished jobs are never polled again
+    fake_mediaconvert.n_get_job_calls = 0
+    assert reconcile_convert_statuses(batch_size=2) == 0
+    assert fake_mediaconvert.n_get_job_calls == 3
+
+
+def test_serialize_is_read_only(db, fake_mediaconvert):
+    """Ensure serializing a converting upload does not poll MediaConvert."""
+    (upload,) = add_converting_uploads(db, fake_mediaconvert, 1)
+    fake_mediaconvert.set_status(upload.mediaconvert_job_id, "COMPLETE")
+    assert not upload.serialize(upload.user)["stream_ready"]
+    assert fake_mediaconvert.n_get_job_calls == 0
+    reconcile_convert_statuses()
+    assert upload.serialize(upload.user)["stream_ready"]
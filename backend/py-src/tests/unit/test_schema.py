@@ -0,0 +1,72 @@
+"""Unit tests for upgrading databases created before the current models."""
+
+from sqlalchemy import text
+
+from app.models import (
+    Bucket,
+    RelationshipType,
+    TimelineEntry,
+    Upload,
+    User,
+    UserRelationship,
+    VisibilityDefault,
+)
+from app.schema import upgrade_schema
+
+# undoes everything added to the tables that existed before the upgrade
+DOWNGRADE = (
+    'ALTER TABLE "user" DROP COLUMN n_friends, DROP COLUMN n_coaches, '
+    "DROP COLUMN n_students",
+    "ALTER TABLE upload DROP COLUMN mediaconvert_status",
+    "DROP TYPE convertstatus",
+    "DROP INDEX ix_user_relationship_user_b_id",
+    "DROP TABLE timeline_entry",
+    "DROP INDEX IF EXISTS ix_user_username_prefix",
+)
+
+
+def test_upgrade_schema(db):
+    """Ensure an old database gains the new columns and derived data."""
+    owner = User("Owner", "owner@email.com", google_id="test1")
+    friend = User("Friend", "friend@email.com", google_id="test2")
+    db.session.add_all([owner, friend])
+    db.session.commit()
+    bucket = Bucket(name="bucket", user_id=owner.id)
+    db.session.add(bucket)
+    db.session.commit()
+    db.session.add_all(
+        [
+            UserRelationship(
+                user_a_id=owner.id,
+                user_b_id=friend.id,
+                type=RelationshipType.FRIENDS,
+            ),
+            Upload(
+                filename="test.mp4",
+                display_title="Upload",
+                user_id=owner.id,
+                bucket_id=bucket.id,
+                visibility=VisibilityDefault.FRIENDS_ONLY,
+            ),
+        ]
+    )
+    db.session.commit()
+    owner_id, friend_id = owner.id, friend.id
+    for ddl in DOWNGRADE:
+        db.session.execute(text(ddl))
+    db.session.commit()
+    db.session.expunge_all()
+    steps = upgrade_schema()
+    assert "Built the feed timelines." in steps
+    assert db.session.execute(
+        text("SELECT to_regclass('ix_user_username_prefix')")
+    ).scalar()
+    assert User.query.get(owner_id).n_friends == 1
+    assert User.query.get(friend_id).n_friends == 1
+    assert Upload.query.one().mediaconvert_status is None
+    (entry,) = TimelineEntry.query.all()
+    assert entry.viewer_id == friend_id
+    # running it again changes nothing
+    assert "Built the feed timelines." not in upgrade_schema()
+    assert TimelineEntry.query.count() == 1
+    assert User.query.get(owner_id).n_friends == 1
@@ -0,0 +1,51 @@
+"""Unit tests for user search."""
+
+from sqlalchemy.dialects import postgresql
+
+from app.models import User
+from app.search import _tiers, search_users
+
+
+def test_search_ranking(db):
+    """Ensure better matches rank first and LIKE wildcards are literal."""
+    client = User("Client", "client@email.com", "client", google_id="0")
+    users = [
+        User("Zed", "zed@email.com", "bobby", google_id="1"),
+        User("Bob Smith", "smith@email.com", "smith", google_id="2"),
+        User("Rob", "rob@email.com", "bob", google_id="3"),
+        User("Alice", "alice@email.com", "alice", google_id="4"),
+        User("Bo_b", "under@email.com", "under", google_id="5"),
+        User("Bobcat", "bobcat@email.com", "bobcat", google_id="6"),
+    ]
+    db.session.add_all([client, *users])
+    db.session.commit()
+    matches = search_users(" BOB", client, False, 10)
+    assert [(m.user.username, m.tier) for m in matches] == [
+        ("bob", 0),
+        ("bobby", 1),
+        ("bobcat", 1),
+        ("smith", 2),
+    ]
+    # matching resumes after a match, across tiers
+    after = search_users("bob", client, False, 2)
+    assert after[-1].user.username == "bobby"
+    resumed = search_users("bob", client, False, 10, after[-1].sort_key)
+    assert [m.user.username for m in resumed] == ["bobcat", "smith"]
+    # the searcher is never found
+    assert search_users("client", client, False, 10) == []
+    matches = search_users("bo_", client, False, 10)
+    assert [m.user.username for m in matches] == ["under"]
+
+
+def test_search_trigram_query():
+    """Ensure substring and fuzzy tiers are only added for longer queries."""
+    dialect = postgresql.psycopg2.dialect()
+
+    def compiled(q):
+        return [
+            str(predicate.compile(dialect=dialect))
+            for predicate, _ in _tiers(q, trigrams=True)
+        ]
+
+    assert not any("username %% " in sql for sql in compiled("sm"))
+    assert any("username %% " in sql for sql in compiled("smi"))
@@ -0,0 +1,134 @@
+"""Unit tests for the CloudFront signing service."""
+
+import datetime
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from cryptography.hazmat.primitives import hashes, serialization
+from cryptography.hazmat.primitives.asymmetric import padding, rsa
+
+from app import aws
+from app.aws import CloudFrontSigningService
+from app.cookiesigner import CookieSigner
+
+
+def generate_pem():
+    """:return: a new RSA private key and its PEM encoding"""
+    key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+    pem = key.private_bytes(
+        serialization.Encoding.PEM,
+        serialization.PrivateFormat.PKCS8,
+        serialization.NoEncryption(),
+    )
+    return key, pem
+
+
+def test_key_loaded_once(monkeypatch):
+    """Ensure the PEM is parsed once no matter how many threads sign."""
+    key, pem = generate_pem()
+    n_loads = 0
+    load = serialization.load_pem_private_key
+
+    def counting_load(*args, **kwargs):
+        nonlocal n_loads
+        n_loads += 1
+        return load(*args, **kwargs)
+
+    monkeypatch.setattr(
+        aws.serialization, "load_pem_private_key", counting_load
+    )
+    service = CloudFrontSigningService(pem, "KEYID")
+    messages = [f"message {i}".encode() for i in range(20)]
+    with ThreadPoolExecutor(4) as pool:
+        signatures = list(pool.map(service.sign, messages))
+    assert n_loads == 1
+    # signatures verify with the public key
+    for message, signature in zip(messages, signatures):
+        key.public_key().verify(
+            signature, message, padding.PKCS1v15(), hashes.SHA1()
+        )
+    stats = service.stats()
+    assert stats["n_signatures"] == 20
+    assert stats["signatures_per_sec"] > 0
+
+
+def test_presigned_url():
+    """Ensure presigned URLs carry the key ID and a signature."""
+    _, pem = generate_pem()
+    service = CloudFrontSigningService(pem, "KEYID")
+    expiration = datetime.datetime.utcnow() + datetime.timedelta(hours=1)
+    url = service.generate_presigned_url("https://cdn/x.jpg", expiration)
+    assert url.startswith("https://cdn/x.jpg?")
+    assert "Key-Pair-Id=KEYID" in url and "Signature=" in url
+    assert service.stats()["n_signatures"] == 1
+
+
+def test_windowed_urls(monkeypatch):
+    """Ensure signed URLs are reused within a window and expire after it."""
+    aws._signed_urls.clear()
+    now = 1_000_000 * aws.SIGNED_URL_WINDOW_SECS
+    monkeypatch.setattr(aws.time, "time", lambda: now)
+    n_signatures = aws.cf_signing.n_signatures
+    first = aws.get_thumbnail_url("1", expiration_in_hours=1)
+    assert aws.get_thumbnail_url("1", expiration_in_hours=1) == first
+    assert aws.cf_signing.n_signatures == n_signatures + 1
+    # a different object gets a different URL
+    assert aws.get_thumbnail_url("2", expiration_in_hours=1) != first
+    # the URL expires at the end of the window plus the requested duration
+    expires = (1_000_001 * aws.SIGNED_URL_WINDOW_SECS) + 3600
+    assert f"Expires={expires}" in first
+    # later in the same window the URL is reused
+    now += aws.SIGNED_URL_WINDOW_SECS - 1
+    assert aws.get_thumbnail_url("1", expiration_in_hours=1) == first
+    # the next window gets a fresh URL
+    now += 1
+    assert aws.get_thumbnail_url("1", expiration_in_hours=1) != first
+
+
+def test_cookies_cover():
+    """Ensure existing cookies are only reused while valid for the URL."""
+    signer = CookieSigner(expiration_in_hrs=1, cf_key_id=aws.CF_PUBLIC_KEY_ID)
+    cookies = signer.generate_signed_cookies("https://cdn/uploads/1/hls/*")
+    assert signer.cookies_cover(cookies, "https://cdn/uploads/1/hls/a.ts", 60)
+    assert not signer.cookies_cover(
+        cookies, "https://cdn/uploads/2/hls/a.ts", 60
+    )
+    # cookies about to expire are not reused
+    assert not signer.cookies_cover(
+        cookies, "https://cdn/uploads/1/hls/a.ts", 2 * 3600
+    )
+    # cookies signed with another key or mangled are not reused
+    other_key = CookieSigner(expiration_in_hrs=1, cf_key_id="OTHER")
+    assert not other_key.cookies_cover(
+        cookies, "https://cdn/uploads/1/hls/a.ts", 60
+    )
+    mangled = dict(cookies, **{"CloudFront-Policy": "abc"})
+    assert not signer.cookies_cover(
+        mangled, "https://cdn/uploads/1/hls/a.ts", 60
+    )
+
+
+def test_windowed_cookies(monkeypatch):
+    """Ensure an upload's cookies are signed once per window."""
+    signer = CookieSigner(
+        expiration_in_hrs=1,
+        cf_key_id=aws.CF_PUBLIC_KEY_ID,
+        window_secs=900,
+        cache_size=10,
+    )
+    now = 1_000_000 * 900
+    monkeypatch.setattr(time, "time", lambda: now)
+    n_signatures = aws.cf_signing.n_signatures
+    first = signer.generate_signed_cookies("https://cdn/uploads/1/hls/*")
+    assert signer.generate_signed_cookies("https://cdn/uploads/1/hls/*") == (
+        first
+    )
+    assert aws.cf_signing.n_signatures == n_signatures + 1
+    # cookies only cover the upload they were signed for
+    other = signer.generate_signed_cookies("https://cdn/uploads/2/hls/*")
+    assert not signer.cookies_cover(other, "https://cdn/uploads/1/hls/a", 60)
+    # the next window gets fresh cookies
+    now += 900
+    assert signer.generate_signed_cookies("https://cdn/uploads/1/hls/*") != (
+        first
+    )